@@ -0,0 +1,27 @@
+#!/usr/bin/env python
+
+import logging
+
+import fire
+from src import benchmarks
+
+FORMAT = '%(levelname)s %(asctime)-15s %(name)-20s %(message)s'
+logging.basicConfig(level=logging.INFO, format=FORMAT)
+
+
+def main():
+    fire.Fire({
+        'populate': benchmarks.populate_build_time,
+        'window_sizes': benchmarks.window_sizes,
+        'quantization_drift': benchmarks.quantization_drift,
+        'storage_formats': benchmarks.storage_formats,
+        'inference_engines': benchmarks.inference_engines,
+        'memory_efficient': benchmarks.memory_efficient,
+        'cpu_scaling': benchmarks.cpu_scaling,
+        'model_startup': benchmarks.model_startup,
+        'import_time': benchmarks.import_time,
+    })
+
+
+if __name__ == "__main__":
+    main()
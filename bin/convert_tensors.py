@@ -0,0 +1,38 @@
+#!/usr/bin/env python
+
+import argparse
+import logging
+
+from src.constants import TENSOR_ENCODINGS, TENSOR_SHARD_SIZE
+from src.dataloaders.tensor_store import pack_tensor_home
+
+FORMAT = '%(levelname)s %(asctime)-15s %(name)-20s %(message)s'
+logging.basicConfig(level=logging.INFO, format=FORMAT)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        prog='Tensor conversion',
+        description='Pack the .pt tensors of each sample into a few shards '
+                    'with an index, e.g. <home>/call/<sample>/freq150',
+    )
+    parser.add_argument('-i', '--tensor_homes', type=str, nargs='+',
+                        required=True)
+    parser.add_argument('-s', '--shard_size', type=int,
+                        default=TENSOR_SHARD_SIZE)
+    parser.add_argument('--remove_originals', action='store_true')
+    parser.add_argument('-e', '--encoding', type=str, default='raw',
+                        choices=TENSOR_ENCODINGS,
+                        help='Store tensors as they are, as float16, as '
+                             'uint8 with per-channel scales, or as their '
+                             'non-zero values (sparse). Use the same '
+                             'encoding for all samples of a run.')
+    args = parser.parse_args()
+
+    for tensor_home in args.tensor_homes:
+        pack_tensor_home(
+            tensor_home,
+            args.shard_size,
+            args.remove_originals,
+            args.encoding
+        )
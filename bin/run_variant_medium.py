@@ -1,13 +1,22 @@
 #!/usr/bin/env python
 
-import fire
-from src.run import Hyperparams
+import sys
 
+from src.run import Hyperparams, parse_command_line
 
 
 def main():
-    fire.Fire(Hyperparams)
+    parsed = parse_command_line(sys.argv[1:])
+    if parsed is None:
+        # imported here, fire is slow to import and only needed for --help
+        # and the command lines parse_command_line leaves to it
+        import fire
+
+        fire.Fire(Hyperparams)
+        return
+    command, init_kwargs, command_kwargs = parsed
+    getattr(Hyperparams(**init_kwargs), command)(**command_kwargs)
 
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
@@ -1,17 +1,18 @@
 import logging
-import numpy as np
-import random
+import os
 import time
 from collections import OrderedDict
-from typing import Text
+from typing import Dict, Text
 
 import torch
+from src.constants import *
+from src.inference import InferenceNetwork, OnnxNetwork, onnx_model_path
 from src.models.densesomatic3d import densesomatic3d
 
 logger = logging.getLogger(__name__)
-random.seed(567497)
-torch.manual_seed(37546)
-np.random.seed(6746549)
+# Weights of the pretrained models loaded, by path: the modification time of
+# the model and its weights, only the latest version of every model is kept.
+_WEIGHTS = {}
 
 
 def select_architecture(hp):
@@ -29,6 +30,7 @@ def select_architecture(hp):
             bn_size=hp.bn_size,
             channels=int((hp.channels - 2) / 2),
             drop_rate=hp.drop_rate,
+            memory_efficient=hp.memory_efficient,
         )
     else:
         raise Exception('Selected architecture {} is not supported'.format(
@@ -36,30 +38,107 @@ def select_architecture(hp):
         ))
 
 
-def initialize_network(hp, network_path: Text = None):
+def normalized_weights_path(network_path: Text) -> Text:
+    """Get the path of the normalized weights next to a pretrained model.
+
+    :param network_path: Path to the pretrained model.
+    :return: Path to the normalized weights.
+    """
+    return os.path.splitext(network_path)[0] + NORMALIZED_WEIGHTS_SUFFIX
+
+
+def load_weights(network_path: Text) -> Dict[Text, torch.Tensor]:
+    """Load the weights of a pretrained model, normalized and on the CPU.
+
+    The weights are normalized once: the DataParallel prefix is stripped from
+    their names and floating point tensors are cast to float32. They are
+    cached next to the model, and rebuilt when the model is newer. Within a
+    process, weights are loaded from disk once per model, until it changes.
+
+    :param network_path: Path to the pretrained model.
+    :return: State dict of the network.
+    """
+    key = os.path.abspath(network_path)
+    mtime = os.stat(network_path).st_mtime_ns
+    if key in _WEIGHTS and _WEIGHTS[key][0] == mtime:
+        return _WEIGHTS[key][1]
+    path = normalized_weights_path(network_path)
+    if os.path.exists(path) and \
+            os.path.getmtime(path) >= os.path.getmtime(network_path):
+        state_dict = torch.load(path, map_location=torch.device('cpu'))
+    else:
+        state_dict = normalize_weights(
+            torch.load(network_path, map_location=torch.device('cpu'))
+        )
+        tmp_path = '{}.{}.tmp'.format(path, os.getpid())
+        try:
+            torch.save(state_dict, tmp_path)
+            os.replace(tmp_path, path)
+            logger.info('Saved normalized weights {}'.format(path))
+        except OSError as e:
+            logger.warning('Could not save normalized weights {}: {}'.format(
+                path, e
+            ))
+    _WEIGHTS[key] = (mtime, state_dict)
+    return state_dict
+
+
+def normalize_weights(
+        state_dict: Dict[Text, torch.Tensor]
+) -> Dict[Text, torch.Tensor]:
+    """Strip the DataParallel prefix from weight names and cast floating point
+    weights to float32.
+
+    :param state_dict: State dict as saved, e.g. from a DataParallel network.
+    :return: Normalized state dict, with contiguous tensors.
+    """
+    normalized = OrderedDict()
+    for name, tensor in state_dict.items():
+        if name.startswith(DATA_PARALLEL_PREFIX):
+            name = name[len(DATA_PARALLEL_PREFIX):]
+        if tensor.is_floating_point():
+            tensor = tensor.float()
+        normalized[name] = tensor.contiguous()
+    return normalized
+
+
+def initialize_network(
+        hp, network_path: Text = None, for_inference: bool = False
+):
     """Initialize the network based on the given parameters.
 
     :param hp: Hyperparameters.
     :param network_path: Path to the pretrained network if there is one.
+    :param for_inference: Prepare the network for inference with the engine
+    in hp.inference_engine, see InferenceNetwork and OnnxNetwork. The
+    onnxruntime engine needs network_path, the export is saved next to it.
     :return: Initialized network, loaded with pretrained weights if given.
     """
     start_time = time.time()
     network = select_architecture(hp)
     if network_path:
         logger.info('Loading pretrained network {}'.format(network_path))
-        if torch.cuda.is_available():
-            network.load_state_dict(torch.load(network_path), strict=False)
-        else:
-            network.load_state_dict(
-                torch.load(network_path, map_location=torch.device('cpu')),
-                strict=False
+        missing, unexpected = network.load_state_dict(
+            load_weights(network_path), strict=False
+        )
+        if missing or unexpected:
+            logger.warning('Weights not in {}: {}, unused weights: {}'.format(
+                network_path, missing, unexpected
+            ))
+    if for_inference and hp.inference_engine == 'onnxruntime':
+        if not network_path:
+            raise ValueError(
+                'The onnxruntime inference engine needs a pretrained network '
+                'to export, none is given'
             )
-
-        new_state_dict = OrderedDict()
-        for k, v in network.state_dict().items():
-            name = k.replace('module.', '')
-            new_state_dict[name] = v
-        network.load_state_dict(new_state_dict)
+        network = OnnxNetwork(
+            network,
+            onnx_model_path(network_path),
+            network_path,
+            hp.onnx_threads,
+        )
+    elif for_inference and hp.inference_engine != 'eager':
+        network = InferenceNetwork(network, hp.inference_engine)
     logger.info('Initialized network in {} seconds'.format(
         time.time() - start_time
     ))
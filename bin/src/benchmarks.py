@@ -0,0 +1,696 @@
+import logging
+import time
+from typing import Dict, List, Sequence, Text
+
+import numpy as np
+import pandas as pd
+
+from src.constants import *
+
+logger = logging.getLogger(__name__)
+
+
+def synthetic_candidates(num_candidates: int, seed: int = 0) -> pd.DataFrame:
+    """Generate a merged candidate data frame as returned by get_merged_df.
+
+    :param num_candidates: Number of candidates.
+    :param seed: Random seed.
+    :return: Data frame with tensor paths, variants and labels.
+    """
+    rng = np.random.default_rng(seed)
+    chroms = np.array(['chr{}'.format(i) for i in range(1, 23)])
+    nucleotides = np.array(['A', 'C', 'G', 'T'])
+    filters = np.array(SOMATIC_LABELS + GERMLINE_LABELS + NO_MUT_LABELS)
+    chrom = chroms[rng.integers(0, len(chroms), num_candidates)]
+    pos = rng.integers(1, 10 ** 8, num_candidates)
+    filt = filters[rng.integers(0, len(filters), num_candidates)]
+    return pd.DataFrame({
+        'CHROM': chrom,
+        'POS': pos,
+        'REF': nucleotides[rng.integers(0, 4, num_candidates)],
+        'ALT': nucleotides[rng.integers(0, 4, num_candidates)],
+        'FILTER': filt,
+        'LABEL': np.isin(filt, SOMATIC_LABELS),
+        'FULL_PATH': [
+            'tensors/{}-{}-snv-0-1-0.pt'.format(c, p)
+            for c, p in zip(chrom, pos)
+        ],
+        'SHARD_ITEM': np.full(num_candidates, NO_SHARD_ITEM),
+        'TYPE': 'snv',
+        'LENGTH': '0',
+        'REPLICATE': '1',
+        'TIMESTAMP': '0',
+    })
+
+
+def populate_build_time(
+        num_candidates: int = 1000000,
+        repeats: int = 3,
+) -> Dict[str, float]:
+    """Measure how long populate takes to build the dataset arrays.
+
+    :param num_candidates: Number of synthetic candidates.
+    :param repeats: Number of measurements, the fastest is reported.
+    :return: Build time in seconds, in total and per 1M candidates.
+    """
+    from src.dataloaders.populator import populate
+
+    df = synthetic_candidates(num_candidates)
+    timings = []
+    for _ in range(repeats):
+        start = time.time()
+        populate(df.copy(), 'sample')
+        timings.append(time.time() - start)
+    seconds = min(timings)
+    result = {
+        'candidates': num_candidates,
+        'seconds': seconds,
+        'seconds_per_1M_candidates': seconds / num_candidates * 10 ** 6,
+    }
+    logger.info('populate: {}'.format(result))
+    return result
+
+
+def window_sizes(
+        home_folder: Text,
+        pretrained_model: Text,
+        prediction_mode: Text,
+        widths: Sequence[int] = (150, 100, 60, 30),
+        batch_size: int = 64,
+        out_path: Text = None,
+) -> List[Dict]:
+    """Compare AUPRC and throughput of calling with different window crops.
+
+    :param home_folder: Home folder with labelled samples in call/
+    :param pretrained_model: Path to the pretrained model.
+    :param prediction_mode: somatic_snv, somatic_indel, germline_snp...
+    :param widths: Window sizes to crop the tensors to.
+    :param batch_size: Batch size.
+    :param out_path: Path to write the report to as TSV, if given.
+    :return: AUPRC and variants per second for every window size.
+    """
+    from src.architecture import initialize_network
+    from src.dataloaders.data_loader import MutationDataLoader
+    from src.run import Hyperparams
+    from src.valid_methods import validate_network
+
+    report = []
+    for width in widths:
+        hp = Hyperparams(
+            run='benchmark_window_{}'.format(width),
+            home_folder=home_folder,
+            prediction_mode=prediction_mode,
+            pretrained_model=pretrained_model,
+            batch_size=batch_size,
+            window_size=width,
+        )
+        hp._set_call_paths()
+        loader = MutationDataLoader(hp)
+        network = initialize_network(hp, network_path=hp.pretrained_model)
+        start = time.time()
+        _, _, auprc = validate_network(loader, hp, network=network)
+        seconds = time.time() - start
+        num_variants = len(loader.dataset) * loader.dataset.num_clips
+        report.append({
+            'window_size': width,
+            'auprc': auprc,
+            'variants': num_variants,
+            'seconds': seconds,
+            'variants_per_second': num_variants / seconds,
+        })
+    df = pd.DataFrame(report)
+    logger.info('Window sizes:\n{}'.format(df.to_string(index=False)))
+    if out_path:
+        df.to_csv(out_path, sep='\t', index=False)
+    return report
+
+
+def quantization_drift(
+        home_folder: Text,
+        tensor_dir: Text,
+        pretrained_model: Text,
+        prediction_mode: Text,
+        encodings: Sequence[Text] = ('float16', 'uint8'),
+        max_tensors: int = 1024,
+        batch_size: int = 64,
+        out_path: Text = None,
+) -> List[Dict]:
+    """Compare the scores of a model on original and quantized tensors.
+
+    The .pt tensors of a directory are quantized in memory, as pack_directory
+    would store them, and decoded again before they are scored.
+
+    :param home_folder: Home folder, as given to Hyperparams.
+    :param tensor_dir: Directory of .pt tensors, e.g. purity-1.0-...-0.0
+    :param pretrained_model: Path to the pretrained model.
+    :param prediction_mode: somatic_snv, somatic_indel, germline_snp...
+    :param encodings: Encodings to compare against the originals.
+    :param max_tensors: Number of tensors to score at most.
+    :param batch_size: Batch size.
+    :param out_path: Path to write the report to as TSV, if given.
+    :return: Mean and max absolute drift of the softmax scores and of the
+    binary score, and the fraction of changed predictions, per encoding.
+    """
+    import torch
+    from torch.nn import functional as F
+
+    from src.architecture import initialize_network
+    from src.dataloaders.tensor_store import dequantize, list_tensors, quantize
+    from src.run import Hyperparams
+    from src.utils import binary_scores, migrate_to_gpu
+
+    file_list = list_tensors(tensor_dir)['FULL_PATH'][:max_tensors]
+    arrs = np.stack([
+        torch.load(path, map_location='cpu').numpy() for path in file_list
+    ])
+    hp = Hyperparams(
+        run='benchmark_quantization',
+        home_folder=home_folder,
+        prediction_mode=prediction_mode,
+        pretrained_model=pretrained_model,
+    )
+    network = initialize_network(hp, network_path=pretrained_model)
+    device, network = migrate_to_gpu(network)
+    network.eval()
+
+    def score(inputs: np.ndarray, scales: np.ndarray = None) -> np.ndarray:
+        """Get the softmax scores of a stack of tensors, in batches."""
+        scores = []
+        with torch.no_grad():
+            for start in range(0, len(inputs), batch_size):
+                batch = torch.from_numpy(inputs[start:start + batch_size])
+                batch = batch.to(device)
+                if scales is not None:
+                    batch_scales = torch.from_numpy(
+                        scales[start:start + batch_size]
+                    ).to(device)
+                    batch = dequantize(
+                        batch, batch_scales[:, 0], batch_scales[:, 1]
+                    )
+                outputs, _ = network(batch.float())
+                scores.append(F.softmax(outputs, dim=1).cpu().numpy())
+        return np.concatenate(scores)
+
+    reference = score(arrs)
+    report = []
+    for encoding in encodings:
+        quantized, scales = quantize(arrs, encoding)
+        scores = score(quantized, scales)
+        drift = np.abs(scores - reference)
+        binary_drift = np.abs(
+            binary_scores(scores, prediction_mode)
+            - binary_scores(reference, prediction_mode)
+        )
+        report.append({
+            'encoding': encoding,
+            'tensors': len(arrs),
+            'bytes_per_tensor': quantized[0].nbytes,
+            'mean_score_drift': float(drift.mean()),
+            'max_score_drift': float(drift.max()),
+            'mean_binary_drift': float(binary_drift.mean()),
+            'max_binary_drift': float(binary_drift.max()),
+            'changed_predictions': float(np.mean(
+                scores.argmax(axis=1) != reference.argmax(axis=1)
+            )),
+        })
+    df = pd.DataFrame(report)
+    logger.info('Quantization drift:\n{}'.format(df.to_string(index=False)))
+    if out_path:
+        df.to_csv(out_path, sep='\t', index=False)
+    return report
+
+
+def storage_formats(
+        tensor_dir: Text,
+        encodings: Sequence[Text] = ('raw', 'float16', 'uint8', 'sparse'),
+        max_tensors: int = 4096,
+        batch_size: int = 256,
+        out_path: Text = None,
+) -> List[Dict]:
+    """Compare size on disk and read throughput of the tensor encodings.
+
+    The .pt tensors of a directory are the baseline. For every encoding, the
+    same tensors are packed into a temporary directory and read back in
+    batches, as the DataLoader workers would. Files are read from the page
+    cache after the first pass, so throughputs are those of warm reads.
+
+    :param tensor_dir: Directory of .pt tensors, e.g. purity-1.0-...-0.0
+    :param encodings: Encodings to compare, see TENSOR_ENCODINGS.
+    :param max_tensors: Number of tensors to compare at most.
+    :param batch_size: Number of tensors per batch.
+    :param out_path: Path to write the report to as TSV, if given.
+    :return: Bytes per tensor and tensors per second, per encoding.
+    """
+    import glob
+    import os
+    import shutil
+    import tempfile
+
+    import torch
+
+    from src.dataloaders.data_loader import collate_batch
+    from src.dataloaders.tensor_store import (
+        _write_shard, list_tensors, load_encoded
+    )
+
+    def read_all(paths: Sequence[Text], items: Sequence[int]) -> float:
+        """Read and collate all tensors, return the tensors per second."""
+        start = time.time()
+        for first in range(0, len(paths), batch_size):
+            collate_batch([
+                dict(load_encoded(path, item), clip=0)
+                for path, item in zip(
+                    paths[first:first + batch_size],
+                    items[first:first + batch_size]
+                )
+            ])
+        return len(paths) / (time.time() - start)
+
+    file_list = list_tensors(tensor_dir)['FULL_PATH'][:max_tensors].tolist()
+    report = [{
+        'encoding': 'pt',
+        'tensors': len(file_list),
+        'bytes_per_tensor': sum(
+            os.path.getsize(path) for path in file_list
+        ) / len(file_list),
+        'tensors_per_second': read_all(
+            file_list, [NO_SHARD_ITEM] * len(file_list)
+        ),
+    }]
+    tensors = [
+        (os.path.split(path)[1], torch.load(path, map_location='cpu').numpy())
+        for path in file_list
+    ]
+    for encoding in encodings:
+        out_dir = tempfile.mkdtemp(prefix='tensors-{}-'.format(encoding))
+        try:
+            index = _write_shard(out_dir, 0, tensors, encoding)
+            shard_path = os.path.join(out_dir, index[0][1])
+            report.append({
+                'encoding': encoding,
+                'tensors': len(index),
+                'bytes_per_tensor': sum(
+                    os.path.getsize(path)
+                    for path in glob.glob(os.path.join(out_dir, '*'))
+                ) / len(index),
+                'tensors_per_second': read_all(
+                    [shard_path] * len(index), [row[2] for row in index]
+                ),
+            })
+        finally:
+            shutil.rmtree(out_dir)
+    df = pd.DataFrame(report)
+    df['size_vs_pt'] = df['bytes_per_tensor'] / df['bytes_per_tensor'][0]
+    logger.info('Storage formats:\n{}'.format(df.to_string(index=False)))
+    if out_path:
+        df.to_csv(out_path, sep='\t', index=False)
+    return df.to_dict('records')
+
+
+def inference_engines(
+        home_folder: Text,
+        tensor_dir: Text,
+        pretrained_model: Text,
+        prediction_mode: Text,
+        engines: Sequence[Text] = ('eager', 'torchscript', 'compile'),
+        max_tensors: int = 1024,
+        batch_size: int = 256,
+        repeats: int = 3,
+        num_threads: int = None,
+        window_size: int = 0,
+        out_path: Text = None,
+) -> List[Dict]:
+    """Compare the CPU throughput of the inference engines with eager mode.
+
+    Every engine scores the same tensors. Its scores are checked against
+    those of the unmodified network in eager mode.
+
+    :param home_folder: Home folder, as given to Hyperparams.
+    :param tensor_dir: Directory of .pt tensors, e.g. purity-1.0-...-0.0
+    :param pretrained_model: Path to the pretrained model.
+    :param prediction_mode: somatic_snv, somatic_indel, germline_snp...
+    :param engines: Engines to compare, see INFERENCE_ENGINES.
+    :param max_tensors: Number of tensors to score at most.
+    :param batch_size: Batch size.
+    :param repeats: Number of measurements, the fastest is reported. The
+    first pass, which compiles the network, is not measured.
+    :param num_threads: Number of CPU threads, PyTorch's default if None.
+    :param window_size: Width to crop the tensors to, as when calling.
+    :param out_path: Path to write the report to as TSV, if given.
+    :return: Variants per second, speedup over eager mode and largest score
+    difference, per engine.
+    """
+    import torch
+
+    from src.architecture import initialize_network
+    from src.dataloaders.tensor_store import list_tensors, load_tensor
+    from src.inference import InferenceNetwork, score_batches
+    from src.run import Hyperparams
+
+    if num_threads:
+        torch.set_num_threads(num_threads)
+    hp = Hyperparams(
+        run='benchmark_inference',
+        home_folder=home_folder,
+        prediction_mode=prediction_mode,
+        pretrained_model=pretrained_model,
+        window_size=window_size,
+    )
+    file_list = list_tensors(tensor_dir)[:max_tensors]
+    inputs = torch.stack([
+        load_tensor(path, item, hp.window_size)
+        for path, item in zip(file_list['FULL_PATH'], file_list['SHARD_ITEM'])
+    ]).float()
+    eager = initialize_network(hp, network_path=pretrained_model).eval()
+    reference = score_batches(eager, inputs, batch_size)
+
+    report = []
+    for engine in engines:
+        network = eager
+        if engine != 'eager':
+            network = InferenceNetwork(eager, engine)
+        scores = score_batches(network, inputs, batch_size)
+        timings = []
+        for _ in range(repeats):
+            start = time.time()
+            score_batches(network, inputs, batch_size)
+            timings.append(time.time() - start)
+        report.append({
+            'engine': engine,
+            'variants': len(inputs),
+            'variants_per_second': len(inputs) / min(timings),
+            'max_score_difference': float(np.abs(scores - reference).max()),
+        })
+    df = pd.DataFrame(report)
+    df['speedup'] = df['variants_per_second'] / \
+        df['variants_per_second'][df['engine'] == 'eager'].max()
+    logger.info('Inference engines:\n{}'.format(df.to_string(index=False)))
+    if out_path:
+        df.to_csv(out_path, sep='\t', index=False)
+    return df.to_dict('records')
+
+
+def memory_efficient(
+        home_folder: Text,
+        tensor_dir: Text,
+        prediction_mode: Text,
+        batch_sizes: Sequence[int] = (64, 128, 256),
+        num_init_features: int = 256,
+        steps: int = 5,
+        out_path: Text = None,
+) -> List[Dict]:
+    """Compare peak memory and step time of training with and without
+    checkpointing the dense layers, see Hyperparams.memory_efficient.
+
+    Both networks start from the same weights and train on the same
+    tensors, repeated to fill the batches, so their losses should match.
+    Peak memory is only measured on the GPU.
+
+    :param home_folder: Home folder, as given to Hyperparams.
+    :param tensor_dir: Directory of .pt tensors, e.g. purity-1.0-...-0.0
+    :param prediction_mode: somatic_snv, somatic_indel, germline_snp...
+    :param batch_sizes: Batch sizes to train with.
+    :param num_init_features: Number of features of the first convolution.
+    :param steps: Number of training steps, the first one is not measured.
+    :param out_path: Path to write the report to as TSV, if given.
+    :return: Peak memory, seconds per step and loss of the first step, per
+    batch size and mode. Batches that run out of memory have no timings.
+    """
+    import torch
+    import torch.nn as nn
+
+    from src.architecture import select_architecture
+    from src.dataloaders.tensor_store import list_tensors, load_tensor
+    from src.run import Hyperparams
+
+    device = torch.device('cuda' if torch.cuda.is_available() else 'cpu')
+    file_list = list_tensors(tensor_dir)[:max(batch_sizes)]
+    tensors = torch.stack([
+        load_tensor(path, item)
+        for path, item in zip(file_list['FULL_PATH'], file_list['SHARD_ITEM'])
+    ]).float()
+    state_dict = None
+
+    report = []
+    for batch_size in batch_sizes:
+        repeats = -(-batch_size // len(tensors))
+        inputs = tensors.repeat(
+            (repeats,) + (1,) * (tensors.dim() - 1)
+        )[:batch_size].to(device)
+        labels1 = torch.arange(batch_size, device=device) % 3
+        labels2 = torch.arange(batch_size, device=device) % 4
+        for efficient in [False, True]:
+            hp = Hyperparams(
+                run='benchmark_memory_efficient',
+                home_folder=home_folder,
+                prediction_mode=prediction_mode,
+                num_init_features=num_init_features,
+                memory_efficient=efficient,
+            )
+            network = select_architecture(hp)
+            if state_dict is None:
+                state_dict = network.state_dict()
+            network.load_state_dict(state_dict)
+            network.to(device).train()
+            optimizer = torch.optim.SGD(network.parameters(), lr=1e-3)
+            criterion = nn.CrossEntropyLoss()
+            row = {
+                'batch_size': batch_size,
+                'memory_efficient': efficient,
+                'peak_memory_mb': None,
+                'seconds_per_step': None,
+                'loss': None,
+            }
+            if device.type == 'cuda':
+                torch.cuda.empty_cache()
+                torch.cuda.reset_peak_memory_stats(device)
+            try:
+                timings = []
+                for step in range(steps):
+                    start = time.time()
+                    optimizer.zero_grad()
+                    outputs1, outputs2 = network(inputs)
+                    loss = criterion(outputs1, labels1) + \
+                        criterion(outputs2, labels2)
+                    loss.backward()
+                    optimizer.step()
+                    if device.type == 'cuda':
+                        torch.cuda.synchronize(device)
+                    if step == 0:
+                        row['loss'] = float(loss.item())
+                    else:
+                        timings.append(time.time() - start)
+                row['seconds_per_step'] = min(timings) if timings else None
+            except torch.cuda.OutOfMemoryError:
+                logger.warning('Out of memory: {}'.format(row))
+            if device.type == 'cuda':
+                row['peak_memory_mb'] = \
+                    torch.cuda.max_memory_allocated(device) / 2 ** 20
+            report.append(row)
+            del network, optimizer
+    df = pd.DataFrame(report)
+    logger.info('Memory efficient:\n{}'.format(df.to_string(index=False)))
+    if out_path:
+        df.to_csv(out_path, sep='\t', index=False)
+    return report
+
+
+def cpu_scaling(
+        home_folder: Text,
+        pretrained_model: Text,
+        prediction_mode: Text,
+        workers: Sequence[int] = (1, 2, 4, 8, 16, 32, 64),
+        out_path: Text = None,
+) -> List[Dict]:
+    """Measure how calling on the CPU scales with the number of worker
+    processes, see Hyperparams.cpu_workers.
+
+    Every number of workers scores the call samples of the home folder with
+    the same network, and its scores are checked against those of one worker.
+    Numbers of workers above the number of CPUs are skipped.
+
+    :param home_folder: Home folder with samples in call/
+    :param pretrained_model: Path to the pretrained model.
+    :param prediction_mode: somatic_snv, somatic_indel, germline_snp...
+    :param workers: Numbers of worker processes to compare.
+    :param out_path: Path to write the report to as TSV, if given.
+    :return: Variants per second, speedup and parallel efficiency over one
+    worker and largest score difference, per number of workers.
+    """
+    import os
+
+    from src.architecture import initialize_network
+    from src.dataloaders.data_loader import MutationDataLoader
+    from src.run import Hyperparams
+    from src.sharded import sharded_scores
+
+    hp = Hyperparams(
+        run='benchmark_cpu_scaling',
+        home_folder=home_folder,
+        prediction_mode=prediction_mode,
+        pretrained_model=pretrained_model,
+    )
+    hp._set_call_paths()
+    loader = MutationDataLoader(hp)
+    network = initialize_network(hp, pretrained_model, for_inference=True)
+    num_cores = len(os.sched_getaffinity(0))
+
+    report = []
+    reference = None
+    for num_workers in workers:
+        if num_workers > num_cores:
+            logger.warning('Skipping {} workers, only {} CPUs'.format(
+                num_workers, num_cores
+            ))
+            continue
+        start = time.time()
+        scores = sharded_scores(network, loader, num_workers)[0]
+        seconds = time.time() - start
+        if reference is None:
+            reference = scores
+        report.append({
+            'workers': num_workers,
+            'variants': len(scores),
+            'seconds': seconds,
+            'variants_per_second': len(scores) / seconds,
+            'max_score_difference': float(np.abs(scores - reference).max()),
+        })
+    df = pd.DataFrame(report)
+    df['speedup'] = df['variants_per_second'] / df['variants_per_second'][0]
+    df['efficiency'] = df['speedup'] * df['workers'][0] / df['workers']
+    logger.info('CPU scaling:\n{}'.format(df.to_string(index=False)))
+    if out_path:
+        df.to_csv(out_path, sep='\t', index=False)
+    return df.to_dict('records')
+
+
+def model_startup(
+        home_folder: Text,
+        pretrained_model: Text,
+        prediction_mode: Text,
+        repeats: int = 5,
+        out_path: Text = None,
+) -> List[Dict]:
+    """Measure how long initializing the pretrained network takes.
+
+    Loading the model as saved is compared with the normalized weights:
+    built from the model, loaded from the cache next to it, and already
+    loaded in the process. See load_weights. The model is copied to a
+    temporary directory first, so its cache there is built and removed
+    instead of the one next to the pretrained model.
+
+    :param home_folder: Home folder, as given to Hyperparams.
+    :param pretrained_model: Path to the pretrained model.
+    :param prediction_mode: somatic_snv, somatic_indel, germline_snp...
+    :param repeats: Number of measurements, the fastest is reported.
+    :param out_path: Path to write the report to as TSV, if given.
+    :return: Seconds to initialize the network, per way of loading it.
+    """
+    import os
+    import shutil
+    import tempfile
+
+    import torch
+
+    from src import architecture
+    from src.run import Hyperparams
+
+    tmp_dir = tempfile.TemporaryDirectory()
+    pretrained_model = shutil.copy2(pretrained_model, tmp_dir.name)
+    hp = Hyperparams(
+        run='benchmark_model_startup',
+        home_folder=home_folder,
+        prediction_mode=prediction_mode,
+        pretrained_model=pretrained_model,
+    )
+    cache_path = architecture.normalized_weights_path(pretrained_model)
+
+    def saved():
+        network = architecture.select_architecture(hp)
+        network.load_state_dict(architecture.normalize_weights(
+            torch.load(pretrained_model, map_location='cpu')
+        ), strict=False)
+
+    def built():
+        architecture._WEIGHTS.clear()
+        if os.path.exists(cache_path):
+            os.remove(cache_path)
+        architecture.initialize_network(hp, pretrained_model)
+
+    def cached():
+        architecture._WEIGHTS.clear()
+        architecture.initialize_network(hp, pretrained_model)
+
+    def in_process():
+        architecture.initialize_network(hp, pretrained_model)
+
+    report = []
+    with tmp_dir:
+        for name, load in [
+            ('saved_model', saved),
+            ('normalized_build', built),
+            ('normalized_cache', cached),
+            ('in_process', in_process),
+        ]:
+            timings = []
+            for _ in range(repeats):
+                start = time.time()
+                load()
+                timings.append(time.time() - start)
+            report.append({'load': name, 'seconds': min(timings)})
+    df = pd.DataFrame(report)
+    df['speedup'] = df['seconds'][0] / df['seconds']
+    logger.info('Model startup:\n{}'.format(df.to_string(index=False)))
+    if out_path:
+        df.to_csv(out_path, sep='\t', index=False)
+    return df.to_dict('records')
+
+
+def import_time(
+        modules: Sequence[Text] = (
+            'run_variant_medium', 'fire', 'src.pipeline', 'torch', 'pandas',
+            'sklearn.metrics', 'torch.utils.tensorboard',
+        ),
+        repeats: int = 5,
+        out_path: Text = None,
+) -> List[Dict]:
+    """Measure how long importing modules takes in a fresh interpreter.
+
+    run_variant_medium is what is imported before any command runs, fire is
+    only imported on top of it for command lines parse_command_line leaves to
+    it. src.pipeline is what call imports. Every import runs in a new
+    process, so nothing is imported already.
+
+    :param modules: Modules to import.
+    :param repeats: Number of measurements, the fastest is reported.
+    :param out_path: Path to write the report to as TSV, if given.
+    :return: Seconds to import, per module.
+    """
+    import os
+    import subprocess
+    import sys
+
+    bin_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    report = []
+    for module in modules:
+        timings = []
+        for _ in range(repeats):
+            output = subprocess.run(
+                [
+                    sys.executable, '-c',
+                    'import time; start = time.perf_counter(); '
+                    'import {}; print(time.perf_counter() - start)'.format(
+                        module
+                    ),
+                ],
+                cwd=bin_dir,
+                stdout=subprocess.PIPE,
+                check=True,
+            ).stdout
+            timings.append(float(output.decode().strip().splitlines()[-1]))
+        report.append({'module': module, 'seconds': min(timings)})
+    df = pd.DataFrame(report)
+    logger.info('Import time:\n{}'.format(df.to_string(index=False)))
+    if out_path:
+        df.to_csv(out_path, sep='\t', index=False)
+    return report
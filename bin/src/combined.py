@@ -0,0 +1,123 @@
+import copy
+import logging
+from typing import Dict, List, Text
+
+import numpy as np
+import torch
+from torch.nn import functional as F
+
+from src.architecture import initialize_network
+from src.constants import *
+from src.dataloaders.data_loader import MutationDataLoader
+from src.quantization import quantize_network
+from src.utils import migrate_to_gpu, output_modes, prepare_inputs, \
+    rescore, save_scores
+from src.valid_methods import sum_up
+
+logger = logging.getLogger(__name__)
+
+
+def mode_hyperparams(hp) -> Dict[Text, object]:
+    """Get the hyperparameters of both modes of a combined call.
+
+    :param hp: Hyperparameters, with a prediction mode in COMBINED_MODES.
+    :return: A copy of hp per prediction mode, with the pretrained model of
+    that mode: pretrained_model for SNVs, indel_model for indels.
+    """
+    snv_mode, indel_mode = COMBINED_MODES[hp.prediction_mode]
+    mode_hps = {}
+    for mode, model in [
+        (snv_mode, hp.pretrained_model), (indel_mode, hp.indel_model)
+    ]:
+        mode_hp = copy.copy(hp)
+        mode_hp.prediction_mode = mode
+        mode_hp.pretrained_model = model
+        mode_hps[mode] = mode_hp
+    return mode_hps
+
+
+def output_hyperparams(hp) -> List:
+    """Get the hyperparameters of every prediction mode a call writes.
+
+    :param hp: Hyperparameters.
+    :return: A copy of hp per prediction mode of a single variant type, see
+    mode_hyperparams and output_modes.
+    """
+    if hp.prediction_mode in COMBINED_MODES:
+        base_hps = list(mode_hyperparams(hp).values())
+    else:
+        base_hps = [hp]
+    out_hps = []
+    for base_hp in base_hps:
+        for mode in output_modes(base_hp):
+            out_hp = copy.copy(base_hp)
+            out_hp.prediction_mode = mode
+            out_hps.append(out_hp)
+    return out_hps
+
+
+def combined_call(hp):
+    """Call SNVs and indels in one pass over the tensors.
+
+    The candidates of both types are parsed, merged with the tensors and
+    loaded once. Every batch is split by the allele lengths of its rows,
+    SNVs are scored by the SNV model and indels by the indel model. The
+    scores of each mode are written as if called on their own.
+
+    :param hp: Hyperparameters, with a prediction mode in COMBINED_MODES and
+    the samples to call in valid_paths. Streaming and CPU workers are not
+    supported, see Hyperparams.
+    """
+    mode_hps = mode_hyperparams(hp)
+    loader = MutationDataLoader(hp)
+    snv_mode, indel_mode = COMBINED_MODES[hp.prediction_mode]
+    networks, device = {}, None
+    for mode, mode_hp in mode_hps.items():
+        network = initialize_network(
+            mode_hp, mode_hp.pretrained_model, for_inference=True
+        )
+        if mode_hp.quantize:
+            network = quantize_network(
+                network, loader, mode_hp, indels=mode == indel_mode
+            )
+        device, network = migrate_to_gpu(network)
+        networks[mode] = network.eval()
+
+    outputs = {mode: [] for mode in networks}
+    rows = {mode: [] for mode in networks}
+    with torch.no_grad():
+        for data in loader.get_data_loader():
+            inputs = prepare_inputs(data, device, loader.dataset.aug_rate)
+            is_indel = loader.dataset.data_list.is_indel(data['index'].numpy())
+            for mode, mask in [(snv_mode, ~is_indel), (indel_mode, is_indel)]:
+                if not mask.any():
+                    continue
+                scores, _ = networks[mode](
+                    inputs[torch.from_numpy(mask).to(inputs.device)]
+                )
+                outputs[mode].append(scores.float().cpu())
+                rows[mode].append((
+                    data['y1'].numpy()[mask],
+                    data['index'].numpy()[mask],
+                    data['clip'].numpy()[mask],
+                ))
+
+    for mode, mode_hp in mode_hps.items():
+        if len(outputs[mode]) == 0:
+            logger.warning('No candidates to call for {}'.format(mode))
+            continue
+        scores = F.softmax(torch.cat(outputs[mode]), dim=1).numpy()
+        labels, indices, clips = [
+            np.concatenate(column) for column in zip(*rows[mode])
+        ]
+        nn_scores, _ = sum_up(mode_hp, scores, labels)
+        metadata = loader.dataset.data_list.metadata(indices, clips)
+        for out_mode in output_modes(mode_hp):
+            save_scores(
+                rescore(nn_scores, out_mode),
+                metadata,
+                hp.out_path,
+                out_mode,
+                call_mode=True
+            )
+        logger.info('Called {} rows for {}'.format(len(scores), mode))
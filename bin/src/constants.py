@@ -20,12 +20,48 @@ GERMLINE_MODES = ['germline_snp', 'germline_indel']
 SOMATIC_MODES = ['somatic_snv', 'somatic_indel']
 SNP_MODES = ['germline_snp', 'somatic_snv']
 INDEL_MODES = ['germline_indel', 'somatic_indel']
+# The mode of the other class for the same variant type, for multi_mode.
+COUNTERPART_MODES = {
+    'somatic_snv': 'germline_snp',
+    'somatic_indel': 'germline_indel',
+    'germline_snp': 'somatic_snv',
+    'germline_indel': 'somatic_indel',
+}
+# Call modes scoring SNVs and indels in one pass: the SNV mode, the indel mode.
+COMBINED_MODES = {
+    'somatic': ['somatic_snv', 'somatic_indel'],
+    'germline': ['germline_snp', 'germline_indel'],
+}
+# Candidate and label files: the columns kept, and lines parsed at once.
+VARIANT_COLUMNS = ['CHROM', 'POS', 'REF', 'ALT', 'FILTER']
+VARIANT_CHUNK_SIZE = 1000000
+VCF_EXTENSIONS = ('.vcf', '.vcf.gz', '.vcf.bgz')
 
 # the information contained in the input tensor file names.
 FILE_NAME_COLUMNS = ['FULL_PATH', 'CHROM', 'POS', 'TYPE', 'LENGTH',
                      'REPLICATE', 'TIMESTAMP']
 FILE_NAME_COLUMNS_NO_REP = ['FULL_PATH', 'CHROM', 'POS', 'TYPE', 'LENGTH',
                             'TIMESTAMP']
+
+# Packed tensor directories: tensors are stored in a few .npy shards, and an
+# index maps each original tensor file name to a shard, an item in it and
+# the encoding of the shard.
+TENSOR_INDEX_FNAME = 'index.tsv'
+TENSOR_SHARD_FNAME = 'shard-{:05d}.npy'
+TENSOR_SHARD_GLOB = 'shard-*.npy'
+TENSOR_INDEX_COLUMNS = ['FILE_NAME', 'SHARD', 'ITEM', 'ENCODING']
+TENSOR_SHARD_SIZE = 4096
+# Shards are stored as they are (raw), as float16, as uint8 with a scale
+# and an offset per tensor and channel, kept next to the shard, or sparse:
+# the non-zero values of all tensors in the shard, with their flat positions
+# within the tensor, the offsets of each tensor's values and the tensor shape.
+TENSOR_ENCODINGS = ['raw', 'float16', 'uint8', 'sparse']
+TENSOR_SCALES_SUFFIX = '.scales.npy'
+TENSOR_INDICES_SUFFIX = '.indices.npy'
+TENSOR_INDPTR_SUFFIX = '.indptr.npy'
+TENSOR_SHAPE_SUFFIX = '.shape.npy'
+# Item number of tensors stored in their own .pt files.
+NO_SHARD_ITEM = -1
 # The accepted "filter"s for labels.
 SOMATIC_LABELS = ['somatic', 'consensus']
 GERMLINE_LABELS = ['SNP', 'MNP', 'deepvariant']
@@ -52,6 +88,50 @@ CHANNELS = {
 }
 
 BEST_MODEL_FNAME = 'best_model.pt'
+# How trained networks are run when validating and calling: as they are
+# (eager), with batch norms folded and compiled by TorchScript or
+# torch.compile, or exported to ONNX and run by onnxruntime on the CPU.
+INFERENCE_ENGINES = ['eager', 'torchscript', 'compile', 'onnxruntime']
+ONNX_MODEL_SUFFIX = '.onnx'
+ONNX_OPSET = 17
+ONNX_TOLERANCE = 1e-4
+# Int8 networks for calling on CPU: cached next to the pretrained model with
+# the settings they were built with, calibrated once on a fixed set of call
+# tensors that is saved next to them too. They are checked once when built,
+# on the first batches of that call, and the float network is used if the
+# binary scores drift more than QUANTIZE_MAX_DRIFT on average.
+QUANTIZED_MODEL_SUFFIX = '.int8.pt'
+QUANTIZED_METADATA_SUFFIX = '.int8.json'
+QUANTIZED_CALIBRATION_SUFFIX = '.int8.calibration.pt'
+QUANTIZE_CALIBRATION_VARIANTS = 512
+QUANTIZE_CHECK_BATCHES = 8
+QUANTIZE_MAX_DRIFT = 0.01
+# Weights of a pretrained model with the DataParallel prefix stripped and
+# float32 tensors, cached next to it so they load in one pass.
+NORMALIZED_WEIGHTS_SUFFIX = '.weights.pt'
+DATA_PARALLEL_PREFIX = 'module.'
+# Processes building the data sets of samples by default. Every process holds
+# the parsed inputs of a whole sample, so memory grows with their number.
+BUILD_WORKERS = 4
+# Snapshot of the populated data set of a sample, kept in the sample folder
+# and named by a hash of the settings it was built with.
+DATASET_SNAPSHOT_FNAME = 'dataset-{}.npz'
+# Part of the snapshot settings: bump it whenever parsing, merging or
+# populating changes, so snapshots built by older code are not loaded.
+DATASET_SNAPSHOT_VERSION = 1
+# Samples completed by a streaming call, per prediction mode.
+STREAM_PROGRESS_FNAME = 'call_progress_{}.txt'
+
+# DataLoader settings, and the grid searched when tuning them. Batch sizes are
+# the number of rows per forward pass, clip levels included.
+NUM_WORKERS = 8
+PREFETCH_FACTOR = 2
+LOADER_CONFIG_FNAME = 'loader_config.json'
+LOADER_CONFIG_KEYS = ['num_workers', 'prefetch_factor', 'batch_size']
+TUNING_SECONDS = 10
+TUNING_WORKERS = [1, 2, 4, 8, 16, 32]
+TUNING_PREFETCH_FACTORS = [2, 4, 8]
+TUNING_BATCH_SIZES = [64, 128, 256, 512, 1024]
 
 UNKNOWN_STRATEGIES = ['discard', 'keep_as_false']
 
@@ -65,6 +145,9 @@ IND_SAMPLE = 4
 IND_REPLICATE = 5
 IND_CLIPPING = 6
 HEADER = ['CHROM', 'POS', 'REF', 'ALT', 'SAMPLE', 'REPLICATE', 'CLIPPING']
+SCORES_COLUMNS = ['SAMPLE', 'CHROM', 'POS', 'REF', 'ALT', 'REPLICATE',
+                  'CLIPPING', 'SCORE', 'SCORE_NOMUT', 'SCORE_GERMLINE',
+                  'SCORE_SOMATIC']
 
 SNV_THRESHOLD = 0.01
 INS_THRESHOLD = -0.75
@@ -1,49 +1,230 @@
-from typing import Text, Tuple
+from typing import Dict, List, Sequence, Text, Tuple
 
+import numpy as np
+import pandas as pd
 
-class AnnotatedTensor:
-    """Encapsulate all information necessary for training and evaluating for one variant."""
+from src.constants import HEADER
+
+
+class AnnotatedTensors:
+    """Encapsulate the information of all variants of a data set, column-wise.
+
+    Every field is a NumPy array of a fixed size type and string fields are
+    stored as categorical codes. Unlike an object array with one object per
+    variant, reading an entry does not update Python reference counts, so the
+    pages stay shared with forked DataLoader workers instead of being copied.
+    """
+
+    CATEGORICAL_FIELDS = ['CHROM', 'REF', 'ALT', 'SAMPLE', 'REPLICATE']
 
     def __init__(
             self,
-            tensor: Text,
-            variant: int,
-            length: int,
-            metadata: Tuple[Text, int, Text, Text, Text, Text, int],
-            clip_length: int,
+            paths: np.ndarray,
+            shard_items: np.ndarray,
+            path_ids: np.ndarray,
+            mutation_types: np.ndarray,
+            mutation_length_types: np.ndarray,
+            positions: np.ndarray,
+            codes: Dict[Text, np.ndarray],
+            categories: Dict[Text, np.ndarray],
+    ):
+        """Initialize the columns.
+
+        :param paths: UTF-8 encoded path of every distinct tensor.
+        :param shard_items: Position of every distinct tensor in its shard.
+        :param path_ids: Index into paths/shard_items for every entry.
+        :param mutation_types: Type of variant of every entry, one of 0,1,2,3
+        :param mutation_length_types: Type of variant length of every entry.
+        :param positions: Position of every entry.
+        :param codes: Categorical codes of CATEGORICAL_FIELDS for every entry.
+        :param categories: Categories of CATEGORICAL_FIELDS.
+        """
+        self.paths = paths
+        self.shard_items = shard_items
+        self.path_ids = path_ids
+        self.mutation_types = mutation_types
+        self.mutation_length_types = mutation_length_types
+        self.positions = positions
+        self.codes = codes
+        self.categories = categories
+
+    @classmethod
+    def from_columns(
+            cls,
+            tensor: Sequence[Text],
+            shard_item: Sequence[int],
+            variant: Sequence[int],
+            length: Sequence[int],
+            metadata: Dict[Text, Sequence],
     ):
-        """Initialize the annotated tensor object.
+        """Build the columns from one sequence per field.
 
-        :param tensor: Path to the tensor.
+        :param tensor: Path to the tensor of every entry.
+        :param shard_item: Position of the tensor in its shard, if packed.
         :param variant: Type of variant, one of 0,1,2,3
         :param length: Type of variant length, one of 0,1,2,3
-        :param metadata: Tuple including chromosome, position, ref, alt, sample name, clipping
-        :param clip_length: How much of the tensor should be zeroed out (for data augmentatıion).
-        """
-        self.tensor = tensor
-        self.mutation_type = int(variant)
-        self.mutation_length_type = int(length)
-        self.metadata = metadata
-        self.clip_length = clip_length
-
-    def __repr__(self) -> Text:
-        """Override the default __repr__ implementation."""
-        return '{} {} {} {}'.format(
-            self.tensor,
-            self.mutation_type,
-            self.mutation_length_type,
-            self.metadata
+        :param metadata: POS and CATEGORICAL_FIELDS of every entry.
+        :return: AnnotatedTensors object.
+        """
+        locations = pd.DataFrame({
+            'tensor': np.asarray(tensor, dtype=object),
+            'item': np.asarray(shard_item, dtype=np.int64),
+        })
+        path_ids = locations.groupby(
+            ['tensor', 'item'], sort=False
+        ).ngroup().values
+        unique = locations.drop_duplicates()
+
+        codes, categories = {}, {}
+        for field in cls.CATEGORICAL_FIELDS:
+            codes[field], uniques = pd.factorize(
+                pd.Series(metadata[field], dtype=object).astype(str)
+            )
+            codes[field] = codes[field].astype(np.int32)
+            categories[field] = np.asarray(uniques, dtype=str)
+
+        return cls(
+            paths=np.char.encode(unique['tensor'].values.astype(str), 'utf-8'),
+            shard_items=unique['item'].values,
+            path_ids=path_ids.astype(np.int64),
+            mutation_types=np.asarray(variant, dtype=np.int8),
+            mutation_length_types=np.asarray(length, dtype=np.int8),
+            positions=np.asarray(metadata['POS'], dtype=np.int64),
+            codes=codes,
+            categories=categories,
+        )
+
+    @classmethod
+    def concatenate(cls, parts: List['AnnotatedTensors']):
+        """Concatenate the columns of several data sets, e.g. samples.
+
+        :param parts: AnnotatedTensors objects to concatenate.
+        :return: AnnotatedTensors object containing all entries, in order.
+        """
+        if len(parts) == 0:
+            return cls.from_columns(
+                [], [], [], [], {'POS': [], **{
+                    field: [] for field in cls.CATEGORICAL_FIELDS
+                }}
+            )
+        path_offsets = np.cumsum([0] + [len(p.paths) for p in parts[:-1]])
+        codes, categories = {}, {}
+        for field in cls.CATEGORICAL_FIELDS:
+            categories[field] = np.unique(
+                np.concatenate([p.categories[field] for p in parts])
+            )
+            codes[field] = np.concatenate([
+                np.searchsorted(
+                    categories[field], p.categories[field]
+                )[p.codes[field]].astype(np.int32)
+                for p in parts
+            ])
+        return cls(
+            paths=np.concatenate([p.paths for p in parts]),
+            shard_items=np.concatenate([p.shard_items for p in parts]),
+            path_ids=np.concatenate([
+                p.path_ids + offset for p, offset in zip(parts, path_offsets)
+            ]),
+            mutation_types=np.concatenate([p.mutation_types for p in parts]),
+            mutation_length_types=np.concatenate(
+                [p.mutation_length_types for p in parts]
+            ),
+            positions=np.concatenate([p.positions for p in parts]),
+            codes=codes,
+            categories=categories,
         )
 
-    def __eq__(self, other) -> bool:
-        """Override the default __eq__ implementation.
+    def to_arrays(self) -> Dict[Text, np.ndarray]:
+        """Get all columns as flat arrays, e.g. to save them with np.savez.
+
+        :return: Arrays keyed by field name, codes and categories keyed by
+        codes/<field> and categories/<field>.
+        """
+        arrays = {
+            'paths': self.paths,
+            'shard_items': self.shard_items,
+            'path_ids': self.path_ids,
+            'mutation_types': self.mutation_types,
+            'mutation_length_types': self.mutation_length_types,
+            'positions': self.positions,
+        }
+        for field in self.CATEGORICAL_FIELDS:
+            arrays['codes/{}'.format(field)] = self.codes[field]
+            arrays['categories/{}'.format(field)] = self.categories[field]
+        return arrays
+
+    @classmethod
+    def from_arrays(cls, arrays: Dict[Text, np.ndarray]):
+        """Rebuild the columns from the arrays returned by to_arrays.
+
+        :param arrays: Arrays keyed by field name, e.g. a loaded .npz file.
+        :return: AnnotatedTensors object.
+        """
+        return cls(
+            paths=arrays['paths'],
+            shard_items=arrays['shard_items'],
+            path_ids=arrays['path_ids'],
+            mutation_types=arrays['mutation_types'],
+            mutation_length_types=arrays['mutation_length_types'],
+            positions=arrays['positions'],
+            codes={
+                field: arrays['codes/{}'.format(field)]
+                for field in cls.CATEGORICAL_FIELDS
+            },
+            categories={
+                field: arrays['categories/{}'.format(field)]
+                for field in cls.CATEGORICAL_FIELDS
+            },
+        )
+
+    def __len__(self) -> int:
+        """Get the number of entries."""
+        return len(self.path_ids)
+
+    def tensor(self, idx: int) -> Tuple[Text, int]:
+        """Get the location of the tensor of one entry.
+
+        :param idx: Index of the entry.
+        :return: Path to the tensor, and its position in the shard if packed.
+        """
+        path_id = self.path_ids[idx]
+        return (
+            self.paths[path_id].decode('utf-8'),
+            int(self.shard_items[path_id])
+        )
+
+    def is_indel(self, indices: np.ndarray = None) -> np.ndarray:
+        """Check which entries are indels, from the lengths of their alleles.
+
+        :param indices: Indices of the entries, all entries if None.
+        :return: True for indels, False for SNVs, one per entry.
+        """
+        if indices is None:
+            indices = np.arange(len(self))
+        ref_lengths = np.char.str_len(self.categories['REF'])
+        alt_lengths = np.char.str_len(self.categories['ALT'])
+        return ref_lengths[self.codes['REF'][indices]] \
+            != alt_lengths[self.codes['ALT'][indices]]
+
+    def metadata(
+            self,
+            indices: np.ndarray = None,
+            clip_lengths: np.ndarray = None,
+    ) -> pd.DataFrame:
+        """Rebuild the metadata of the given entries.
 
-        :param other: Object that self is being compared to.
-        :return: True if the contents of the objects match, False otherwise.
+        :param indices: Indices of the entries, all entries if None.
+        :param clip_lengths: Clip level each entry was scored with, 0 if None.
+        :return: Data frame with the columns in HEADER.
         """
-        if isinstance(other, AnnotatedTensor):
-            return self.tensor == other.tensor \
-                   and self.mutation_type == other.mutation_type \
-                   and self.mutation_length_type == other.mutation_length_type \
-                   and self.metadata == other.metadata
-        return False
+        if indices is None:
+            indices = np.arange(len(self))
+        if clip_lengths is None:
+            clip_lengths = np.zeros(len(indices), dtype=np.int8)
+        df = pd.DataFrame({
+            field: self.categories[field][self.codes[field][indices]]
+            for field in self.CATEGORICAL_FIELDS
+        })
+        df['POS'] = self.positions[indices]
+        df['CLIPPING'] = np.asarray(clip_lengths).astype(int)
+        return df[HEADER]
@@ -1,22 +1,27 @@
 import numpy as np
+import os
 import random
 import time
 import torch
-from collections import defaultdict
-from torch.utils.data import Dataset, DataLoader
+from concurrent.futures import ProcessPoolExecutor
+from torch.utils.data import Dataset, DataLoader, default_collate
 from typing import Dict
 
+from src.dataloaders.annotated_tensor import AnnotatedTensors
 from src.dataloaders.input_parsers import *
 from src.dataloaders.populator import populate
+from src.dataloaders.sampler import BalancedSampler
+from src.dataloaders.snapshot import (
+    fingerprint, load_snapshot, save_snapshot, snapshot_path
+)
+from src.dataloaders.tensor_cache import SharedTensorCache
+from src.dataloaders.tensor_store import densify
+from src.dataloaders.tuning import load_loader_config
 
 # from variantmedium.run import Hyperparams
 
 logger = logging.getLogger(__name__)
 
-random.seed(567497)
-torch.manual_seed(37546)
-np.random.seed(6746549)
-
 
 class MutationDataset(Dataset):
     """Mutation dataset."""
@@ -29,6 +34,10 @@ class MutationDataset(Dataset):
             aug_rate: int = 0,
             aug_mixes: List = None,
             prediction_mode: Text = False,
+            window_size: int = 0,
+            cache_size: float = 0.,
+            build_workers: int = None,
+            use_snapshots: bool = True,
     ):
         """ Initializer for mutation data set.
 
@@ -42,29 +51,41 @@ class MutationDataset(Dataset):
         :param aug_mixes: Augmentation mix for purity/downsampling augmentation.
         :param prediction_mode: The final prediction of the network.
         somatic/germline snv/indel etc.
+        :param window_size: Width to crop the tensors to around the variant,
+        0 to keep the full width.
+        :param cache_size: Size of the shared memory cache of decoded tensors
+        in GiB, 0 to disable it. Filled first come, with no eviction.
+        :param build_workers: Number of processes building the data set, one
+        sample per task. Defaults to BUILD_WORKERS, or fewer CPUs, 1 builds
+        it in this process.
+        :param use_snapshots: Reuse the data sets of samples whose inputs did
+        not change since the last run, see build_sample.
         :param removed_channel: Channel(s) to remove to compute feature importance.
         """
         # initialize variables
         start = time.time()
         self.for_train = for_training
         self.aug_rate = aug_rate
+        # window size augmentation is indexed virtually: an index points to
+        # (base entry, clip level), no entry is stored once per clip level.
+        self.num_clips = max(aug_rate, 1)
         self.prediction_mode = prediction_mode
-        self.for_final_validation = False
-        self.val_clip_length = 0
-        self.index_mappings = defaultdict(list)
+        self.window_size = window_size
+        self.index_mappings = {
+            class_name: np.zeros(0, dtype=np.int64)
+            for class_name in list(CLASSES_DICT.keys()) + ['UNKNOWN']
+        }
 
         self.data_list = self._generate_data_list(
             data_paths,
             unknown_strategy,
-            aug_mixes
+            aug_mixes,
+            build_workers,
+            use_snapshots
         )
 
         self._print_info(aug_mixes)
-
-        # During training, balancing is applied for better pos/neg ratio.
-        self.balanced_data_list = []
-        if self.for_train:
-            self.mix_for_balance()
+        self.cache = self._init_cache(cache_size)
 
         end = time.time()
         logger.info(
@@ -77,9 +98,15 @@ class MutationDataset(Dataset):
             data_paths: Dict[Text, Dict[Text, Text]],
             unknown_strategy: Text,
             aug_mixes: List = None,
+            build_workers: int = None,
+            use_snapshots: bool = True,
     ):
         """ Fill in the list that encapsulates training/validation set.
 
+        Samples are read and populated in a process pool, one task per
+        sample. The results are merged in the order of data_paths, so the
+        index of an entry does not depend on the number of processes.
+
         :param in_homes: Home directories for pt files that contain one tensor.
         :param ground_truth_paths: Paths to the labels files.
         :param candidate_paths: Paths to the candidates files.
@@ -87,25 +114,100 @@ class MutationDataset(Dataset):
         One of keep_as_false or discard.
         :param aug_rate: Augmentation rate for varying window size augmentation.
         :param aug_mixes: Augmentation mix for purity/downsampling augmentation.
+        :param build_workers: Number of processes, defaults to BUILD_WORKERS
+        or the number of CPUs if lower.
+        :param use_snapshots: Reuse the data sets of unchanged samples.
+        :return: AnnotatedTensors of all samples.
         """
-        all_data_list = []
-        for sample, paths in data_paths.items():
-            logger.info('Processing files in: {}'.format(paths['tensors']))
-
-            df_merge = get_merged_df(
+        tasks = [
+            (
+                sample,
                 paths,
                 self.prediction_mode,
                 self.for_train,
                 aug_mixes,
-                unknown_strategy
+                unknown_strategy,
+                use_snapshots,
             )
-            if df_merge is None:
+            for sample, paths in data_paths.items()
+        ]
+        if not build_workers:
+            build_workers = min(BUILD_WORKERS, os.cpu_count() or 1)
+        num_processes = min(build_workers, len(tasks))
+        if num_processes <= 1:
+            results = [build_sample(*task) for task in tasks]
+        else:
+            logger.info('Building the data set of {} samples with {} '
+                        'processes'.format(len(tasks), num_processes))
+            with ProcessPoolExecutor(num_processes) as executor:
+                results = list(executor.map(build_sample, *zip(*tasks)))
+
+        all_data_list = []
+        offset = 0
+        for result in results:
+            if result is None:
                 continue
-            data_list, class_idx = populate(df_merge, sample, self.aug_rate)
+            data_list, class_idx = result
             # save the file information and true, false, unknown index_mappings
-            self._update_class_indices(class_idx, len(all_data_list))
-            all_data_list.extend(data_list)
-        return np.array(all_data_list)
+            self._update_class_indices(class_idx, offset)
+            all_data_list.append(data_list)
+            offset += len(data_list)
+        return AnnotatedTensors.concatenate(all_data_list)
+
+    def _init_cache(self, cache_size: float):
+        """Allocate the shared memory cache of decoded tensors.
+
+        The cache is sized for tensors shaped like the first one in the data
+        set, and allocated before the DataLoader workers are started.
+
+        :param cache_size: Size of the cache in GiB, 0 to disable it.
+        :return: SharedTensorCache object, or None if disabled.
+        """
+        if cache_size <= 0 or len(self.data_list) == 0:
+            return None
+        encoded = read_array(*self.data_list.tensor(0), self.window_size)
+        if 'indices' in encoded:
+            logger.warning('Sparse tensors are not cached, see collate_batch')
+            return None
+        tensor_bytes = sum(
+            arr.nelement() * arr.element_size() for arr in encoded.values()
+        )
+        num_slots = min(
+            len(self.data_list.paths),
+            int(cache_size * 2 ** 30) // tensor_bytes,
+        )
+        if num_slots == 0:
+            return None
+        logger.info('Caching up to {} of {} tensors in shared memory'.format(
+            num_slots, len(self.data_list.paths)
+        ))
+        return SharedTensorCache(len(self.data_list.paths), num_slots, encoded)
+
+    def cache_stats(self) -> Dict:
+        """Get the hit rate and memory use of the tensor cache.
+
+        :return: Cache statistics, empty if there is no cache.
+        """
+        if self.cache is None:
+            return {}
+        return self.cache.stats()
+
+    def _read_tensor(self, idx: int) -> Dict[Text, torch.Tensor]:
+        """Read the tensor of an entry, through the cache if there is one.
+
+        :param idx: Index of the entry in data_list.
+        :return: The tensor as stored (key: 'X'), with its scales if it is
+        quantized, or its non-zero values if it is sparse. Read-only if it
+        comes from the cache.
+        """
+        if self.cache is None:
+            return read_array(*self.data_list.tensor(idx), self.window_size)
+        path_id = int(self.data_list.path_ids[idx])
+        encoded = self.cache.get(path_id)
+        if encoded is None:
+            encoded = read_array(*self.data_list.tensor(idx), self.window_size)
+            self.cache.put(path_id, encoded)
+        return encoded
 
     def _print_info(self, aug_mixes):
         """Print information about data
@@ -114,6 +216,7 @@ class MutationDataset(Dataset):
         """
 
         logger.info('Number of tensors: {}'.format(len(self.data_list)))
+        logger.info('Clip levels per tensor: {}'.format(self.num_clips))
         for key in self.index_mappings.keys():
             logger.info(
                 'Number of {}s: {}'.format(key, len(self.index_mappings[key]))
@@ -124,81 +227,167 @@ class MutationDataset(Dataset):
     def _update_class_indices(self, new_indices, offset):
         """ Add the class information for each index in the data_list
 
-        :param new_indices: The indices matching the AnnotatedTensor in data_list
+        :param new_indices: The indices matching the entries in data_list
         :param offset: Start index to add the indices to
         """
         for key in new_indices.keys():
-            self.index_mappings[key].extend(
-                [ind + offset for ind in new_indices[key]]
-            )
-
-    def mix_for_balance(self):
-        """When training, use balanced data when available"""
-        if self.prediction_mode in GERMLINE_MODES:
-            num_instances = len(self.index_mappings['GERMLINE'])
-        elif self.prediction_mode in SOMATIC_MODES:
-            num_instances = len(self.index_mappings['SOMATIC'])
-        else:
-            raise Exception(
-                'Prediction mode {} is not recognized'.format(
-                    self.prediction_mode
-                )
+            self.index_mappings[key] = np.concatenate(
+                [self.index_mappings[key], new_indices[key] + offset]
             )
-        indices = []
-        for key in self.index_mappings.keys():
-            if len(self.index_mappings[key]) > 0:
-                indices.extend(list(np.random.choice(
-                    self.index_mappings[key],
-                    size=min(num_instances, len(self.index_mappings[key]))
-                )))
-                random.shuffle(indices)
-                # TODO: convert to np style
-                self.balanced_data_list = [self.data_list[i] for i in indices]
 
     def __len__(self) -> int:
         """Get the length of the data set, different for training vs. testing.
 
-        For train, return length of the balanced_data_list.
+        For train, return the number of (entry, clip level) pairs, the
+        BalancedSampler decides which of them are drawn in an epoch.
         Otherwise length of the data_list.
 
         :return: Length of the data set.
         """
         if self.for_train:
-            return len(self.balanced_data_list)
+            return len(self.data_list) * self.num_clips
         return len(self.data_list)
 
     def __getitem__(self, idx: int) -> Dict:
         """Get one item with index idx from the data set.
 
-        When training, returns from the balanced_data_list, when testing returns from data_list.
+        The tensor is returned as stored, dequantization and window clipping
+        are applied to the whole batch by prepare_inputs. When training, the
+        index points to one (entry, clip level) pair, as drawn by
+        BalancedSampler. When testing, the tensor of the entry in data_list is
+        loaded once and prepare_inputs expands it to all of its clip levels on
+        the device.
 
         :param idx: Index of the item.
-        :return: A dictionary of the tensor (key: 'X'), mutation type,
-         (key: 'y1'), mutation length, type (key: 'y2'),
-         also metadata (key: 'metadata') for evaluation.
+        :return: A dictionary of the tensor (key: 'X'), its per-channel
+         scales if quantized (keys: 'scale', 'offset'), or its non-zero
+         values if sparse (keys: 'values', 'indices', 'shape'), mutation type,
+         (key: 'y1'), mutation length, type (key: 'y2'), clip level(s)
+         (key: 'clip'), also the index in data_list (key: 'index') for
+         evaluation, from which the metadata is rebuilt.
         """
         if self.for_train:
-            arr = torch.load(self.balanced_data_list[idx].tensor)
-            clip_length = self.balanced_data_list[idx].clip_length
-            if clip_length > 0:
-                arr = clip_array(arr, arr.shape[3], self.aug_rate, clip_length)
-            return {
-                'X': arr,
-                'y1': self.balanced_data_list[idx].mutation_type,
-                'y2': self.balanced_data_list[idx].mutation_length_type
-            }
-        else:
-            arr = torch.load(self.data_list[idx].tensor)
-            clip_length = self.data_list[idx].clip_length
-            if clip_length > 0:
-                arr = clip_array(arr, arr.shape[3], self.aug_rate, clip_length)
-            d = self.data_list[idx]
-            return {
-                'X': arr,
-                'y1': d.mutation_type,
-                'y2': d.mutation_length_type,
-                'metadata': d.metadata
-            }
+            idx, clip_length = divmod(int(idx), self.num_clips)
+            return dict(
+                self._read_tensor(idx),
+                y1=int(self.data_list.mutation_types[idx]),
+                y2=int(self.data_list.mutation_length_types[idx]),
+                clip=clip_length,
+            )
+
+        return dict(
+            self._read_tensor(idx),
+            y1=int(self.data_list.mutation_types[idx]),
+            y2=int(self.data_list.mutation_length_types[idx]),
+            clip=torch.arange(self.num_clips),
+            index=int(idx),
+        )
+
+
+def build_sample(
+        sample: Text,
+        paths: Dict[Text, Text],
+        prediction_mode: Text,
+        for_training: bool,
+        aug_mixes: List,
+        unknown_strategy: Text,
+        use_snapshot: bool = True,
+):
+    """Read the candidates and labels of one sample and populate its entries.
+
+    Runs in the process pool of MutationDataset._generate_data_list. The
+    result is saved as a snapshot in the sample folder and reused as long as
+    the tensor directories, candidates and labels do not change.
+
+    :param sample: Sample name.
+    :param paths: Paths to the tensors, candidates and labels of the sample.
+    :param prediction_mode: The final prediction of the network.
+    :param for_training: True if built for training, else False.
+    :param aug_mixes: Augmentation mix for purity/downsampling augmentation.
+    :param unknown_strategy: What to do with candidates with unknown labels.
+    :param use_snapshot: Reuse and save the snapshot of the sample.
+    :return: AnnotatedTensors of the sample and its class indices, starting
+    from 0, or None if the sample has no candidates.
+    """
+    if use_snapshot:
+        path = snapshot_path(
+            paths, prediction_mode, for_training, aug_mixes, unknown_strategy
+        )
+        inputs = fingerprint(paths, for_training, aug_mixes)
+        found, result = load_snapshot(path, inputs)
+        if found:
+            logger.info('Loaded snapshot: {}'.format(path))
+            return result
+
+    logger.info('Processing files in: {}'.format(paths['tensors']))
+    df_merge = get_merged_df(
+        paths, prediction_mode, for_training, aug_mixes, unknown_strategy
+    )
+    result = None
+    if df_merge is not None:
+        result = populate(df_merge, sample)
+    if use_snapshot:
+        save_snapshot(path, inputs, result)
+    return result
+
+
+def collate_batch(batch: List[Dict]) -> Dict:
+    """Collate items into a batch.
+
+    Sparse tensors are decoded into one dense batch here. Test items carry
+    all of their clip levels: their labels, indices and clip levels are
+    expanded to one row per (entry, clip level) pair, their tensors are not.
+    Tensors stay as stored, one per entry, see prepare_inputs for
+    dequantization, expansion to the clip levels and window clipping.
+
+    :param batch: Items returned by MutationDataset.__getitem__.
+    :return: The batch.
+    """
+    dense = None
+    if 'indices' in batch[0]:
+        dense = densify(
+            [item['values'] for item in batch],
+            [item['indices'] for item in batch],
+            batch[0]['shape']
+        )
+        batch = [
+            {key: value for key, value in item.items()
+             if key not in ['values', 'indices', 'shape']}
+            for item in batch
+        ]
+    collated = default_collate(batch)
+    if dense is not None:
+        collated['X'] = dense
+    if collated['clip'].dim() == 2:
+        num_clips = collated['clip'].shape[1]
+        collated['clip'] = collated['clip'].flatten()
+        for key in collated.keys():
+            if key not in ['clip', 'X', 'scale', 'offset']:
+                collated[key] = collated[key].repeat_interleave(
+                    num_clips, dim=0
+                )
+    return collated
+
+
+def loader_settings(hp, for_training: bool = False) -> Dict[Text, int]:
+    """Get the DataLoader settings, given explicitly or saved by the tuner.
+
+    They are tuned on the validation/call loader, and only used for it.
+
+    :param hp: Hyperparameters.
+    :param for_training: True for the training loader, else False.
+    :return: Number of workers, batches loaded in advance per worker, and
+    rows per batch, see MutationDataLoader.configure.
+    """
+    config = {} if for_training else load_loader_config(hp.loader_config)
+    return {
+        'num_workers': hp.num_workers if hp.num_workers is not None
+        else config.get('num_workers', NUM_WORKERS),
+        'prefetch_factor': hp.prefetch_factor if hp.prefetch_factor
+        else config.get('prefetch_factor', PREFETCH_FACTOR),
+        'batch_size': hp.inference_batch_size or
+        config.get('batch_size', hp.batch_size * 4),
+    }
 
 
 class MutationDataLoader:
@@ -228,33 +417,96 @@ class MutationDataLoader:
             hp.aug_rate,
             hp.aug_mixes,
             hp.prediction_mode,
+            hp.window_size,
+            hp.tensor_cache_size,
+            hp.build_workers,
+            hp.dataset_snapshots,
         )
-        if for_training:
-            self.batch_size = hp.batch_size
-        else:
-            self.batch_size = hp.batch_size * 4
         self.for_train = for_training
+        # During training, balancing is applied for better pos/neg ratio.
+        self.sampler = None
+        if for_training:
+            self.sampler = BalancedSampler(
+                self.dataset.index_mappings,
+                hp.prediction_mode,
+                self.dataset.num_clips,
+            )
 
-    def get_data_loader(self) -> DataLoader:
-        """Get the data loader object.
+        self.data_loader = None
+        self.batch_size = hp.batch_size
+        self.configure(**loader_settings(hp, for_training))
 
-        Behaves differently for training vs. testing.
+    def configure(
+            self, num_workers: int, prefetch_factor: int, batch_size: int
+    ):
+        """Change the DataLoader settings, the workers are restarted.
 
-        :return: Iterable DataLoader object.
+        :param num_workers: Number of worker processes.
+        :param prefetch_factor: Number of batches loaded in advance per worker.
+        :param batch_size: Number of rows per batch. When testing, each item
+        expands to all of its clip levels in the batch. Ignored in training,
+        the batch size is a hyperparameter there.
         """
-        if self.for_train:
-            self.dataset.mix_for_balance()
+        self.num_workers = num_workers
+        self.prefetch_factor = prefetch_factor
+        if not self.for_train:
+            self.batch_size = max(1, batch_size // self.dataset.num_clips)
+        self.data_loader = None
 
+    def build_data_loader(
+            self,
+            num_workers: int,
+            prefetch_factor: int,
+            batch_size: int,
+            persistent: bool = True,
+    ) -> DataLoader:
+        """Build a DataLoader object over the data set.
+
+        :param num_workers: Number of worker processes.
+        :param prefetch_factor: Number of batches loaded in advance per worker.
+        :param batch_size: Number of items per batch.
+        :param persistent: Keep the workers alive between iterations.
+        :return: Iterable DataLoader object.
+        """
         g = torch.Generator()
         g.manual_seed(5686)
-        data_loader = DataLoader(
+        kwargs = {}
+        if num_workers > 0:
+            kwargs['prefetch_factor'] = prefetch_factor
+            kwargs['persistent_workers'] = persistent
+        return DataLoader(
             self.dataset,
-            batch_size=self.batch_size,
-            num_workers=8,
+            batch_size=batch_size,
+            sampler=self.sampler,
+            num_workers=num_workers,
             pin_memory=True,
-            generator=g
+            generator=g,
+            collate_fn=collate_batch,
+            **kwargs
         )
-        return data_loader
+
+    def get_data_loader(self) -> DataLoader:
+        """Get the data loader object.
+
+        The object is built once and its workers persist across training
+        epochs and validation passes.
+
+        :return: Iterable DataLoader object.
+        """
+        if self.data_loader is None:
+            self.data_loader = self.build_data_loader(
+                self.num_workers, self.prefetch_factor, self.batch_size
+            )
+        return self.data_loader
+
+    def release(self):
+        """Stop the workers of the data loader object, and its pin memory
+        thread, e.g. before forking. The next get_data_loader restarts them.
+        """
+        iterator = getattr(self.data_loader, '_iterator', None)
+        if hasattr(iterator, '_shutdown_workers'):
+            iterator._shutdown_workers()
+        self.data_loader = None
 
     def seed_worker(worker_id):
         worker_seed = torch.initial_seed() % 2 ** 32
@@ -1,20 +1,16 @@
 import glob
-import io
+import gzip
 import logging
-import numpy as np
 import os
 import pandas as pd
-import random
 import torch
-from typing import List, Text
+from typing import Dict, List, Text
 
 from src.constants import *
+from src.dataloaders.tensor_store import list_tensors, load_encoded
 
 logger = logging.getLogger(__name__)
 
-random.seed(567497)
-torch.manual_seed(37546)
-np.random.seed(6746549)
 
 def get_merged_df(
         paths, prediction_mode, for_train, aug_list, unknown_strategy
@@ -68,42 +64,61 @@ def get_file_paths(
         input_home: Text,
         for_train: bool,
         aug_mixes: List[Text] = None
-) -> List[Text]:
+) -> pd.DataFrame:
     """Get the list of paths that point to the tensor objects.
 
+    Packed directories are listed from their shard index, others are globbed.
+
     :param input_home: Home directory for tensor objects.
     :param for_train: Whether this is initialized for training or testing.
     :param aug_mixes: Augmentation mix for purity/downsampling augmentation.
-    :return: A list of paths.
+    :return: A data frame of file names, paths and shard items.
     """
-    file_list = glob.glob(
-        '{}/purity-1.0-downsample-1.0-contamination-0.0/*.pt'.format(
-            input_home
-        ))
+    file_list = [
+        list_tensors(directory)
+        for directory in get_tensor_dirs(input_home, for_train, aug_mixes)
+    ]
+    return pd.concat(file_list, ignore_index=True)
 
-    if not for_train:
-        return file_list
 
-    if not aug_mixes:
-        return file_list
+def get_tensor_dirs(
+        input_home: Text,
+        for_train: bool,
+        aug_mixes: List[Text] = None
+) -> List[Text]:
+    """Get the directories of tensors used for a sample.
+
+    :param input_home: Home directory for tensor objects.
+    :param for_train: Whether this is initialized for training or testing.
+    :param aug_mixes: Augmentation mix for purity/downsampling augmentation.
+    :return: The directory of the original mix, followed by the existing
+    augmentation mixes when training.
+    """
+    directories = [os.path.join(
+        input_home, 'purity-1.0-downsample-1.0-contamination-0.0'
+    )]
 
-    for aug in aug_mixes:
-        upsampled_home = os.path.join(input_home, aug)
-        if os.path.exists(upsampled_home):
-            file_list.extend(glob.glob('{}/{}'.format(upsampled_home, '*.pt')))
+    if for_train and aug_mixes:
+        for aug in aug_mixes:
+            upsampled_home = os.path.join(input_home, aug)
+            if os.path.exists(upsampled_home):
+                directories.append(upsampled_home)
 
-    return file_list
+    return directories
 
 
-def get_paths(file_list: List[Text]) -> pd.DataFrame:
+def get_paths(file_list: pd.DataFrame) -> pd.DataFrame:
     """Given a file list, generate data frame with path and variant information.
 
-    :param file_list: List of full paths to tensor files.
-    :param columns: Column names of the data frame.
+    :param file_list: Data frame of tensor file names, paths and shard items.
     :return: A dataframe containing full path, chromosome, position and other
     variant information.
     """
-    metadata = list(map(get_variant_properties_from_file, file_list))
+    if len(file_list) == 0:
+        return pd.DataFrame(columns=FILE_NAME_COLUMNS_NO_REP + ['SHARD_ITEM'])
+    metadata = list(map(
+        get_variant_properties_from_file, file_list['FILE_NAME']
+    ))
     # generate data frame from file paths
     df_paths = pd.DataFrame(metadata)
     try:
@@ -111,6 +126,8 @@ def get_paths(file_list: List[Text]) -> pd.DataFrame:
     except:
         df_paths.columns = FILE_NAME_COLUMNS_NO_REP
     df_paths.loc[:, 'POS'] = df_paths['POS'].astype(int)
+    df_paths.loc[:, 'FULL_PATH'] = file_list['FULL_PATH'].values
+    df_paths.loc[:, 'SHARD_ITEM'] = file_list['SHARD_ITEM'].values
 
     return df_paths
 
@@ -162,40 +179,71 @@ def combine_candidates_and_labels(
 
 
 def parse_variants(
-        path: Text, prediction_mode: Text
+        path: Text,
+        prediction_mode: Text,
+        chunk_size: int = VARIANT_CHUNK_SIZE,
 ) -> pd.DataFrame:
-    """Parse a VCF formatted file or a TSV
+    """Parse a VCF formatted file or a TSV, plain or (b)gzipped
+
+    The format is detected from the extension, or from the header. The file
+    is streamed in chunks and only the columns in VARIANT_COLUMNS are kept,
+    variants of the other type (SNV/indel) are dropped chunk by chunk, so the
+    memory needed is bounded by the variants kept.
 
     :param path: Path to the candidate file.
     :param prediction_mode: What type of variant to predict (point/indel)
+    :param chunk_size: Number of lines parsed at once.
     :return: A data frame of variants.
     """
+    compression = 'gzip' if _is_gzipped(path) else None
+    header_lines, columns = _read_header(path, compression)
+    chrom_column = '#CHROM' if '#CHROM' in columns else 'CHROM'
+    names = {chrom_column: 'CHROM'}
+    usecols = [
+        column for column in columns
+        if names.get(column, column) in VARIANT_COLUMNS
+    ]
+    if not set(VARIANT_COLUMNS[:4]) <= {names.get(c, c) for c in usecols}:
+        raise Exception(
+            'Wrong variants file type/format. Please check {}.'.format(path)
+        )
+    dtype = {chrom_column: str, 'REF': str, 'ALT': str}
+    if chrom_column == '#CHROM':
+        dtype.update({'POS': int, 'FILTER': str})
+
+    chunks = []
     try:
-        df = pd.read_csv(path, sep='\t', dtype={'CHROM': str})
-        df['CHROM'] = df['CHROM'].astype(str)
-        if len(df.columns) < 4:
-            raise Exception('Read the file in wrong format. Trying again.')
-    except: #TODO: just check the file extension...
-        try:
-            with open(path, 'r') as f:
-                lines = [l for l in f if not l.startswith('##')]
-
-            # Convert the lines to a dataframe.
-            df = pd.read_csv(
-                io.StringIO(u''.join(lines)),
-                dtype={'#CHROM': str, 'POS': int, 'ID': str, 'REF': str,
-                       'ALT': str, 'QUAL': str, 'FILTER': str, 'INFO': str},
-                sep='\t'
+        reader = pd.read_csv(
+            path,
+            sep='\t',
+            skiprows=header_lines,
+            usecols=usecols,
+            dtype=dtype,
+            compression=compression,
+            chunksize=chunk_size,
+        )
+        for chunk in reader:
+            chunks.append(
+                filter_variants(chunk.rename(columns=names), prediction_mode)
             )
-
-            # Rename column
-            df.rename(columns={'#CHROM': 'CHROM'}, inplace=True)
-        except:
-            raise Exception(
-                'Wrong variants file type/format. Please check {}.'.format(
-                    path
-                )
+    except (ValueError, pd.errors.ParserError) as e:
+        raise Exception(
+            'Wrong variants file type/format. Please check {}. {}'.format(
+                path, e
             )
+        )
+    if len(chunks) == 0:
+        return pd.DataFrame(columns=[names.get(c, c) for c in usecols])
+    return pd.concat(chunks, ignore_index=True)
+
+
+def filter_variants(df: pd.DataFrame, prediction_mode: Text) -> pd.DataFrame:
+    """Keep the variants of the type predicted.
+
+    :param df: Data frame of variants with REF and ALT columns.
+    :param prediction_mode: What type of variant to predict (point/indel)
+    :return: SNVs for SNP_MODES, indels for INDEL_MODES.
+    """
     if prediction_mode in SNP_MODES:
         df = df[df['REF'].str.len() == df['ALT'].str.len()]
     if prediction_mode in INDEL_MODES:
@@ -203,46 +251,83 @@ def parse_variants(
     return df
 
 
+def _is_gzipped(path: Text) -> bool:
+    """Check the magic bytes of a file for gzip (and bgzip) compression."""
+    with open(path, 'rb') as f:
+        return f.read(2) == b'\x1f\x8b'
+
+
+def _read_header(path: Text, compression: Text = None):
+    """Find the column names of a VCF or a TSV.
+
+    Only the meta-information lines (##) and the header line are read.
+
+    :param path: Path to the variants file.
+    :param compression: 'gzip' or None.
+    :return: Number of meta-information lines to skip, and the column names.
+    """
+    is_vcf = path.endswith(VCF_EXTENSIONS)
+    opener = gzip.open if compression == 'gzip' else open
+    with opener(path, 'rt') as f:
+        header_lines = 0
+        line = f.readline()
+        while line.startswith('##'):
+            is_vcf = True
+            header_lines += 1
+            line = f.readline()
+    if is_vcf and not line.startswith('#CHROM'):
+        raise Exception(
+            'Wrong variants file type/format. Please check {}.'.format(path)
+        )
+    return header_lines, line.rstrip('\r\n').split('\t')
+
+
 def read_array(
         file_path: str,
-        clip_length: int,
-        aug_rate: int,
-) -> torch.Tensor:
-    """ Read the input array from disk.
-
-    :param file_path: Path to the tensor file.
-    :param clip_length: How much to clip from each side of the tensor.
-    :param aug_rate: Augmentation rate for window size augmentation.
-    :return:
+        shard_item: int = NO_SHARD_ITEM,
+        window_size: int = 0,
+) -> Dict[Text, torch.Tensor]:
+    """ Read the input array from disk, as stored.
+
+    Sparse tensors are decoded into dense batches by collate_batch.
+    Dequantization and window clipping are applied to whole batches, after
+    they are moved to the device, see prepare_inputs.
+
+    :param file_path: Path to the tensor file, or to the shard containing it.
+    :param shard_item: Position of the tensor in the shard, if packed.
+    :param window_size: Width to crop the tensor to around the variant, 0 to
+    keep the full width.
+    :return: The tensor (key: 'X'), with its scales if stored quantized, or
+    its non-zero values if stored sparse, see load_encoded.
     """
-    arr = torch.load(file_path)
-    if clip_length > 0:
-        arr = clip_array(arr, arr.shape[3], aug_rate, clip_length)
-    return arr
+    return load_encoded(file_path, shard_item, window_size)
 
 
-def clip_array(
+def clip_batch(
         arr: torch.Tensor,
-        width: int,
+        clip_lengths: torch.Tensor,
         aug_rate: int,
-        clip_length: int
 ) -> torch.Tensor:
-    """ Zero out sides of the tensor to mimick a smaller window size around the
-    variant.
+    """ Zero out sides of the tensors in a batch to mimick smaller window sizes
+    around the variants.
+
+    A single width mask is built for the batch and broadcast over the other
+    dimensions, instead of slicing each tensor on its own.
 
-    :param arr: The input tensor
-    :param width: Width of the tensor
+    :param arr: The batch of input tensors, width in the last dimension.
+    :param clip_lengths: How much to clip from each side, one per tensor.
     :param aug_rate: Augmentation rate for window size augmentation.
-    :param clip_length: How much to clip from each side of the tensor.
-    :return: Tensor with certain amount (or none) zeroed out widthwise.
+    :return: Batch with certain amount (or none) zeroed out widthwise.
     """
-    zero_out_amount = 0
-    if aug_rate > 0:
-        zero_out_amount = int(
-            (width / (aug_rate * 2)) * clip_length)
-    if zero_out_amount * 2 == width:
-        zero_out_amount = zero_out_amount - 1
-    arr[:, :, :, 0:zero_out_amount] = 0
-    arr[:, :, :, width - zero_out_amount:width] = 0
-
-    return arr
+    if aug_rate <= 0 or not bool((clip_lengths > 0).any()):
+        return arr
+    width = arr.shape[-1]
+    zero_out_amount = torch.floor(
+        (width / (aug_rate * 2)) * clip_lengths.to(torch.float64)
+    ).long()
+    zero_out_amount[zero_out_amount * 2 == width] -= 1
+    columns = torch.arange(width, device=arr.device)
+    keep = (columns >= zero_out_amount[:, None]) & \
+           (columns < width - zero_out_amount[:, None])
+    keep = keep.view([arr.shape[0]] + [1] * (arr.dim() - 2) + [width])
+    return arr.masked_fill_(~keep, 0)
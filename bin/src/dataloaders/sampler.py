@@ -0,0 +1,65 @@
+import logging
+from typing import Dict, Iterator, Text
+
+import numpy as np
+from torch.utils.data import Sampler
+
+from src.constants import *
+
+logger = logging.getLogger(__name__)
+
+
+class BalancedSampler(Sampler):
+    """Draw class-balanced (entry, clip level) indices for an epoch.
+
+    Every class is sampled with replacement, at most as many entries as the
+    class being predicted (somatic or germline) has. Indices are drawn as
+    NumPy arrays, the data set itself is never copied or rebuilt.
+    """
+
+    def __init__(
+            self,
+            index_mappings: Dict[Text, np.ndarray],
+            prediction_mode: Text,
+            num_clips: int = 1,
+    ):
+        """Initialize the sampler.
+
+        :param index_mappings: Indices of the entries of each class.
+        :param prediction_mode: The final prediction of the network.
+        somatic/germline snv/indel etc.
+        :param num_clips: Number of clip levels per entry, the drawn indices
+        are entry * num_clips + clip level.
+        """
+        if prediction_mode in GERMLINE_MODES:
+            num_instances = len(index_mappings['GERMLINE'])
+        elif prediction_mode in SOMATIC_MODES:
+            num_instances = len(index_mappings['SOMATIC'])
+        else:
+            raise Exception(
+                'Prediction mode {} is not recognized'.format(prediction_mode)
+            )
+        self.num_clips = num_clips
+        self.class_indices = [
+            indices for indices in index_mappings.values() if len(indices) > 0
+        ]
+        self.sizes = [
+            min(num_instances, len(indices)) * num_clips
+            for indices in self.class_indices
+        ]
+
+    def __len__(self) -> int:
+        """Get the number of indices drawn per epoch."""
+        return sum(self.sizes)
+
+    def __iter__(self) -> Iterator[int]:
+        """Draw the indices of one epoch, shuffled across classes."""
+        indices = np.zeros(0, dtype=np.int64)
+        if len(self.class_indices) > 0:
+            indices = np.concatenate([
+                np.random.choice(class_indices, size=size) * self.num_clips
+                + np.random.randint(0, self.num_clips, size=size)
+                for class_indices, size in zip(self.class_indices, self.sizes)
+            ])
+        np.random.shuffle(indices)
+        return iter(indices)
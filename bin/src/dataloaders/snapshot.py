@@ -0,0 +1,141 @@
+import hashlib
+import json
+import logging
+import os
+import zipfile
+from typing import Dict, List, Optional, Text, Tuple
+
+import numpy as np
+
+from src.constants import *
+from src.dataloaders.annotated_tensor import AnnotatedTensors
+from src.dataloaders.input_parsers import get_tensor_dirs
+
+logger = logging.getLogger(__name__)
+
+CLASS_PREFIX = 'class_indices/'
+
+
+def snapshot_path(
+        paths: Dict[Text, Text],
+        prediction_mode: Text,
+        for_train: bool,
+        aug_mixes: List[Text],
+        unknown_strategy: Text,
+) -> Text:
+    """Get the path of the snapshot of a sample for the given settings.
+
+    Different settings, e.g. prediction modes, get different snapshots, so
+    switching between them does not rebuild the data sets. Snapshots built
+    with another DATASET_SNAPSHOT_VERSION are not used.
+
+    :param paths: Paths to the tensors, candidates and labels of the sample.
+    :param prediction_mode: The final prediction of the network.
+    :param for_train: True if built for training, else False.
+    :param aug_mixes: Augmentation mix for purity/downsampling augmentation.
+    :param unknown_strategy: What to do with candidates with unknown labels.
+    :return: Path to the .npz file in the sample folder.
+    """
+    settings = json.dumps([
+        DATASET_SNAPSHOT_VERSION,
+        os.path.split(os.path.normpath(paths['tensors']))[1],
+        prediction_mode,
+        bool(for_train),
+        list(aug_mixes or []) if for_train else [],
+        unknown_strategy,
+        paths['labels'] is not None,
+    ])
+    key = hashlib.sha1(settings.encode('utf-8')).hexdigest()[:16]
+    sample_dir = os.path.dirname(os.path.normpath(paths['tensors']))
+    return os.path.join(sample_dir, DATASET_SNAPSHOT_FNAME.format(key))
+
+
+def fingerprint(
+        paths: Dict[Text, Text],
+        for_train: bool,
+        aug_mixes: List[Text],
+) -> Text:
+    """Fingerprint the inputs of a sample by their modification times and
+    sizes.
+
+    Adding or removing tensors changes the modification time of their
+    directory, packing a directory replaces its shard index.
+
+    :param paths: Paths to the tensors, candidates and labels of the sample.
+    :param for_train: True if built for training, else False.
+    :param aug_mixes: Augmentation mix for purity/downsampling augmentation.
+    :return: The fingerprint, as JSON.
+    """
+    inputs = [paths['candidates'], paths['labels']]
+    for directory in get_tensor_dirs(paths['tensors'], for_train, aug_mixes):
+        inputs.extend([directory, os.path.join(directory, TENSOR_INDEX_FNAME)])
+    stats = []
+    for path in inputs:
+        if path is None or not os.path.exists(path):
+            stats.append([path, None, None])
+            continue
+        stat = os.stat(path)
+        stats.append([path, stat.st_mtime_ns, stat.st_size])
+    return json.dumps(stats)
+
+
+def load_snapshot(
+        path: Text, expected: Text
+) -> Tuple[bool, Optional[Tuple[AnnotatedTensors, Dict]]]:
+    """Load the snapshot of a sample if its inputs did not change.
+
+    :param path: Path to the snapshot.
+    :param expected: Fingerprint of the current inputs.
+    :return: Whether the snapshot could be used, and the data set of the
+    sample with its class indices, or None if the sample has no entries.
+    """
+    if not os.path.exists(path):
+        return False, None
+    try:
+        with np.load(path, allow_pickle=False) as snapshot:
+            if str(snapshot['fingerprint']) != expected:
+                logger.info('Inputs changed, rebuilding: {}'.format(path))
+                return False, None
+            if bool(snapshot['empty']):
+                return True, None
+            arrays = {key: snapshot[key] for key in snapshot.files}
+    except (OSError, ValueError, KeyError, EOFError,
+            zipfile.BadZipFile) as e:
+        # e.g. truncated by a run that was killed, it is rebuilt
+        logger.warning('Could not read snapshot {}: {}'.format(path, e))
+        return False, None
+    class_indices = {
+        key[len(CLASS_PREFIX):]: arrays[key]
+        for key in arrays if key.startswith(CLASS_PREFIX)
+    }
+    return True, (AnnotatedTensors.from_arrays(arrays), class_indices)
+
+
+def save_snapshot(
+        path: Text,
+        expected: Text,
+        result: Optional[Tuple[AnnotatedTensors, Dict]],
+):
+    """Save the data set of a sample, to be reused while its inputs do not
+    change.
+
+    :param path: Path to the snapshot.
+    :param expected: Fingerprint of the inputs it was built from.
+    :param result: The data set of the sample with its class indices, or
+    None if the sample has no entries.
+    """
+    arrays = {'fingerprint': np.array(expected), 'empty': np.array(True)}
+    if result is not None:
+        data_list, class_indices = result
+        arrays['empty'] = np.array(False)
+        arrays.update(data_list.to_arrays())
+        for class_name, indices in class_indices.items():
+            arrays[CLASS_PREFIX + class_name] = np.asarray(indices)
+    # runs of the same sample may save it concurrently
+    tmp_path = '{}.{}.tmp'.format(path, os.getpid())
+    try:
+        with open(tmp_path, 'wb') as f:
+            np.savez(f, **arrays)
+        os.replace(tmp_path, path)
+    except OSError as e:
+        logger.warning('Could not save snapshot {}: {}'.format(path, e))
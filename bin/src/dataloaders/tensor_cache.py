@@ -0,0 +1,128 @@
+import logging
+import multiprocessing
+from typing import Dict, Optional, Text
+
+import torch
+from torch.utils.data import get_worker_info
+
+logger = logging.getLogger(__name__)
+
+# Rows of hit/miss counters: one for the main process, one per worker.
+MAX_COUNTER_ROWS = 257
+# Slot table values of tensors not cached, and of tensors being copied in.
+NOT_CACHED = -1
+PENDING = -2
+
+
+class SharedTensorCache:
+    """Bounded cache of decoded tensors in shared memory.
+
+    Tensors are cached as read from disk: unpickled or memory-mapped, and
+    cropped, but still quantized if stored quantized.
+
+    The buffer is allocated once, before the DataLoader workers start, and
+    every worker reads and fills the same buffer. Slots are handed out first
+    come, first served until the buffer is full and cached tensors are never
+    evicted, so every validation pass after the first reads the same tensors
+    from memory, and so do repeated draws of the balanced sampler.
+    """
+
+    def __init__(
+            self,
+            num_keys: int,
+            num_slots: int,
+            example: Dict[Text, torch.Tensor],
+    ):
+        """Allocate the shared buffers.
+
+        :param num_keys: Number of distinct tensors that may be cached.
+        :param num_slots: Number of tensors that fit in the cache.
+        :param example: A tensor as read from disk, with its scales if it is
+        quantized. Tensors of other shapes or types are not cached.
+        """
+        self.num_slots = num_slots
+        self.data = {
+            key: torch.zeros(
+                [num_slots] + list(arr.shape), dtype=arr.dtype
+            ).share_memory_()
+            for key, arr in example.items()
+        }
+        self.slots = torch.full(
+            (num_keys,), NOT_CACHED, dtype=torch.int64
+        ).share_memory_()
+        self.next_slot = torch.zeros(1, dtype=torch.int64).share_memory_()
+        self.counters = torch.zeros(
+            (MAX_COUNTER_ROWS, 2), dtype=torch.int64
+        ).share_memory_()
+        self.lock = multiprocessing.Lock()
+
+    def get(self, key: int) -> Optional[Dict[Text, torch.Tensor]]:
+        """Get a tensor from the cache.
+
+        :param key: Key of the tensor, e.g. its path id.
+        :return: Read-only views of the cached tensor and its scales, None if
+        not cached.
+        """
+        slot = int(self.slots[key])
+        row = self._counter_row()
+        if slot < 0:
+            self.counters[row, 1] += 1
+            return None
+        self.counters[row, 0] += 1
+        return {name: data[slot] for name, data in self.data.items()}
+
+    def put(self, key: int, encoded: Dict[Text, torch.Tensor]):
+        """Put a tensor into the cache, if there is room left.
+
+        The slot is reserved under the lock, the tensor is copied outside of
+        it and only published once complete. Readers see the tensor as not
+        cached until then.
+
+        :param key: Key of the tensor, e.g. its path id.
+        :param encoded: The tensor as read from disk, with its scales if it is
+        quantized.
+        """
+        if encoded.keys() != self.data.keys() or any(
+                arr.shape != self.data[name].shape[1:]
+                or arr.dtype != self.data[name].dtype
+                for name, arr in encoded.items()
+        ):
+            return
+        with self.lock:
+            slot = int(self.next_slot[0])
+            if slot >= self.num_slots or int(self.slots[key]) != NOT_CACHED:
+                return
+            self.next_slot[0] = slot + 1
+            self.slots[key] = PENDING
+        for name, arr in encoded.items():
+            self.data[name][slot].copy_(arr)
+        self.slots[key] = slot
+
+    def stats(self) -> Dict:
+        """Get the hit rate and memory use of the cache.
+
+        :return: Hits, misses, hit rate, cached tensors and bytes in use.
+        """
+        hits, misses = self.counters.sum(dim=0).tolist()
+        filled = min(int(self.next_slot[0]), self.num_slots)
+        slot_bytes = sum(
+            data[0].nelement() * data.element_size()
+            for data in self.data.values()
+        )
+        return {
+            'hits': hits,
+            'misses': misses,
+            'hit_rate': hits / max(hits + misses, 1),
+            'cached_tensors': filled,
+            'capacity': self.num_slots,
+            'bytes_used': filled * slot_bytes,
+            'bytes_allocated': self.num_slots * slot_bytes,
+        }
+
+    @staticmethod
+    def _counter_row() -> int:
+        """Get the counter row of this process, workers do not share rows."""
+        worker_info = get_worker_info()
+        if worker_info is None:
+            return 0
+        return min(worker_info.id + 1, MAX_COUNTER_ROWS - 1)
@@ -0,0 +1,506 @@
+import glob
+import logging
+import os
+from collections import defaultdict
+from typing import Dict, List, Text
+
+import numpy as np
+import pandas as pd
+import torch
+
+from src.constants import *
+
+logger = logging.getLogger(__name__)
+
+
+class ShardReader:
+    """Read single tensors from packed shards through memory maps.
+
+    Shards are opened lazily, once per process, and kept open. Only the bytes
+    of the requested tensor are paged in, no pickle is involved.
+    """
+
+    def __init__(self):
+        """Initialize the reader without any open shard."""
+        self._shards = {}
+        self._encodings = {}
+
+    def read(
+            self, shard_path: Text, item: int, width: int = 0
+    ) -> Dict[Text, torch.Tensor]:
+        """Read one tensor from a shard, as stored.
+
+        :param shard_path: Path to the .npy shard.
+        :param item: Position of the tensor in the shard.
+        :param width: Width to crop the tensor to around its center, 0 to
+        keep the full width. Only the cropped columns are read.
+        :return: A writable copy of the tensor (key: 'X'), and for uint8
+        shards its per-channel scale and offset (keys: 'scale', 'offset').
+        For sparse shards, the non-zero values of the tensor and their flat
+        positions instead of 'X' (keys: 'values', 'indices', 'shape'), see
+        densify.
+        """
+        shard = self._open(shard_path)
+        if 'indptr' in shard:
+            start, end = shard['indptr'][item], shard['indptr'][item + 1]
+            return crop_sparse(
+                torch.from_numpy(np.array(shard['values'][start:end])),
+                torch.from_numpy(
+                    shard['indices'][start:end].astype(np.int64)
+                ),
+                torch.from_numpy(shard['shape'].astype(np.int64)),
+                width
+            )
+        window = crop_window(shard['X'].shape[-1], width)
+        encoded = {
+            'X': torch.from_numpy(np.array(shard['X'][item, ..., window]))
+        }
+        if 'scales' in shard:
+            scales = np.array(shard['scales'][item])
+            encoded['scale'] = torch.from_numpy(scales[0])
+            encoded['offset'] = torch.from_numpy(scales[1])
+        return encoded
+
+    def _open(self, shard_path: Text) -> Dict[Text, np.ndarray]:
+        """Memory-map a shard and the files kept next to it.
+
+        The files are chosen by the encoding of the shard in the index of
+        its directory.
+
+        :param shard_path: Path to the .npy shard.
+        :return: The shard (key: 'X'), and its scales if it is quantized
+        (key: 'scales'). For sparse shards, the values, their positions, the
+        offsets of each tensor and the tensor shape (keys: 'values',
+        'indices', 'indptr', 'shape') instead.
+        """
+        if shard_path not in self._shards:
+            directory, shard_name = os.path.split(shard_path)
+            if directory not in self._encodings:
+                self._encodings[directory] = shard_encodings(directory)
+            encoding = self._encodings[directory][shard_name]
+            shard = np.load(shard_path, mmap_mode='r', allow_pickle=False)
+            if encoding == 'sparse':
+                arrays = {
+                    'values': shard,
+                    'indices': _load_sidecar(
+                        shard_path, TENSOR_INDICES_SUFFIX
+                    ),
+                    'indptr': np.array(
+                        _load_sidecar(shard_path, TENSOR_INDPTR_SUFFIX)
+                    ),
+                    'shape': np.array(
+                        _load_sidecar(shard_path, TENSOR_SHAPE_SUFFIX)
+                    ),
+                }
+            else:
+                arrays = {'X': shard}
+                if encoding == 'uint8':
+                    arrays['scales'] = _load_sidecar(
+                        shard_path, TENSOR_SCALES_SUFFIX
+                    )
+            self._shards[shard_path] = arrays
+        return self._shards[shard_path]
+
+    def __getstate__(self):
+        """Do not send open memory maps to spawned worker processes."""
+        return {'_shards': {}, '_encodings': {}}
+
+
+_READER = ShardReader()
+
+
+def sidecar_path(shard_path: Text, suffix: Text) -> Text:
+    """Get the path of a file kept next to a shard, e.g. its scales.
+
+    :param shard_path: Path to the .npy shard.
+    :param suffix: Suffix replacing the .npy extension of the shard.
+    :return: Path to the file.
+    """
+    return os.path.splitext(shard_path)[0] + suffix
+
+
+def _load_sidecar(shard_path: Text, suffix: Text) -> np.ndarray:
+    """Memory-map a file kept next to a shard.
+
+    :param shard_path: Path to the .npy shard.
+    :param suffix: Suffix of the file, e.g. TENSOR_SCALES_SUFFIX.
+    :return: The memory-mapped array.
+    """
+    return np.load(
+        sidecar_path(shard_path, suffix), mmap_mode='r', allow_pickle=False
+    )
+
+
+def load_encoded(
+        path: Text, item: int = NO_SHARD_ITEM, width: int = 0
+) -> Dict[Text, torch.Tensor]:
+    """Load a tensor as stored, either from its own .pt file or from a shard.
+
+    :param path: Path to the .pt file, or to the shard.
+    :param item: Position of the tensor in the shard, NO_SHARD_ITEM for .pt.
+    :param width: Width to crop the tensor to around its center, 0 to keep
+    the full width.
+    :return: The tensor (key: 'X'), and for uint8 shards its per-channel
+    scale and offset (keys: 'scale', 'offset'), see dequantize. For sparse
+    shards, its non-zero values instead (keys: 'values', 'indices',
+    'shape'), see densify.
+    """
+    if item == NO_SHARD_ITEM:
+        arr = torch.load(path)
+        return {'X': arr[..., crop_window(arr.shape[-1], width)].contiguous()}
+    return _READER.read(path, item, width)
+
+
+def load_tensor(
+        path: Text, item: int = NO_SHARD_ITEM, width: int = 0
+) -> torch.Tensor:
+    """Load a tensor either from its own .pt file or from a packed shard.
+
+    :param path: Path to the .pt file, or to the shard.
+    :param item: Position of the tensor in the shard, NO_SHARD_ITEM for .pt.
+    :param width: Width to crop the tensor to around its center, 0 to keep
+    the full width.
+    :return: The tensor, dequantized if it is stored quantized.
+    """
+    encoded = load_encoded(path, item, width)
+    if 'indices' in encoded:
+        return densify(
+            [encoded['values']], [encoded['indices']], encoded['shape']
+        )[0]
+    if 'scale' not in encoded:
+        return encoded['X']
+    return dequantize(
+        encoded['X'].unsqueeze(0),
+        encoded['scale'].unsqueeze(0),
+        encoded['offset'].unsqueeze(0)
+    )[0]
+
+
+def quantize(arrs: np.ndarray, encoding: Text):
+    """Encode a stack of tensors for storage.
+
+    uint8 tensors get a scale and an offset per tensor and channel (the
+    first dimension of a tensor), mapping each channel's range to 0..255.
+
+    :param arrs: Stack of tensors, shaped (tensors, channels, ...).
+    :param encoding: One of TENSOR_ENCODINGS.
+    :return: Encoded stack, and scales shaped (tensors, 2, channels) with
+    the scale and offset, or None if the encoding does not use them.
+    """
+    if encoding == 'raw':
+        return arrs, None
+    if encoding == 'float16':
+        return arrs.astype(np.float16), None
+    if encoding != 'uint8':
+        raise Exception('Tensor encoding {} is not supported. Should be one '
+                        'of: {}'.format(encoding, TENSOR_ENCODINGS))
+    axes = tuple(range(2, arrs.ndim))
+    offset = arrs.min(axis=axes).astype(np.float32)
+    scale = (arrs.max(axis=axes) - offset).astype(np.float32) / 255
+    scale[scale == 0] = 1
+    shape = list(offset.shape) + [1] * len(axes)
+    quantized = np.rint(
+        (arrs - offset.reshape(shape)) / scale.reshape(shape)
+    ).clip(0, 255).astype(np.uint8)
+    return quantized, np.stack([scale, offset], axis=1)
+
+
+def dequantize(
+        arr: torch.Tensor, scale: torch.Tensor, offset: torch.Tensor
+) -> torch.Tensor:
+    """Decode a batch of uint8 tensors, e.g. after moving it to the device.
+
+    :param arr: Batch of quantized tensors, shaped (batch, channels, ...).
+    :param scale: Scale per tensor and channel, shaped (batch, channels).
+    :param offset: Offset per tensor and channel, shaped (batch, channels).
+    :return: The batch in float.
+    """
+    shape = list(scale.shape) + [1] * (arr.dim() - 2)
+    return arr.float() * scale.view(shape) + offset.view(shape)
+
+
+def sparsify(arrs: np.ndarray):
+    """Encode a stack of tensors as their non-zero values.
+
+    :param arrs: Stack of tensors, shaped (tensors, ...).
+    :return: The non-zero values of all tensors, their flat positions within
+    their tensor as int32, and the offsets of each tensor's values, shaped
+    (tensors + 1,).
+    """
+    flat = arrs.reshape(len(arrs), -1)
+    rows, indices = np.nonzero(flat)
+    indptr = np.zeros(len(arrs) + 1, dtype=np.int64)
+    np.cumsum(np.bincount(rows, minlength=len(arrs)), out=indptr[1:])
+    return flat[rows, indices], indices.astype(np.int32), indptr
+
+
+def crop_sparse(
+        values: torch.Tensor,
+        indices: torch.Tensor,
+        shape: torch.Tensor,
+        width: int,
+) -> Dict[Text, torch.Tensor]:
+    """Crop a sparse tensor to a width around its center.
+
+    :param values: Non-zero values of the tensor.
+    :param indices: Flat positions of the values within the tensor.
+    :param shape: Shape of the dense tensor, width in the last dimension.
+    :param width: Width to crop to, 0 to keep the full width.
+    :return: The values, positions and shape of the cropped tensor
+    (keys: 'values', 'indices', 'shape').
+    """
+    full_width = int(shape[-1])
+    window = crop_window(full_width, width)
+    if window == slice(None):
+        return {'values': values, 'indices': indices, 'shape': shape}
+    columns = indices % full_width
+    keep = (columns >= window.start) & (columns < window.stop)
+    shape = shape.clone()
+    shape[-1] = width
+    return {
+        'values': values[keep],
+        'indices': indices[keep] // full_width * width
+        + columns[keep] - window.start,
+        'shape': shape,
+    }
+
+
+def densify(
+        values: List[torch.Tensor],
+        indices: List[torch.Tensor],
+        shape: torch.Tensor,
+) -> torch.Tensor:
+    """Decode sparse tensors of the same shape into one dense batch.
+
+    :param values: Non-zero values of each tensor.
+    :param indices: Flat positions of the values within each tensor.
+    :param shape: Shape of one dense tensor.
+    :return: The batch, shaped (tensors, *shape).
+    """
+    shape = [int(dim) for dim in shape]
+    numel = int(np.prod(shape))
+    lengths = torch.tensor([len(item) for item in indices])
+    offsets = torch.repeat_interleave(
+        torch.arange(len(indices)) * numel, lengths
+    )
+    batch = torch.zeros(
+        len(indices) * numel,
+        dtype=values[0].dtype if len(values) > 0 else torch.float
+    )
+    if lengths.sum() > 0:
+        batch[torch.cat(indices) + offsets] = torch.cat(values)
+    return batch.view([len(indices)] + shape)
+
+
+def crop_window(full_width: int, width: int) -> slice:
+    """Get the centered columns to keep when cropping a tensor.
+
+    :param full_width: Width of the stored tensor.
+    :param width: Width to crop to, 0 (or larger than full_width) to keep all.
+    :return: Slice over the width dimension.
+    """
+    if width <= 0 or width >= full_width:
+        return slice(None)
+    start = (full_width - width) // 2
+    return slice(start, start + width)
+
+
+def is_packed(directory: Text) -> bool:
+    """Check whether the tensors of a directory are packed into shards.
+
+    :param directory: Directory of tensors, e.g. purity-1.0-...-0.0
+    :return: True if the directory has a shard index.
+    """
+    return os.path.exists(os.path.join(directory, TENSOR_INDEX_FNAME))
+
+
+def list_tensors(directory: Text) -> pd.DataFrame:
+    """List the tensors of a directory, packed or not.
+
+    :param directory: Directory of tensors, e.g. purity-1.0-...-0.0
+    :return: Data frame with the original file name of every tensor, the path
+    to read it from, and its item number in the shard (NO_SHARD_ITEM if the
+    tensor is stored in its own .pt file).
+    """
+    if is_packed(directory):
+        index = read_index(directory)
+        return pd.DataFrame({
+            'FILE_NAME': index['FILE_NAME'].values,
+            'FULL_PATH': [
+                os.path.join(directory, shard) for shard in index['SHARD']
+            ],
+            'SHARD_ITEM': index['ITEM'].values,
+        })
+
+    file_list = glob.glob('{}/*.pt'.format(directory))
+    return pd.DataFrame({
+        'FILE_NAME': [os.path.split(path)[1] for path in file_list],
+        'FULL_PATH': file_list,
+        'SHARD_ITEM': np.full(len(file_list), NO_SHARD_ITEM, dtype=np.int64),
+    })
+
+
+def read_index(directory: Text) -> pd.DataFrame:
+    """Read the shard index of a packed directory.
+
+    :param directory: Directory of packed tensors.
+    :return: Data frame with the columns in TENSOR_INDEX_COLUMNS.
+    """
+    return pd.read_csv(
+        os.path.join(directory, TENSOR_INDEX_FNAME),
+        sep='\t',
+        dtype={'FILE_NAME': str, 'SHARD': str, 'ITEM': np.int64,
+               'ENCODING': str}
+    )
+
+
+def shard_encodings(directory: Text) -> Dict[Text, Text]:
+    """Get the encoding of every shard of a packed directory.
+
+    Indexes written before the encoding was recorded have no ENCODING
+    column. Their shards are told apart by the files kept next to them.
+
+    :param directory: Directory of packed tensors.
+    :return: One of TENSOR_ENCODINGS per shard file name.
+    """
+    index = read_index(directory)
+    if 'ENCODING' in index.columns:
+        shards = index[['SHARD', 'ENCODING']].drop_duplicates('SHARD')
+        return dict(zip(shards['SHARD'], shards['ENCODING']))
+    encodings = {}
+    for shard in index['SHARD'].unique():
+        shard_path = os.path.join(directory, shard)
+        if os.path.exists(sidecar_path(shard_path, TENSOR_INDPTR_SUFFIX)):
+            encodings[shard] = 'sparse'
+        elif os.path.exists(sidecar_path(shard_path, TENSOR_SCALES_SUFFIX)):
+            encodings[shard] = 'uint8'
+        else:
+            encodings[shard] = 'raw'
+    return encodings
+
+
+def pack_directory(
+        directory: Text,
+        shard_size: int = TENSOR_SHARD_SIZE,
+        remove_originals: bool = False,
+        encoding: Text = 'raw',
+) -> int:
+    """Pack the .pt tensors of a directory into .npy shards with an index.
+
+    Tensors of different shapes or types end up in different shards. Shards
+    left by an earlier packing are removed first. The index records the
+    encoding of every shard and is written last, so a directory is only used
+    as packed once all of its shards are complete.
+
+    :param directory: Directory of tensors, e.g. purity-1.0-...-0.0
+    :param shard_size: Maximum number of tensors in one shard.
+    :param remove_originals: Delete the .pt files once packed.
+    :param encoding: How to store the tensors, one of TENSOR_ENCODINGS:
+    as they are (raw), as float16, as uint8 with per-channel scales, or as
+    their non-zero values (sparse).
+    :return: Number of packed tensors.
+    """
+    if is_packed(directory):
+        logger.info('Already packed, skipping: {}'.format(directory))
+        return 0
+    file_list = sorted(glob.glob('{}/*.pt'.format(directory)))
+    if len(file_list) == 0:
+        logger.warning('No tensors to pack in: {}'.format(directory))
+        return 0
+
+    # shards of an earlier packing whose index was removed, e.g. to repack
+    # with another encoding, must not be mixed with the new ones
+    for path in glob.glob(os.path.join(directory, TENSOR_SHARD_GLOB)):
+        os.remove(path)
+
+    pending = defaultdict(list)
+    index = []
+    num_shards = 0
+    for path in file_list:
+        arr = torch.load(path, map_location='cpu').numpy()
+        group = (arr.shape, arr.dtype.str)
+        pending[group].append((os.path.split(path)[1], arr))
+        if len(pending[group]) == shard_size:
+            index.extend(_write_shard(
+                directory, num_shards, pending.pop(group), encoding
+            ))
+            num_shards += 1
+    for group in list(pending.keys()):
+        index.extend(_write_shard(
+            directory, num_shards, pending.pop(group), encoding
+        ))
+        num_shards += 1
+
+    index_path = os.path.join(directory, TENSOR_INDEX_FNAME)
+    pd.DataFrame(index, columns=TENSOR_INDEX_COLUMNS).to_csv(
+        index_path + '.tmp', sep='\t', index=False
+    )
+    os.replace(index_path + '.tmp', index_path)
+
+    if remove_originals:
+        for path in file_list:
+            os.remove(path)
+    logger.info('Packed {} tensors into {} shards in: {}'.format(
+        len(file_list), num_shards, directory
+    ))
+    return len(file_list)
+
+
+def _write_shard(
+        directory: Text, shard_id: int, tensors: List, encoding: Text
+) -> List:
+    """Write tensors of the same shape and type into one shard.
+
+    :param directory: Directory to write the shard into.
+    :param shard_id: Number of the shard in the directory.
+    :param tensors: List of (file name, array) tuples.
+    :param encoding: How to store the tensors, one of TENSOR_ENCODINGS.
+    :return: Index rows of the written tensors.
+    """
+    shard = TENSOR_SHARD_FNAME.format(shard_id)
+    shard_path = os.path.join(directory, shard)
+    arrs = np.stack([arr for _, arr in tensors])
+    if encoding == 'sparse':
+        values, indices, indptr = sparsify(arrs)
+        for suffix, arr in [
+            (TENSOR_INDICES_SUFFIX, indices),
+            (TENSOR_INDPTR_SUFFIX, indptr),
+            (TENSOR_SHAPE_SUFFIX, np.array(arrs.shape[1:], dtype=np.int64)),
+        ]:
+            np.save(sidecar_path(shard_path, suffix), arr, allow_pickle=False)
+        np.save(shard_path, values, allow_pickle=False)
+    else:
+        arrs, scales = quantize(arrs, encoding)
+        if scales is not None:
+            np.save(
+                sidecar_path(shard_path, TENSOR_SCALES_SUFFIX),
+                scales,
+                allow_pickle=False
+            )
+        np.save(shard_path, arrs, allow_pickle=False)
+    return [
+        [fname, shard, item, encoding]
+        for item, (fname, _) in enumerate(tensors)
+    ]
+
+
+def pack_tensor_home(
+        tensor_home: Text,
+        shard_size: int = TENSOR_SHARD_SIZE,
+        remove_originals: bool = False,
+        encoding: Text = 'raw',
+) -> Dict[Text, int]:
+    """Pack every purity/downsampling/contamination mix of a tensor home.
+
+    :param tensor_home: Tensor home of a sample, e.g. <sample>/freq150
+    :param shard_size: Maximum number of tensors in one shard.
+    :param remove_originals: Delete the .pt files once packed.
+    :param encoding: How to store the tensors, one of TENSOR_ENCODINGS.
+    :return: Number of packed tensors per mix directory.
+    """
+    packed = {}
+    for directory in sorted(glob.glob(os.path.join(tensor_home, 'purity-*'))):
+        packed[directory] = pack_directory(
+            directory, shard_size, remove_originals, encoding
+        )
+    return packed
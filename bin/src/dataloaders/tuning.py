@@ -0,0 +1,134 @@
+import json
+import logging
+import os
+import time
+from typing import Dict, List, Text
+
+from src.constants import *
+
+logger = logging.getLogger(__name__)
+
+
+def load_loader_config(path: Text) -> Dict:
+    """Load DataLoader settings saved by tune_data_loader.
+
+    :param path: Path to the JSON file.
+    :return: Settings, empty if the file does not exist.
+    """
+    if not path or not os.path.exists(path):
+        return {}
+    with open(path) as f:
+        return json.load(f)
+
+
+def save_loader_config(path: Text, config: Dict):
+    """Save DataLoader settings for later runs.
+
+    :param path: Path to the JSON file.
+    :param config: Settings, with num_workers, prefetch_factor, batch_size.
+    """
+    with open(path, 'w') as f:
+        json.dump(config, f, indent=2)
+
+
+def measure_throughput(
+        loader,
+        num_workers: int,
+        prefetch_factor: int,
+        batch_size: int,
+        seconds: float = TUNING_SECONDS,
+) -> float:
+    """Measure how many rows per second a DataLoader setting delivers.
+
+    The first batch is not counted, it includes starting the workers.
+
+    :param loader: MutationDataLoader object.
+    :param num_workers: Number of worker processes.
+    :param prefetch_factor: Number of batches loaded in advance per worker.
+    :param batch_size: Number of rows per batch, clip levels included.
+    :param seconds: How long to measure for.
+    :return: Rows per second.
+    """
+    if not loader.for_train:
+        # as in configure, each item expands to all of its clip levels
+        batch_size = max(1, batch_size // loader.dataset.num_clips)
+    data_loader = loader.build_data_loader(
+        num_workers, prefetch_factor, batch_size, persistent=False
+    )
+    num_rows = 0
+    start = None
+    for data in data_loader:
+        if start is None:
+            start = time.time()
+            continue
+        # one row per clip level, the tensors are expanded on the device
+        num_rows += data['clip'].shape[0]
+        if time.time() - start > seconds:
+            break
+    if start is None or num_rows == 0:
+        return 0.
+    return num_rows / (time.time() - start)
+
+
+def tune_data_loader(
+        loader,
+        config_path: Text,
+        worker_counts: List[int] = TUNING_WORKERS,
+        prefetch_factors: List[int] = TUNING_PREFETCH_FACTORS,
+        batch_sizes: List[int] = TUNING_BATCH_SIZES,
+        seconds: float = TUNING_SECONDS,
+) -> Dict:
+    """Find the fastest DataLoader setting on this machine and save it.
+
+    The settings are tuned one after another: the number of workers first,
+    then the prefetch factor, then the batch size. The batch size is only
+    used for inference, it is a hyperparameter in training. A setting saved
+    by an earlier run is reused without measuring, the loader was already
+    configured with it, see loader_settings.
+
+    :param loader: MutationDataLoader object to measure and update.
+    :param config_path: Path to save the best setting to, as JSON.
+    :param worker_counts: Numbers of worker processes to try.
+    :param prefetch_factors: Prefetch factors to try.
+    :param batch_sizes: Numbers of rows per batch to try.
+    :param seconds: How long to measure each setting for.
+    :return: The best setting and the rows per second it delivered.
+    """
+    saved = load_loader_config(config_path)
+    if all(key in saved for key in LOADER_CONFIG_KEYS):
+        logger.info('Reusing the DataLoader setting of {}: {}'.format(
+            config_path, saved
+        ))
+        return saved
+    best = {
+        'num_workers': loader.num_workers,
+        'prefetch_factor': loader.prefetch_factor,
+        'batch_size': loader.batch_size * loader.dataset.num_clips,
+    }
+    for key, candidates in [
+        ('num_workers', worker_counts),
+        ('prefetch_factor', prefetch_factors),
+        ('batch_size', batch_sizes),
+    ]:
+        throughputs = {}
+        for candidate in candidates:
+            setting = dict(best, **{key: candidate})
+            throughputs[candidate] = measure_throughput(
+                loader,
+                setting['num_workers'],
+                setting['prefetch_factor'],
+                setting['batch_size'],
+                seconds
+            )
+            logger.info('DataLoader {}: {:.1f} rows/s'.format(
+                setting, throughputs[candidate]
+            ))
+        best[key] = max(throughputs, key=throughputs.get)
+        best['rows_per_second'] = throughputs[best[key]]
+
+    logger.info('Best DataLoader setting: {}'.format(best))
+    save_loader_config(config_path, best)
+    loader.configure(
+        best['num_workers'], best['prefetch_factor'], best['batch_size']
+    )
+    return best
@@ -5,7 +5,6 @@ import logging
 
 import numpy as np
 import pandas as pd
-import sklearn.metrics as metrics
 
 import os
 from typing import List, Text, Dict
@@ -14,8 +13,6 @@ from src.constants import *
 
 logger = logging.getLogger(__name__)
 
-np.random.seed(6746549)
-
 
 def evaluate_model(hp, call_mode=False):
     out_path = '../all_runs_summary.tsv'
@@ -65,7 +62,7 @@ def evaluate_model(hp, call_mode=False):
             str(hp.aug_mixes),
             str(hp.drop_rate),
             str(hp.prediction_mode),
-            str(['{:.2f}'.format(w) for w in hp.class_balance.cpu()]),
+            str(['{:.2f}'.format(w) for w in hp.class_balance]),
         ])
         )
         f.write('\t{}\t{}\t'.format(
@@ -321,6 +318,8 @@ def evaluate(labels: List[bool], preds: List[float]):
     :param preds: Predicted likelihoods of being a somatic mutation.
     :return: Precision, recall, F1 score, TN, FP, FN, TP, Total, AUPRC, AUROC.
     """
+    import sklearn.metrics as metrics
+
     scores = {}
     pr, rc, f1 = 'Precision-{}', 'Recall-{}', 'F1-{}'
     _tn, _fp, _fn, _tp, _total = '=TN-{}', '=FP-{}', '=FN-{}', '=TP-{}', '=All-{}'
@@ -367,7 +366,7 @@ def write_predictions(df: pd.DataFrame, path: Text, call_mode: bool):
     if not call_mode:
         return
 
-    if 'snv' in path:
+    if any(mode in os.path.basename(path) for mode in SNP_MODES):
         muttype = 'snv'
     else:
         muttype = 'indel'
@@ -0,0 +1,316 @@
+import copy
+import logging
+import os
+import time
+from typing import Text
+
+import numpy as np
+import torch
+import torch.nn as nn
+from torch.nn import functional as F
+from torch.nn.utils.fusion import fuse_conv_bn_eval
+
+from src.constants import *
+from src.models.densesomatic3d import _DenseLayer
+
+logger = logging.getLogger(__name__)
+
+
+def fold_batch_norms(network: nn.Module) -> nn.Module:
+    """Fold the batch norms that follow a convolution into it.
+
+    In DenseSomatic3D these are norm0 after conv0, and norm2 after conv1 in
+    every dense layer. The other batch norms come after a concatenation or
+    before a ReLU and stay as they are.
+
+    :param network: DenseSomatic3D network, it is not modified.
+    :return: A copy of the network in eval mode, with folded batch norms
+    replaced by identities.
+    """
+    network = copy.deepcopy(network).eval()
+    features = network.features
+    features.conv0 = fuse_conv_bn_eval(features.conv0, features.norm0)
+    features.norm0 = nn.Identity()
+    for module in network.modules():
+        if isinstance(module, _DenseLayer):
+            module.conv1 = fuse_conv_bn_eval(module.conv1, module.norm2)
+            module.norm2 = nn.Identity()
+    return network
+
+
+class InferenceNetwork(nn.Module):
+    """A network with folded batch norms, frozen and compiled for inference.
+
+    The network is compiled for the device and input shape of its first
+    batch, and again after being moved to another device. TorchScript traces
+    and freezes the graph, torch.compile leaves it to the compiler.
+    """
+
+    def __init__(self, network: nn.Module, engine: Text):
+        """Fold the batch norms of a trained network.
+
+        :param network: Trained DenseSomatic3D network.
+        :param engine: eager, torchscript or compile.
+        """
+        super(InferenceNetwork, self).__init__()
+        engines = ['eager', 'torchscript', 'compile']
+        if engine not in engines:
+            raise Exception('Inference engine {} is not supported. Should be '
+                            'one of: {}'.format(engine, engines))
+        if engine == 'compile' and not hasattr(torch, 'compile'):
+            raise Exception('torch.compile needs PyTorch 2.0 or later')
+        self.network = fold_batch_norms(network)
+        self.engine = engine
+        self._compiled = None
+
+    def forward(self, x: torch.Tensor):
+        """Run the compiled network, compiling it on the first batch.
+
+        :param x: Batch of input tensors.
+        :return: Mutation type and mutation length outputs.
+        """
+        if self._compiled is None:
+            # not registered as a submodule, it shares the network's weights
+            object.__setattr__(self, '_compiled', self._compile(x))
+        return self._compiled(x)
+
+    def _compile(self, x: torch.Tensor):
+        """Compile the network for inputs like x.
+
+        :param x: Example batch, on the device of the network.
+        :return: Callable compiled network.
+        """
+        start = time.time()
+        if self.engine == 'torchscript':
+            with torch.no_grad():
+                traced = torch.jit.trace(self.network, x, check_trace=False)
+            compiled = torch.jit.optimize_for_inference(
+                torch.jit.freeze(traced)
+            )
+        elif self.engine == 'compile':
+            compiled = torch.compile(self.network)
+        else:
+            compiled = self.network
+        logger.info('Prepared the {} network in {:.1f} seconds'.format(
+            self.engine, time.time() - start
+        ))
+        return compiled
+
+    def _apply(self, fn):
+        """Move or cast the network, it is compiled again afterwards."""
+        object.__setattr__(self, '_compiled', None)
+        return super(InferenceNetwork, self)._apply(fn)
+
+
+class OnnxNetwork(nn.Module):
+    """A network exported to ONNX and run by onnxruntime on the CPU.
+
+    The network is exported on its first batch if there is no export yet, or
+    if the pretrained model is newer than it. The export is checked against
+    the torch network on that batch. Inputs and outputs stay torch tensors,
+    so it is used like the torch network.
+    """
+
+    def __init__(
+            self,
+            network: nn.Module,
+            onnx_path: Text,
+            model_path: Text = None,
+            num_threads: int = None,
+    ):
+        """Wrap a trained network.
+
+        :param network: Trained DenseSomatic3D network, to export.
+        :param onnx_path: Path to the exported network.
+        :param model_path: Path to the pretrained model it is exported from.
+        :param num_threads: Number of intra-op threads, the number of CPUs
+        if None.
+        """
+        super(OnnxNetwork, self).__init__()
+        self.network = network
+        self.onnx_path = onnx_path
+        self.model_path = model_path
+        self.num_threads = num_threads
+        self._session = None
+        # the export is checked once, on the first batch
+        self.checked = False
+
+    def prepare(self, x: torch.Tensor):
+        """Export the network if needed, and check the export on a batch.
+
+        Called on the first batch, or before forking processes that open
+        their own sessions, see sharded_scores. The export is not checked
+        again by this object.
+
+        :param x: Batch of input tensors.
+        :return: onnxruntime session the export was checked with.
+        """
+        if self._needs_export():
+            export_onnx(self.network, self.onnx_path, x)
+        session = onnx_session(self.onnx_path, self.num_threads)
+        difference = onnx_max_difference(
+            self.network, self.onnx_path, x, session=session
+        )
+        if difference > ONNX_TOLERANCE:
+            raise Exception(
+                'The ONNX export differs from torch by up to {}, more '
+                'than {}: {}'.format(
+                    difference, ONNX_TOLERANCE, self.onnx_path
+                )
+            )
+        self.checked = True
+        return session
+
+    def close(self):
+        """Close the onnxruntime session, e.g. before forking processes.
+
+        The next batch opens a new session, without checking the export again.
+        """
+        self._session = None
+
+    def forward(self, x: torch.Tensor):
+        """Run the exported network, exporting it on the first batch.
+
+        :param x: Batch of input tensors.
+        :return: Mutation type and mutation length outputs.
+        """
+        if self._session is None and not self.checked:
+            self._session = self.prepare(x)
+        elif self._session is None:
+            self._session = onnx_session(self.onnx_path, self.num_threads)
+        out1, out2 = self._session.run(
+            None, {'X': x.detach().cpu().numpy().astype(np.float32)}
+        )
+        return (
+            torch.from_numpy(out1).to(x.device),
+            torch.from_numpy(out2).to(x.device)
+        )
+
+    def _needs_export(self) -> bool:
+        """Check whether there is no export yet, or an outdated one."""
+        if not os.path.exists(self.onnx_path):
+            return True
+        return self.model_path is not None and \
+            os.path.getmtime(self.model_path) > os.path.getmtime(self.onnx_path)
+
+
+def onnx_model_path(pretrained_model: Text) -> Text:
+    """Get the path of the ONNX export next to a pretrained model.
+
+    :param pretrained_model: Path to the pretrained model.
+    :return: Path to the .onnx file.
+    """
+    return os.path.splitext(pretrained_model)[0] + ONNX_MODEL_SUFFIX
+
+
+def export_onnx(network: nn.Module, onnx_path: Text, example: torch.Tensor):
+    """Export a trained network to ONNX with a dynamic batch size.
+
+    The batch norms are folded first, see fold_batch_norms. The export is
+    written to a temporary file and renamed into place.
+
+    :param network: Trained DenseSomatic3D network.
+    :param onnx_path: Path to write the .onnx file to.
+    :param example: Batch of input tensors, on the device of the network.
+    """
+    start = time.time()
+    network = fold_batch_norms(network)
+    # written to a temporary file first, processes may export concurrently
+    # and must not read a partial export
+    tmp_path = '{}.{}.tmp'.format(onnx_path, os.getpid())
+    try:
+        with torch.no_grad():
+            torch.onnx.export(
+                network,
+                example,
+                tmp_path,
+                input_names=['X'],
+                output_names=['mutation_type', 'mutation_length'],
+                dynamic_axes={
+                    'X': {0: 'batch'},
+                    'mutation_type': {0: 'batch'},
+                    'mutation_length': {0: 'batch'},
+                },
+                opset_version=ONNX_OPSET,
+                do_constant_folding=True,
+            )
+        os.replace(tmp_path, onnx_path)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+    logger.info('Exported the network to {} in {:.1f} seconds'.format(
+        onnx_path, time.time() - start
+    ))
+
+
+def onnx_session(onnx_path: Text, num_threads: int = None):
+    """Open an exported network with onnxruntime's CPU provider.
+
+    :param onnx_path: Path to the .onnx file.
+    :param num_threads: Number of intra-op threads, the number of CPUs if
+    None. Batches are run one at a time, so there is one inter-op thread.
+    :return: onnxruntime InferenceSession object.
+    """
+    try:
+        import onnxruntime
+    except ImportError:
+        raise Exception('The onnxruntime inference engine needs the '
+                        'onnxruntime package, pip install onnxruntime')
+    options = onnxruntime.SessionOptions()
+    options.intra_op_num_threads = num_threads or os.cpu_count() or 1
+    options.inter_op_num_threads = 1
+    options.execution_mode = onnxruntime.ExecutionMode.ORT_SEQUENTIAL
+    options.graph_optimization_level = \
+        onnxruntime.GraphOptimizationLevel.ORT_ENABLE_ALL
+    return onnxruntime.InferenceSession(
+        onnx_path, options, providers=['CPUExecutionProvider']
+    )
+
+
+def onnx_max_difference(
+        network: nn.Module,
+        onnx_path: Text,
+        inputs: torch.Tensor,
+        num_threads: int = None,
+        session=None,
+) -> float:
+    """Check that an exported network gives the same outputs as in torch.
+
+    :param network: Trained network the export was made from.
+    :param onnx_path: Path to the .onnx file.
+    :param inputs: Batch of input tensors, on the device of the network.
+    :param num_threads: Number of intra-op threads for onnxruntime.
+    :param session: Open onnxruntime session of the export, opened here if
+    None.
+    :return: Largest absolute difference between the outputs of both heads.
+    """
+    with torch.no_grad():
+        expected = [out.cpu().numpy() for out in network.eval()(inputs)]
+    session = session or onnx_session(onnx_path, num_threads)
+    outputs = session.run(
+        None, {'X': inputs.detach().cpu().numpy().astype(np.float32)}
+    )
+    return max(
+        float(np.abs(out - ref).max()) for out, ref in zip(outputs, expected)
+    )
+
+
+def score_batches(
+        network: nn.Module,
+        inputs: torch.Tensor,
+        batch_size: int = 256,
+) -> np.ndarray:
+    """Get the softmax scores of a stack of input tensors, in batches.
+
+    :param network: Network returning mutation type and length outputs.
+    :param inputs: Input tensors, on the device of the network.
+    :param batch_size: Number of tensors per forward pass.
+    :return: Softmax scores of the mutation type, one row per tensor.
+    """
+    scores = []
+    with torch.no_grad():
+        for start in range(0, len(inputs), batch_size):
+            outputs, _ = network(inputs[start:start + batch_size])
+            scores.append(F.softmax(outputs.float(), dim=1).cpu().numpy())
+    return np.concatenate(scores)
+
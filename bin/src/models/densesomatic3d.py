@@ -31,28 +31,28 @@
 
 from collections import OrderedDict
 
-import numpy as np
-import random
 import torch
 import torch.nn as nn
 import torch.nn.functional as F
+import torch.utils.checkpoint as cp
 
 __all__ = ['densesomatic3d']
 
-random.seed(567497)
-torch.manual_seed(37546)
-np.random.seed(6746549)
 
 class _DenseLayer(nn.Sequential):
     """Class encapsulating a dense layer"""
 
-    def __init__(self, num_input_features, growth_rate, bn_size, drop_rate):
+    def __init__(self, num_input_features, growth_rate, bn_size, drop_rate,
+                 memory_efficient=False):
         """ Constructor for _DenseLayer class.
 
         :param num_input_features: Number of input features.
         :param growth_rate: Growth rate of the layer.
         :param bn_size: Bottleneck size.
         :param drop_rate: Dropout rate.
+        :param memory_efficient: Recompute the concatenation of the previous
+        features and the bottleneck in the backward pass instead of keeping
+        them, when training.
         """
         super(_DenseLayer, self).__init__()
         self.add_module('norm1', nn.BatchNorm3d(num_input_features)),
@@ -75,25 +75,76 @@ class _DenseLayer(nn.Sequential):
             bias=False
         )),
         self.drop_rate = drop_rate
+        self.memory_efficient = memory_efficient
+
+    def bn_function(self, inputs):
+        """ Concatenate the features of the previous layers and apply the
+        first batch norm, ReLU and 1x1 convolution.
+
+        :param inputs: Features of the previous layers.
+        :return: Bottleneck features.
+        """
+        concated_features = torch.cat(inputs, 1)
+        return self.conv1(self.relu1(self.norm1(concated_features)))
+
+    def checkpoint_bn_function(self, inputs):
+        """ Apply bn_function without keeping the concatenated features, they
+        are recomputed in the backward pass.
+
+        norm1 normalizes with the batch statistics in the checkpoint, and
+        its running statistics are updated here, once, from the statistics
+        of every input. Otherwise the recomputation would update them again.
+
+        :param inputs: Features of the previous layers.
+        :return: Bottleneck features.
+        """
+        norm1 = self.norm1
+        with torch.no_grad():
+            dims = [0] + list(range(2, inputs[0].dim()))
+            mean = torch.cat([f.mean(dims) for f in inputs])
+            var = torch.cat([f.var(dims, unbiased=True) for f in inputs])
+            norm1.num_batches_tracked.add_(1)
+            momentum = norm1.momentum
+            if momentum is None:
+                momentum = 1.0 / float(norm1.num_batches_tracked)
+            norm1.running_mean.mul_(1 - momentum).add_(mean, alpha=momentum)
+            norm1.running_var.mul_(1 - momentum).add_(var, alpha=momentum)
+
+        def closure(*features):
+            concated_features = torch.cat(features, 1)
+            normalized = F.batch_norm(
+                concated_features, None, None, norm1.weight, norm1.bias,
+                training=True, eps=norm1.eps
+            )
+            return self.conv1(self.relu1(normalized))
+
+        return cp.checkpoint(closure, *inputs, use_reentrant=False)
 
     def forward(self, x):
         """ Process the incoming data.
 
-        :param x: Input data
-        :return: Data processed by the dense layer, concat. to input data.
+        :param x: Input data, or the features of the previous layers.
+        :return: New features of the dense layer, concatenated to the
+        previous features by the dense block.
         """
-        new_features = super(_DenseLayer, self).forward(x)
+        prev_features = [x] if isinstance(x, torch.Tensor) else x
+        if self.memory_efficient and self.training and \
+                any(f.requires_grad for f in prev_features):
+            bottleneck = self.checkpoint_bn_function(prev_features)
+        else:
+            bottleneck = self.bn_function(prev_features)
+        new_features = self.conv2(self.relu2(self.norm2(bottleneck)))
         if self.drop_rate > 0:
             new_features = F.dropout(new_features, p=self.drop_rate,
                                      training=self.training)
-        return torch.cat([x, new_features], 1)
+        return new_features
 
 
 class _DenseBlock(nn.Sequential):
     """ Class encapsulating a block of dense layers."""
 
     def __init__(self, num_layers, num_input_features, bn_size, growth_rate,
-                 drop_rate):
+                 drop_rate, memory_efficient=False):
         """ Constructor for _DenseBlock class.
 
         :param num_layers: Number of layers.
@@ -101,14 +152,30 @@ class _DenseBlock(nn.Sequential):
         :param bn_size: Bottleneck size.
         :param growth_rate: Growth rate.
         :param drop_rate: Dropout rate.
+        :param memory_efficient: Checkpoint the concatenation and bottleneck
+        of every layer.
         """
         super(_DenseBlock, self).__init__()
         for i in range(num_layers):
             layer = _DenseLayer(num_input_features + i * growth_rate,
                                 growth_rate, bn_size,
-                                drop_rate)
+                                drop_rate, memory_efficient)
             self.add_module('denselayer%d' % (i + 1), layer)
 
+    def forward(self, init_features):
+        """ Process the incoming data.
+
+        Every layer gets the features of all previous layers, they are
+        concatenated once, at the end of the block.
+
+        :param init_features: Input data
+        :return: Input data, concat. to the features of every layer.
+        """
+        features = [init_features]
+        for layer in self:
+            features.append(layer(features))
+        return torch.cat(features, 1)
+
 
 class _Transition(nn.Sequential):
     """ Class encapsulating a transition object."""
@@ -140,6 +207,9 @@ class DenseNet(nn.Module):
           (i.e. bn_size * k features in the bottleneck layer)
         drop_rate (float) - dropout rate after each dense layer
         num_classes (int) - number of classification classes
+        memory_efficient (bool) - recompute the concatenated features and
+          the bottleneck of every dense layer in the backward pass, which
+          uses less memory but is slower
     """
 
     def __init__(
@@ -150,7 +220,8 @@ class DenseNet(nn.Module):
             bn_size=4,
             drop_rate=0,
             num_classes=3,
-            channels=18
+            channels=18,
+            memory_efficient=False
     ):
 
         super(DenseNet, self).__init__()
@@ -182,7 +253,8 @@ class DenseNet(nn.Module):
                 num_input_features=num_features,
                 bn_size=bn_size,
                 growth_rate=growth_rate,
-                drop_rate=drop_rate
+                drop_rate=drop_rate,
+                memory_efficient=memory_efficient
             )
             self.features.add_module('denseblock%d' % (i + 1), block)
             num_features = num_features + num_layers * growth_rate
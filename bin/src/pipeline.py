@@ -1,45 +1,69 @@
 import logging
-import numpy as np
-import random
+import os
 import time
 
 import torch
 import torch.nn as nn
 import torch.optim as optim
-from torch.utils.tensorboard import SummaryWriter
 
-from src.constants import BEST_MODEL_FNAME
+from src.constants import BEST_MODEL_FNAME, COMBINED_MODES
 from src.architecture import initialize_network
 from src.dataloaders.data_loader import MutationDataLoader
 from src.train_methods import train_network
 from src.valid_methods import validate_network
-from src.utils import save_scores
+from src.utils import output_modes, rescore, save_scores, set_seeds
 
 logger = logging.getLogger(__name__)
 
-random.seed(567497)
-torch.manual_seed(37546)
-np.random.seed(6746549)
-
 
 def pipeline(hp, call: bool = False):
     """Pipeline for training and validating the network.
     :param hp: hyperparameters.
     """
     start = time.time()
+    set_seeds()
     logger.info(hp)
 
-    writer = SummaryWriter(hp.tensorboard_dir)
+    if call and hp.prediction_mode in COMBINED_MODES:
+        from src.combined import combined_call
+
+        combined_call(hp)
+        logger.info('Program finished in {} minutes'.format(
+            (time.time() - start) / 60
+        ))
+        return
+
+    if call and hp.stream_call:
+        from src.streaming import stream_call
+
+        stream_call(hp, hp.pretrained_model)
+        logger.info('Program finished in {} minutes'.format(
+            (time.time() - start) / 60
+        ))
+        return
 
+    writer = None
     valid_loader = MutationDataLoader(hp)
+    if hp.tune_loader:
+        from src.dataloaders.tuning import tune_data_loader
+
+        tune_data_loader(valid_loader, hp.loader_config)
     if hp.epoch > 0:
+        # imported here, TensorBoard takes long to import and is only used
+        # for training
+        from torch.utils.tensorboard import SummaryWriter
+
+        os.makedirs(hp.tensorboard_dir, exist_ok=True)
+        writer = SummaryWriter(hp.tensorboard_dir)
         train_loader = MutationDataLoader(hp=hp, for_training=True)
         device = torch.device('cuda:0' if torch.cuda.is_available() else 'cpu')
 
         network = initialize_network(hp, network_path=hp.pretrained_model)
         # criterions for mutation class, and mutation length class.
         criterion1 = nn.CrossEntropyLoss(
-            weight=hp.class_balance.to(device, dtype=torch.float)
+            weight=torch.tensor(
+                hp.class_balance, device=device, dtype=torch.float
+            )
         )
         criterion2 = nn.CrossEntropyLoss()
         # optimizer
@@ -67,17 +91,17 @@ def pipeline(hp, call: bool = False):
     else:
         BEST_MODEL_FNAME = hp.pretrained_model
     torch.cuda.empty_cache()
-    valid_loader.dataset.for_final_validation = True
     scores_valid, metadata_valid, _ = validate_network(
         valid_loader, hp, BEST_MODEL_FNAME
     )
-    save_scores(
-        scores_valid,
-        metadata_valid,
-        hp.out_path,
-        hp.prediction_mode,
-        call_mode=call
-    )
+    for mode in (output_modes(hp) if call else [hp.prediction_mode]):
+        save_scores(
+            rescore(scores_valid, mode),
+            metadata_valid,
+            hp.out_path,
+            mode,
+            call_mode=call
+        )
 
     if writer:
         writer.close()
@@ -0,0 +1,466 @@
+import copy
+import hashlib
+import itertools
+import json
+import logging
+import os
+import time
+from typing import Dict, Iterator, List, Optional, Text, Tuple
+
+import numpy as np
+import torch
+import torch.nn as nn
+
+from src.constants import *
+from src.inference import InferenceNetwork, OnnxNetwork, fold_batch_norms, \
+    score_batches
+from src.utils import binary_scores, compute_binary_performance, \
+    prepare_inputs
+
+logger = logging.getLogger(__name__)
+
+
+def quantized_model_path(pretrained_model: Text) -> Text:
+    """Get the path of the int8 network cached next to a pretrained model.
+
+    :param pretrained_model: Path to the pretrained model.
+    :return: Path to the quantized TorchScript network.
+    """
+    return os.path.splitext(pretrained_model)[0] + QUANTIZED_MODEL_SUFFIX
+
+
+def quantized_metadata_path(pretrained_model: Text) -> Text:
+    """Get the path of the metadata of the int8 network cached next to a
+    pretrained model.
+
+    :param pretrained_model: Path to the pretrained model.
+    :return: Path to the JSON metadata.
+    """
+    return os.path.splitext(pretrained_model)[0] + QUANTIZED_METADATA_SUFFIX
+
+
+def quantized_calibration_path(pretrained_model: Text) -> Text:
+    """Get the path of the calibration tensors of the int8 network cached
+    next to a pretrained model.
+
+    :param pretrained_model: Path to the pretrained model.
+    :return: Path to the calibration tensors.
+    """
+    return os.path.splitext(pretrained_model)[0] + \
+        QUANTIZED_CALIBRATION_SUFFIX
+
+
+def quantization_settings(hp) -> Dict:
+    """Get the settings an int8 network is built with.
+
+    A cached network is only used if it was built with the same settings.
+
+    :param hp: Hyperparameters.
+    :return: Window size, architecture and quantization engine.
+    """
+    return {
+        'window_size': hp.window_size,
+        'architecture': hp.architecture,
+        'num_init_features': hp.num_init_features,
+        'growth_rate': hp.growth_rate,
+        'bn_size': hp.bn_size,
+        'block_config': list(hp.block_config),
+        'channels': hp.channels,
+        'engine': torch.backends.quantized.engine,
+    }
+
+
+def quantize_network(
+        network: nn.Module, loader, hp, indels: Optional[bool] = None
+) -> nn.Module:
+    """Quantize a trained network to int8 for calling on CPU.
+
+    Conv3d layers are quantized statically, the classifiers dynamically. The
+    quantized network is cached next to the pretrained model, with the
+    settings it was built with, and rebuilt when the model is newer or the
+    settings differ. It is calibrated on a fixed set of call tensors, taken
+    from the first call that builds it and saved next to it, so every call
+    builds the same network. When it is built, its scores are compared with
+    the float network on the first batches of the call. The result is cached
+    with it, and calls keep the float network if they drift too far.
+
+    :param network: Trained network, or InferenceNetwork, on the CPU.
+    :param loader: MutationDataLoader object of the call tensors. It is only
+    read if the network is built.
+    :param hp: Hyperparameters.
+    :param indels: Calibrate and check on the indels of the call tensors
+    only if True, on the SNVs only if False, on all rows if None. For
+    loaders of SNVs and indels together, see combined_call.
+    :return: The quantized network, or the float network if its scores
+    drift more than QUANTIZE_MAX_DRIFT.
+    """
+    if torch.cuda.is_available():
+        logger.warning('Quantized networks run on the CPU, not quantizing')
+        return network
+    if isinstance(network, InferenceNetwork):
+        float_network = network.network
+    elif isinstance(network, OnnxNetwork):
+        float_network = fold_batch_norms(network.network)
+    else:
+        float_network = fold_batch_norms(network)
+
+    path = quantized_model_path(hp.pretrained_model)
+    settings = quantization_settings(hp)
+    metadata = _load_metadata(hp.pretrained_model)
+    if metadata is not None and metadata['settings'] == settings and \
+            'check' in metadata and os.path.exists(path):
+        report = metadata['check']
+        if report['mean_binary_drift'] > QUANTIZE_MAX_DRIFT:
+            return _drifted(network, report)
+        logger.info('Loading quantized network {}'.format(path))
+        return torch.jit.load(path, map_location='cpu')
+
+    batches = _iter_batches(loader, indels)
+    try:
+        inputs, labels = [], []
+        calibration = _load_calibration(hp.pretrained_model, settings)
+        if calibration is None:
+            inputs, labels = _take_variants(
+                batches, QUANTIZE_CALIBRATION_VARIANTS
+            )
+            if len(inputs) == 0:
+                logger.warning('No tensors to calibrate on, not quantizing')
+                return network
+            calibration = _save_calibration(
+                torch.cat(inputs)[:QUANTIZE_CALIBRATION_VARIANTS].clone(),
+                hp.pretrained_model,
+                settings
+            )
+        # checked on the batches after the calibration tensors taken here, or
+        # on those if there are no others
+        check_inputs, check_labels = _take_batches(
+            batches, QUANTIZE_CHECK_BATCHES
+        )
+    finally:
+        # stops the workers of the data loader
+        batches.close()
+    if len(check_inputs) == 0:
+        check_inputs, check_labels = inputs, labels
+    if len(check_inputs) == 0:
+        logger.warning('No tensors to check the quantized network on')
+        return network
+
+    quantized = build_quantized_network(
+        float_network, list(calibration.split(hp.batch_size))
+    )
+    report = compare_networks(
+        float_network,
+        quantized,
+        torch.cat(check_inputs),
+        torch.cat(check_labels).numpy(),
+        hp.prediction_mode
+    )
+    logger.info('Quantized network against float: {}'.format(report))
+    _save_quantized(quantized, hp.pretrained_model, {
+        'settings': settings,
+        'calibration': {
+            'variants': len(calibration),
+            'sha1': hashlib.sha1(
+                calibration.contiguous().numpy().tobytes()
+            ).hexdigest(),
+        },
+        'check': report,
+    })
+    if report['mean_binary_drift'] > QUANTIZE_MAX_DRIFT:
+        return _drifted(network, report)
+    return quantized
+
+
+def _drifted(network: nn.Module, report: Dict) -> nn.Module:
+    """Keep the float network, the quantized scores drift too far.
+
+    :param network: Trained network.
+    :param report: Comparison of the networks, see compare_networks.
+    :return: The network.
+    """
+    logger.warning(
+        'Quantized scores drift by {:.4f} on average, more than {}. '
+        'Calling with the float network.'.format(
+            report['mean_binary_drift'], QUANTIZE_MAX_DRIFT
+        )
+    )
+    return network
+
+
+def build_quantized_network(
+        float_network: nn.Module, calibration: List[torch.Tensor]
+) -> torch.jit.ScriptModule:
+    """Quantize a network with folded batch norms, post training.
+
+    :param float_network: Network in eval mode, on the CPU.
+    :param calibration: Batches of input tensors to calibrate on.
+    :return: Traced and frozen int8 network.
+    """
+    from torch.ao.quantization import (
+        QConfigMapping, default_dynamic_qconfig, get_default_qconfig
+    )
+    from torch.ao.quantization.quantize_fx import convert_fx, prepare_fx
+
+    start = time.time()
+    qconfig_mapping = QConfigMapping().set_object_type(
+        nn.Conv3d, get_default_qconfig(torch.backends.quantized.engine)
+    ).set_object_type(
+        nn.Linear, default_dynamic_qconfig
+    )
+    prepared = prepare_fx(
+        copy.deepcopy(float_network), qconfig_mapping, example_inputs=(calibration[0],)
+    )
+    with torch.no_grad():
+        for inputs in calibration:
+            prepared(inputs)
+        quantized = convert_fx(prepared).eval()
+        traced = torch.jit.freeze(torch.jit.trace(
+            quantized, calibration[0], check_trace=False
+        ))
+    logger.info('Quantized the network on {} batches in {:.1f} seconds'.format(
+        len(calibration), time.time() - start
+    ))
+    return traced
+
+
+def compare_networks(
+        float_network: nn.Module,
+        quantized: nn.Module,
+        inputs: torch.Tensor,
+        labels: np.ndarray,
+        prediction_mode: Text,
+) -> Dict:
+    """Compare the scores and speed of a quantized network with its float
+    version.
+
+    :param float_network: Network in eval mode, on the CPU.
+    :param quantized: Quantized network.
+    :param inputs: Input tensors that were not used for calibration.
+    :param labels: Mutation type of every input tensor.
+    :param prediction_mode: somatic_snv, somatic_indel, germline_snp...
+    :return: Drift of the binary scores, fraction of changed predictions,
+    the speedup of the quantized network and, if the labels have more than
+    one class, the AUPRC of both networks.
+    """
+    start = time.time()
+    float_scores = score_batches(float_network, inputs)
+    float_seconds = time.time() - start
+    start = time.time()
+    quantized_scores = score_batches(quantized, inputs)
+    quantized_seconds = time.time() - start
+
+    drift = np.abs(
+        binary_scores(quantized_scores, prediction_mode)
+        - binary_scores(float_scores, prediction_mode)
+    )
+    report = {
+        'variants': len(inputs),
+        'mean_binary_drift': float(drift.mean()),
+        'max_binary_drift': float(drift.max()),
+        'changed_predictions': float(np.mean(
+            quantized_scores.argmax(axis=1) != float_scores.argmax(axis=1)
+        )),
+        'speedup': float_seconds / max(quantized_seconds, 1e-9),
+    }
+    # without labels, e.g. when calling, there is no AUPRC to compare
+    float_auprc, _, _ = compute_binary_performance(
+        labels, float_scores, prediction_mode
+    )
+    if float_auprc >= 0:
+        quantized_auprc, _, _ = compute_binary_performance(
+            labels, quantized_scores, prediction_mode
+        )
+        report['float_auprc'] = float(float_auprc)
+        report['quantized_auprc'] = float(quantized_auprc)
+    return report
+
+
+def _load_metadata(pretrained_model: Text) -> Optional[Dict]:
+    """Load the metadata of the int8 network cached next to a pretrained
+    model.
+
+    :param pretrained_model: Path to the pretrained model.
+    :return: Metadata saved by _save_quantized, None if there is none or the
+    model is newer.
+    """
+    path = quantized_metadata_path(pretrained_model)
+    if not os.path.exists(path) or \
+            os.path.getmtime(path) < os.path.getmtime(pretrained_model):
+        return None
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except (OSError, ValueError) as e:
+        logger.warning('Could not read {}: {}'.format(path, e))
+        return None
+
+
+def _load_calibration(
+        pretrained_model: Text, settings: Dict
+) -> Optional[torch.Tensor]:
+    """Load the calibration tensors saved next to a pretrained model.
+
+    :param pretrained_model: Path to the pretrained model.
+    :param settings: Settings of the network to calibrate, see
+    quantization_settings.
+    :return: Calibration tensors saved by _save_calibration, None if there
+    are none or they were saved for other settings.
+    """
+    path = quantized_calibration_path(pretrained_model)
+    if not os.path.exists(path):
+        return None
+    try:
+        saved = torch.load(path, map_location='cpu')
+    except (OSError, RuntimeError, EOFError) as e:
+        logger.warning('Could not read {}: {}'.format(path, e))
+        return None
+    if saved['settings'] != settings:
+        return None
+    return saved['inputs']
+
+
+def _save_calibration(
+        calibration: torch.Tensor, pretrained_model: Text, settings: Dict
+) -> torch.Tensor:
+    """Save calibration tensors next to a pretrained model, unless another
+    call did so first.
+
+    Calls taking their calibration tensors concurrently all keep those of
+    the first call that saved them, so they build the same network.
+    Calibration tensors saved for other settings are replaced.
+
+    :param calibration: Input tensors to calibrate on.
+    :param pretrained_model: Path to the pretrained model.
+    :param settings: Settings of the network to calibrate, see
+    quantization_settings.
+    :return: The calibration tensors saved next to the model.
+    """
+    path = quantized_calibration_path(pretrained_model)
+    tmp_path = '{}.{}.tmp'.format(path, os.getpid())
+    try:
+        torch.save({'settings': settings, 'inputs': calibration}, tmp_path)
+        if os.path.exists(path) and \
+                _load_calibration(pretrained_model, settings) is None:
+            os.replace(tmp_path, path)
+        else:
+            try:
+                # fails if another call saved its tensors in the meantime
+                os.link(tmp_path, path)
+            except FileExistsError:
+                pass
+            os.remove(tmp_path)
+    except OSError as e:
+        logger.warning('Could not save calibration tensors {}: {}'.format(
+            path, e
+        ))
+        return calibration
+    saved = _load_calibration(pretrained_model, settings)
+    return calibration if saved is None else saved
+
+
+def _save_quantized(
+        quantized: torch.jit.ScriptModule,
+        pretrained_model: Text,
+        metadata: Dict,
+):
+    """Cache an int8 network next to a pretrained model, with its metadata.
+
+    Files are written to a temporary file first, calls may load them
+    concurrently. The network is written before its metadata, so the
+    metadata never describes an older network.
+
+    :param quantized: Quantized network.
+    :param pretrained_model: Path to the pretrained model.
+    :param metadata: Settings and calibration tensors the network was built
+    with, see quantize_network.
+    """
+    path = quantized_model_path(pretrained_model)
+    metadata_path = quantized_metadata_path(pretrained_model)
+    try:
+        tmp_path = '{}.{}.tmp'.format(path, os.getpid())
+        torch.jit.save(quantized, tmp_path)
+        os.replace(tmp_path, path)
+        logger.info('Saved quantized network {}'.format(path))
+        tmp_path = '{}.{}.tmp'.format(metadata_path, os.getpid())
+        with open(tmp_path, 'w') as f:
+            json.dump(metadata, f, indent=2)
+        os.replace(tmp_path, metadata_path)
+    except OSError as e:
+        logger.warning('Could not save quantized network {}: {}'.format(
+            path, e
+        ))
+
+
+def _iter_batches(
+        loader, indels: Optional[bool] = None
+) -> Iterator[Tuple[torch.Tensor, torch.Tensor]]:
+    """Iterate over the batches of a data loader, decoded on the CPU.
+
+    The batches are read by a data loader object of their own, without
+    persistent workers, so the workers stop once the iterator is closed.
+
+    :param loader: MutationDataLoader object.
+    :param indels: Keep the rows of indels only if True, of SNVs only if
+    False, all rows if None. Batches without such rows are skipped.
+    :return: Input tensors and mutation types of every batch.
+    """
+    data_loader = loader.build_data_loader(
+        loader.num_workers,
+        loader.prefetch_factor,
+        loader.batch_size,
+        persistent=False
+    )
+    for data in data_loader:
+        batch = prepare_inputs(
+            data, torch.device('cpu'), loader.dataset.aug_rate
+        )
+        batch_labels = data['y1']
+        if indels is not None:
+            mask = loader.dataset.data_list.is_indel(data['index'].numpy())
+            if not indels:
+                mask = ~mask
+            if not mask.any():
+                continue
+            mask = torch.from_numpy(mask)
+            batch, batch_labels = batch[mask], batch_labels[mask]
+        yield batch, batch_labels
+
+
+def _take_batches(
+        batches: Iterator[Tuple[torch.Tensor, torch.Tensor]],
+        num_batches: int
+) -> Tuple[List[torch.Tensor], List[torch.Tensor]]:
+    """Take the next batches of _iter_batches.
+
+    :param batches: Iterator of input tensors and mutation types.
+    :param num_batches: Number of batches.
+    :return: Input tensors and mutation types of every batch.
+    """
+    inputs, labels = [], []
+    for batch, batch_labels in itertools.islice(batches, num_batches):
+        inputs.append(batch)
+        labels.append(batch_labels)
+    return inputs, labels
+
+
+def _take_variants(
+        batches: Iterator[Tuple[torch.Tensor, torch.Tensor]],
+        num_variants: int
+) -> Tuple[List[torch.Tensor], List[torch.Tensor]]:
+    """Take the next batches of _iter_batches, until they hold a number of
+    variants.
+
+    :param batches: Iterator of input tensors and mutation types.
+    :param num_variants: Number of variants.
+    :return: Input tensors and mutation types of every batch.
+    """
+    inputs, labels = [], []
+    taken = 0
+    while taken < num_variants:
+        batch = next(batches, None)
+        if batch is None:
+            break
+        inputs.append(batch[0])
+        labels.append(batch[1])
+        taken += len(batch[0])
+    return inputs, labels
@@ -1,29 +1,21 @@
-from pandas.core.window.ewm import *
+import ast
+import inspect
 import logging
 import warnings
 from collections import defaultdict
 
-import fire
-import numpy as np
 import os
-import random
-import torch
 from glob import glob
-from typing import List, Text
+from typing import Dict, List, Optional, Text, Tuple
 
 from src.constants import GERMLINE_MODES, SOMATIC_MODES, UNKNOWN_STRATEGIES, \
-    DATASETS
-from src.evaluation import evaluate_model
-from src.pipeline import pipeline
+    DATASETS, LOADER_CONFIG_FNAME, INFERENCE_ENGINES, ONNX_TOLERANCE, \
+    COMBINED_MODES
 
 FORMAT = '%(levelname)s %(asctime)-15s %(name)-20s %(message)s'
 logging.basicConfig(level=logging.INFO, format=FORMAT)
 logger = logging.getLogger(__name__)
 
-random.seed(567497)
-torch.manual_seed(37546)
-np.random.seed(6746549)
-
 
 class Hyperparams:
     """Train/call the VariantMedium models with given data & hyperparameters"""
@@ -47,16 +39,34 @@ class Hyperparams:
             aug_rate: int = 0,
             aug_mixes: List[Text] = None,
             tensor_type: Text = 'freq150',
+            window_size: int = 0,
             unknown_strategy_tr: Text = 'keep_as_false',
             unknown_strategy_val: Text = 'keep_as_false',
             unknown_strategy_call: Text = 'discard',
+            num_workers: int = None,
+            prefetch_factor: int = None,
+            inference_batch_size: int = None,
+            tune_loader: bool = False,
+            loader_config: Text = None,
+            tensor_cache_size: float = 0.,
+            build_workers: int = None,
+            dataset_snapshots: bool = True,
+            stream_call: bool = False,
+            inference_engine: Text = 'eager',
+            quantize: bool = False,
+            onnx_threads: int = None,
+            memory_efficient: bool = False,
+            cpu_workers: int = None,
+            indel_model: Text = None,
+            multi_mode: bool = False,
     ):
         """Constructor for training.
 
         :param home_folder: Home folder containing all the necessary data.
         tensors, labels, candidates, train/test.
         :param prediction_mode: Predict one of: somatic_snv, somatic_indel,
-        germline_snp, germline_indel.
+        germline_snp, germline_indel. In call mode, somatic or germline call
+        SNVs and indels in one pass, see indel_model.
         :param out_path: Output directory.
         :param learning_rate: Learning rate for training.
         :param epoch: Number of epochs.
@@ -71,10 +81,63 @@ class Hyperparams:
         :param aug_rate: Augmentation rate for tensor_type size aug.
         :param aug_mixes: Purity/downsampling/normal contamination mixes.
         :param tensor_type: Tensor type and window size, e.g. freq150.
+        :param window_size: Crop the tensors to this width around the variant
+        when loading them, 0 to use the full tensor_type width. Narrower
+        windows cost less compute in training and calling.
         :param unknown_strategy_tr: What to do with unknown class in training.
         keep_as_false or discard
         :param unknown_strategy_val: What to do with unknown class in validation.
         keep_as_false or discard
+        :param num_workers: Number of DataLoader worker processes. Taken from
+        loader_config for validation and calling if not given.
+        :param prefetch_factor: Number of batches each worker loads in
+        advance. Taken from loader_config for validation and calling if not
+        given.
+        :param inference_batch_size: Rows per forward pass when validating or
+        calling. Taken from loader_config, or 4 * batch_size if not given.
+        :param tune_loader: Measure the DataLoader throughput for different
+        settings on this machine first, and save the fastest to loader_config.
+        A setting already saved there is reused, remove it to tune again.
+        :param loader_config: Path to the JSON file of tuned DataLoader
+        settings. Defaults to loader_config.json in the home_folder.
+        :param tensor_cache_size: Size in GiB of the shared memory cache of
+        decoded tensors, per data set (training, validation). The workers fill
+        it once and reuse it in later validation passes and sampler draws.
+        Tensors are cached first come, first served and never evicted: once
+        it is full, the tensors not cached are read from disk in every pass.
+        0 to disable.
+        :param build_workers: Number of processes reading and populating the
+        samples of a data set, one sample per task. Defaults to BUILD_WORKERS,
+        or the number of CPUs if lower, 1 to build the data sets in the main
+        process. Every process holds a whole sample in memory.
+        :param dataset_snapshots: Save the populated data set of every sample
+        in its folder, and reuse it in later runs while the tensors,
+        candidates and labels of the sample do not change.
+        :param stream_call: In call mode, load and score one sample at a time
+        and write its scores as soon as it is done, so memory does not grow
+        with the number of samples. An interrupted call resumes from the
+        first sample not completed.
+        :param inference_engine: How the trained network is run when
+        validating and calling: eager, torchscript, compile or onnxruntime.
+        The others fold the batch norms into the convolutions and compile the
+        network. onnxruntime runs the ONNX export of the pretrained model on
+        the CPU, see export, and exports it if there is none.
+        :param quantize: Call with an int8 quantized network on CPU, see
+        call.
+        :param onnx_threads: Number of intra-op threads of the onnxruntime
+        engine, defaults to the number of CPUs.
+        :param memory_efficient: Recompute the concatenated features and the
+        bottleneck of every dense layer in the backward pass instead of
+        storing them, so larger batches or more features fit in memory, at
+        the cost of slower training steps.
+        :param cpu_workers: Without a GPU, split validation and calling
+        across this many processes, each pinned to its own share of the CPUs
+        with its own copy of the network. Disabled if None or 1.
+        :param indel_model: Path to the pretrained indel model when calling
+        SNVs and indels together, pretrained_model is then the SNV model.
+        :param multi_mode: In call mode, also write the scores and calls of
+        the other class, e.g. germline_snp for somatic_snv, from the same
+        forward pass.
         """
         self.architecture = 'DenseSomatic3D'
         self.channels = 24
@@ -86,10 +149,13 @@ class Hyperparams:
         self.aug_mixes = aug_mixes
 
         self._set_pretrained_model(pretrained_model)
-        self._set_tensorboard_dir()
+        self.tensorboard_dir = os.path.join(
+            self.home_folder, 'tensorboard', str(self.run)
+        )
         self._set_prediction_mode(prediction_mode)
 
         self.tensor_type = tensor_type
+        self.window_size = window_size
         self.num_init_features = num_init_features
         self.growth_rate = growth_rate
         self.bn_size = bn_size
@@ -109,8 +175,31 @@ class Hyperparams:
         self.unknown_strategy_call = self._check_unknown_strategy(
             unknown_strategy_call, 'Calling'
         )
+        self.num_workers = num_workers
+        self.prefetch_factor = prefetch_factor
+        self.inference_batch_size = inference_batch_size
+        self.tune_loader = tune_loader
+        self.loader_config = loader_config or os.path.join(
+            self.home_folder, LOADER_CONFIG_FNAME
+        )
+        self.tensor_cache_size = tensor_cache_size
+        self.build_workers = build_workers
+        self.dataset_snapshots = dataset_snapshots
+        self.stream_call = stream_call
+        self._set_inference_engine(inference_engine)
+        self.quantize = quantize
+        self.onnx_threads = onnx_threads
+        self.memory_efficient = memory_efficient
+        self.cpu_workers = cpu_workers
+        self.indel_model = indel_model
+        self.multi_mode = multi_mode
 
     def train(self):
+        if self.prediction_mode in COMBINED_MODES:
+            raise Exception(
+                'SNVs and indels are only called together, train each of '
+                '{} separately'.format(COMBINED_MODES[self.prediction_mode])
+            )
         if self.learning_rate <= 0.:
             raise Exception(
                 "Learning rate should be higher than 0 for training"
@@ -121,35 +210,114 @@ class Hyperparams:
         #     )
         self.train_paths = self._get_tensors_folders('train', self.tensor_type)
         self.valid_paths = self._get_tensors_folders('valid', self.tensor_type)
+        from src.evaluation import evaluate_model
+        from src.pipeline import pipeline
+
         pipeline(self)
         evaluate_model(self)
 
-    def call(self):
-        if self.pretrained_model is None:
-            raise Exception(
-                "No pretrained model is given for call mode. Exiting..."
-            )
-        self.train_paths = {'model': self.pretrained_model}
-        self.valid_paths = self._get_tensors_folders('call', self.tensor_type)
-        self.unknown_strategy_val = self.unknown_strategy_call
+    def call(self, quantize: bool = None):
+        """Call variants with the pretrained model.
+
+        :param quantize: Call with an int8 quantized network on CPU. It is
+        calibrated once on call tensors that are saved with it next to the
+        pretrained model. Its score drift against the float network is
+        checked when it is built, and saved with it.
+        """
+        from src.pipeline import pipeline
+
+        if quantize is not None:
+            self.quantize = quantize
+        self._set_call_paths()
         pipeline(self, call=True)
 
         if list(self.valid_paths.values())[0]['labels']:
-            evaluate_model(self, call_mode=True)
+            from src.combined import output_hyperparams
+            from src.evaluation import evaluate_model
+
+            for mode_hp in output_hyperparams(self):
+                evaluate_model(mode_hp, call_mode=True)
+
+    def export(self, out_path: Text = None, num_tensors: int = 8):
+        """Export the pretrained model to ONNX with a dynamic batch size.
+
+        The export is checked against the torch outputs on tensors of the
+        first sample to call.
+
+        :param out_path: Path to the .onnx file. Defaults to the pretrained
+        model's path with an .onnx extension, where the onnxruntime engine
+        looks for it.
+        :param num_tensors: Number of tensors to export and check with.
+        """
+        import torch
+
+        from src.architecture import initialize_network
+        from src.dataloaders.input_parsers import get_tensor_dirs
+        from src.dataloaders.tensor_store import list_tensors, load_tensor
+        from src.inference import (
+            export_onnx, onnx_max_difference, onnx_model_path
+        )
+
+        self._set_call_paths()
+        out_path = out_path or onnx_model_path(self.pretrained_model)
+        network = initialize_network(self, self.pretrained_model).eval()
+        tensors = get_tensor_dirs(
+            list(self.valid_paths.values())[0]['tensors'], False
+        )[0]
+        file_list = list_tensors(tensors)[:num_tensors]
+        example = torch.stack([
+            load_tensor(path, item, self.window_size) for path, item in zip(
+                file_list['FULL_PATH'], file_list['SHARD_ITEM']
+            )
+        ]).float()
+        export_onnx(network, out_path, example)
+        difference = onnx_max_difference(
+            network, out_path, example, self.onnx_threads
+        )
+        if difference > ONNX_TOLERANCE:
+            raise Exception(
+                'The ONNX export differs from torch by up to {}, more than '
+                '{}: {}'.format(difference, ONNX_TOLERANCE, out_path)
+            )
+        logger.info('Exported {}, largest difference to torch: {}'.format(
+            out_path, difference
+        ))
 
     def evaluate(self):
+        from src.combined import output_hyperparams
+        from src.evaluation import evaluate_model
+
+        self._set_call_paths()
+        if len(self.valid_paths) == 0:
+            raise Exception('No path found for evaluation mode. Make sure '
+                            'your call folder is not empty, and the paths are '
+                            'correct')
+        for mode_hp in output_hyperparams(self):
+            evaluate_model(mode_hp)
+
+    def _set_call_paths(self):
         if self.pretrained_model is None:
             raise Exception(
                 "No pretrained model is given for call mode. Exiting..."
             )
         self.train_paths = {'model': self.pretrained_model}
         self.valid_paths = self._get_tensors_folders('call', self.tensor_type)
-        if len(self.valid_paths) == 0:
-            raise Exception('No path found for evaluation mode. Make sure '
-                            'your call folder is not empty, and the paths are '
-                            'correct')
         self.unknown_strategy_val = self.unknown_strategy_call
-        evaluate_model(self)
+        if self.prediction_mode in COMBINED_MODES and (
+                not self.indel_model or not os.path.exists(self.indel_model)
+        ):
+            raise Exception(
+                'Calling SNVs and indels together needs the indel model, '
+                'the path to it does not exist: {}'.format(self.indel_model)
+            )
+        if self.prediction_mode in COMBINED_MODES and (
+                self.stream_call or (self.cpu_workers or 1) > 1
+        ):
+            raise ValueError(
+                'Calling SNVs and indels together runs in one process with '
+                'all samples at once, stream_call and cpu_workers are not '
+                'supported with {}'.format(self.prediction_mode)
+            )
 
     def _set_home_folder(self, home_folder):
         if not os.path.exists(home_folder):
@@ -205,18 +373,23 @@ class Hyperparams:
             )
         )
 
-    def _set_tensorboard_dir(self):
-        self.tensorboard_dir = os.path.join(
-            self.home_folder, 'tensorboard', str(self.run)
-        )
-        os.makedirs(self.tensorboard_dir, exist_ok=True)
+    def _set_inference_engine(self, inference_engine):
+        if inference_engine not in INFERENCE_ENGINES:
+            raise Exception(
+                'Inference engine is not valid. Should be one of {}'.format(
+                    INFERENCE_ENGINES
+                )
+            )
+        self.inference_engine = inference_engine
 
     def _set_prediction_mode(self, prediction_mode):
         if not (prediction_mode in GERMLINE_MODES
-                or prediction_mode in SOMATIC_MODES):
+                or prediction_mode in SOMATIC_MODES
+                or prediction_mode in COMBINED_MODES):
             raise Exception(
-                'Prediction mode is not valid. Should be one of {} {}'.format(
-                    GERMLINE_MODES, SOMATIC_MODES
+                'Prediction mode is not valid. Should be one of {} {} '
+                '{}'.format(
+                    GERMLINE_MODES, SOMATIC_MODES, list(COMBINED_MODES)
                 )
             )
         self.prediction_mode = prediction_mode
@@ -235,7 +408,7 @@ class Hyperparams:
                 'The number of classes in the class balance field does not'
                 'match the number of classes in the assigned architecture'
             )
-        self.class_balance = torch.Tensor(class_balance)
+        self.class_balance = [float(weight) for weight in class_balance]
 
     def _check_unknown_strategy(self, strategy, dataset):
         if strategy not in UNKNOWN_STRATEGIES:
@@ -261,6 +434,7 @@ class Hyperparams:
                'Train samples: {}\n' \
                'Validation samples: {}\n' \
                'Window size: {}\n' \
+               'Window crop: {}\n' \
                'Number of initial features: {}\n' \
                'Growth rate: {}\n' \
                'Bottleneck size: {}\n' \
@@ -281,6 +455,7 @@ class Hyperparams:
             list(self.train_paths.keys()),
             list(self.valid_paths.keys()),
             self.tensor_type,
+            self.window_size,
             self.num_init_features,
             self.growth_rate,
             self.bn_size,
@@ -298,3 +473,49 @@ class Hyperparams:
             self.unknown_strategy_val,
             self.pretrained_model
         )
+
+
+def parse_command_line(
+        argv: List[Text]
+) -> Optional[Tuple[Text, Dict, Dict]]:
+    """Parse a command line of the form used by the pipeline, without fire.
+
+    Importing fire takes longer than many short call tasks need. The command
+    comes first, followed by --name value or --name=value flags. Values are
+    parsed as Python literals, or kept as strings, like fire does.
+
+    :param argv: Command line arguments, without the script name.
+    :return: The command, and the keyword arguments of Hyperparams and of the
+    command. None if the command line has another form, e.g. --help or a
+    flag without a value, it is then left to fire.
+    """
+    if len(argv) == 0 or argv[0].startswith('_') or \
+            not inspect.isfunction(getattr(Hyperparams, argv[0], None)):
+        return None
+    command = argv[0]
+    init_params = inspect.signature(Hyperparams.__init__).parameters
+    command_params = inspect.signature(getattr(Hyperparams, command)).parameters
+    init_kwargs, command_kwargs = {}, {}
+    args = iter(argv[1:])
+    for arg in args:
+        if not arg.startswith('--'):
+            return None
+        name, has_value, value = arg[2:].partition('=')
+        if not has_value:
+            value = next(args, None)
+            if value is None or value.startswith('--'):
+                return None
+        name = name.replace('-', '_')
+        if name in command_params and name != 'self':
+            kwargs = command_kwargs
+        elif name in init_params and name != 'self':
+            kwargs = init_kwargs
+        else:
+            return None
+        if name in kwargs:
+            return None
+        try:
+            kwargs[name] = ast.literal_eval(value)
+        except (ValueError, SyntaxError):
+            kwargs[name] = value
+    return command, init_kwargs, command_kwargs
@@ -0,0 +1,131 @@
+import logging
+import multiprocessing
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from typing import List, Tuple
+
+import numpy as np
+import torch
+import torch.nn as nn
+from torch.utils.data import DataLoader, Subset
+
+from src.dataloaders.data_loader import MutationDataLoader, collate_batch
+from src.inference import OnnxNetwork
+from src.utils import prepare_inputs
+
+logger = logging.getLogger(__name__)
+
+# State inherited by the forked workers, so neither the network nor the data
+# set is pickled.
+_SHARD_STATE = {}
+
+
+def core_groups(num_workers: int) -> List[List[int]]:
+    """Split the CPUs this process may run on into contiguous groups.
+
+    :param num_workers: Number of groups, at most the number of CPUs.
+    :return: CPU ids of every group.
+    """
+    cores = sorted(os.sched_getaffinity(0))
+    num_workers = max(1, min(num_workers, len(cores)))
+    # plain ints, os.sched_setaffinity does not take NumPy integers
+    bounds = [len(cores) * i // num_workers for i in range(num_workers + 1)]
+    return [cores[start:stop] for start, stop in zip(bounds[:-1], bounds[1:])]
+
+
+def sharded_scores(
+        network: nn.Module, loader: MutationDataLoader, num_workers: int
+) -> Tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+    """Score a data set on the CPU with one network per worker process.
+
+    The data set is split into contiguous shards, one per worker. Every
+    worker is pinned to its own group of CPUs and uses one PyTorch thread
+    per CPU. Workers are forked, so they share the network and the data set
+    with this process until they write to them. Shards are gathered in order,
+    so the rows are in the same order as with a single process. This
+    process uses a single PyTorch thread while forking, and stops the
+    DataLoader workers of the loader, so no worker inherits the state of a
+    live thread pool. An ONNX network is exported and checked here once,
+    every worker opens its own onnxruntime session with one thread per CPU.
+
+    :param network: Network, on the CPU.
+    :param loader: MutationDataLoader object, not for training.
+    :param num_workers: Number of worker processes.
+    :return: Raw mutation type outputs, mutation types, indices in data_list
+    and clip levels of every row.
+    """
+    start = time.time()
+    groups = core_groups(num_workers)
+    shards = np.array_split(np.arange(len(loader.dataset)), len(groups))
+    loader.release()
+    if isinstance(network, OnnxNetwork):
+        network.close()
+        if not network.checked and len(loader.dataset) > 0:
+            example = collate_batch([loader.dataset[0]])
+            network.prepare(prepare_inputs(
+                example, torch.device('cpu'), loader.dataset.aug_rate
+            ))
+    _SHARD_STATE.update(
+        network=network.eval(),
+        dataset=loader.dataset,
+        batch_size=loader.batch_size,
+    )
+    num_threads = torch.get_num_threads()
+    torch.set_num_threads(1)
+    try:
+        with ProcessPoolExecutor(
+                len(groups), mp_context=multiprocessing.get_context('fork')
+        ) as executor:
+            results = list(executor.map(_score_shard, shards, groups))
+    finally:
+        _SHARD_STATE.clear()
+        torch.set_num_threads(num_threads)
+    logger.info('Scored {} items with {} workers in {:.1f} seconds'.format(
+        len(loader.dataset), len(groups), time.time() - start
+    ))
+    return tuple(
+        np.concatenate([result[i] for result in results]) for i in range(4)
+    )
+
+
+def _score_shard(
+        indices: np.ndarray, cores: List[int]
+) -> Tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+    """Score one shard of the data set in a worker process.
+
+    :param indices: Indices of the items of the shard.
+    :param cores: CPUs to pin the worker to.
+    :return: Raw mutation type outputs, mutation types, indices in data_list
+    and clip levels of every row.
+    """
+    os.sched_setaffinity(0, cores)
+    torch.set_num_threads(len(cores))
+    network = _SHARD_STATE['network']
+    if isinstance(network, OnnxNetwork):
+        network.num_threads = len(cores)
+    dataset = _SHARD_STATE['dataset']
+    data_loader = DataLoader(
+        Subset(dataset, indices.tolist()),
+        batch_size=_SHARD_STATE['batch_size'],
+        num_workers=0,
+        collate_fn=collate_batch,
+    )
+    scores, labels, items, clips = [], [], [], []
+    with torch.no_grad():
+        for data in data_loader:
+            inputs = prepare_inputs(data, torch.device('cpu'), dataset.aug_rate)
+            outputs, _ = network(inputs)
+            scores.append(outputs.float().numpy())
+            labels.append(data['y1'].numpy().astype(np.int8))
+            items.append(data['index'].numpy())
+            clips.append(data['clip'].numpy().astype(np.int8))
+    if len(scores) == 0:
+        return (
+            np.zeros((0, 3), dtype=np.float32), np.zeros(0, dtype=np.int8),
+            np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int8)
+        )
+    return (
+        np.concatenate(scores), np.concatenate(labels),
+        np.concatenate(items), np.concatenate(clips)
+    )
@@ -0,0 +1,388 @@
+import logging
+import os
+from typing import Dict, Iterator, Set, Text, Tuple
+
+import numpy as np
+import pandas as pd
+import torch
+from torch.nn import functional as F
+from torch.utils.data import DataLoader, Dataset, Sampler
+
+from src.architecture import initialize_network
+from src.constants import *
+from src.dataloaders.annotated_tensor import AnnotatedTensors
+from src.dataloaders.data_loader import build_sample, collate_batch, \
+    loader_settings
+from src.dataloaders.input_parsers import read_array
+from src.quantization import quantize_network
+from src.utils import (
+    binary_scores, combine_scores, migrate_to_gpu, output_modes,
+    prepare_inputs, rescore_frame, scores_frame, write_predictions
+)
+
+logger = logging.getLogger(__name__)
+
+
+def stream_call(hp, network_path: Text):
+    """Call variants one sample at a time, writing scores as they come.
+
+    Only the entries of the sample being called are in memory, see
+    StreamingLoader. The scores of
+    every batch are appended to a part file right away. Once a sample is
+    complete, its scores are appended to all_scores_<mode>.tsv, its combined
+    scores to scores_<mode>.tsv, and its calls are written. The sample is
+    then recorded in the progress file, which is removed once all samples
+    are called. A rerun after a crash with the same model skips the samples
+    recorded there and drops the rows of any other sample from the score
+    files, as they may be incomplete. It starts fresh if no sample is
+    recorded, or if the model is another one or has changed.
+
+    Unlike save_scores, scores_<mode>.tsv is sorted by score within each
+    sample, not across samples. With multi_mode, the files of the other
+    class are written from the same scores, see output_modes.
+
+    :param hp: Hyperparameters, with the samples to call in valid_paths.
+    :param network_path: Path to the trained network.
+    """
+    network = initialize_network(hp, network_path, for_inference=True)
+    device, network = migrate_to_gpu(network)
+    network.eval()
+
+    out_names = {
+        mode: os.path.join(hp.out_path, 'all_scores_{}.tsv'.format(mode))
+        for mode in output_modes(hp)
+    }
+    part_name = out_names[hp.prediction_mode] + '.part'
+    progress_path = os.path.join(
+        hp.out_path, STREAM_PROGRESS_FNAME.format(hp.prediction_mode)
+    )
+    model = model_signature(network_path)
+    done = read_progress(progress_path, model)
+    quantized = False
+    loader = StreamingLoader(hp)
+    for out_name in out_names.values():
+        for path in [out_name, out_name.replace('all_', '')]:
+            if len(done) == 0 and os.path.exists(path):
+                os.remove(path)
+            elif len(done) > 0:
+                keep_samples(path, done)
+    if len(done) == 0:
+        with open(progress_path, 'w') as f:
+            f.write('{}\n'.format(model))
+
+    for sample, paths in hp.valid_paths.items():
+        if sample in done:
+            logger.info('Already called, skipping: {}'.format(sample))
+            continue
+        if loader.load(sample, paths) == 0:
+            logger.info('No candidates to call in sample {}'.format(sample))
+            record_progress(progress_path, sample)
+            continue
+        if hp.quantize and not quantized:
+            # calibrated on the first sample called
+            network = quantize_network(network, loader, hp)
+            quantized = True
+        num_rows = score_sample(loader, network, device, hp, part_name)
+        df = pd.read_csv(
+            part_name,
+            sep='\t',
+            dtype={'SAMPLE': str, 'CHROM': str, 'REF': str, 'ALT': str,
+                   'REPLICATE': str}
+        )
+        for mode, out_name in out_names.items():
+            df_mode = rescore_frame(df, mode)
+            df_comb = combine_scores(df_mode)
+            append_tsv(df_mode, out_name)
+            append_tsv(df_comb, out_name.replace('all_', ''))
+            write_predictions(
+                df_comb, hp.out_path, mode, call_mode=True
+            )
+        os.remove(part_name)
+        logger.info('Called {} rows of sample {}'.format(num_rows, sample))
+        record_progress(progress_path, sample)
+    if os.path.exists(progress_path):
+        os.remove(progress_path)
+
+
+def score_sample(
+        loader: 'StreamingLoader',
+        network: torch.nn.Module,
+        device: torch.device,
+        hp,
+        part_name: Text,
+) -> int:
+    """Score the rows of one sample, appending each batch to a part file.
+
+    :param loader: StreamingLoader object, loaded with the sample.
+    :param network: Trained network, on the device.
+    :param device: Device of the network.
+    :param hp: Hyperparameters.
+    :param part_name: Path to write the scores of the sample to.
+    :return: Number of rows scored.
+    """
+    num_rows = 0
+    with open(part_name, 'w') as f, torch.no_grad():
+        for data in loader.get_data_loader():
+            inputs = prepare_inputs(data, device, loader.dataset.aug_rate)
+            outputs, _ = network(inputs)
+            scores = F.softmax(outputs.float(), dim=1).cpu().numpy()
+            preds = np.append(
+                scores,
+                binary_scores(scores, hp.prediction_mode)[:, None],
+                axis=1
+            )
+            metadata = loader.dataset.data_list.metadata(
+                data['index'].numpy(), data['clip'].numpy()
+            )
+            scores_frame(preds, metadata).to_csv(
+                f,
+                sep='\t',
+                index=False,
+                header=num_rows == 0,
+                float_format='%.15f'
+            )
+            f.flush()
+            num_rows += len(preds)
+    return num_rows
+
+
+class StreamingLoader:
+    """Load the entries of one sample after another, for stream_call.
+
+    Used like MutationDataLoader, but its data set holds the entries of the
+    sample loaded last, and there is no tensor cache: every tensor is read
+    once. Starting a pool of workers for every sample would dominate the
+    call of many small samples, so the workers of its DataLoader persist
+    across samples.
+    """
+
+    def __init__(self, hp):
+        """Initializer for the loader, with no sample loaded.
+
+        :param hp: Hyperparameters.
+        """
+        self.hp = hp
+        self.dataset = LocatedTensors(hp.window_size, hp.aug_rate)
+        self.sampler = EntryLocations(self.dataset)
+        settings = loader_settings(hp)
+        self.num_workers = settings['num_workers']
+        self.prefetch_factor = settings['prefetch_factor']
+        self.batch_size = max(
+            1, settings['batch_size'] // self.dataset.num_clips
+        )
+        self.data_loader = None
+
+    def load(self, sample: Text, paths: Dict[Text, Text]) -> int:
+        """Replace the entries of the data set with those of a sample.
+
+        :param sample: Sample name.
+        :param paths: Paths to the tensors, candidates and labels of the
+        sample.
+        :return: Number of entries of the sample.
+        """
+        result = build_sample(
+            sample,
+            paths,
+            self.hp.prediction_mode,
+            False,
+            self.hp.aug_mixes,
+            self.hp.unknown_strategy_val,
+            self.hp.dataset_snapshots,
+        )
+        self.dataset.data_list = AnnotatedTensors.concatenate(
+            [] if result is None else [result[0]]
+        )
+        return len(self.dataset.data_list)
+
+    def build_data_loader(
+            self,
+            num_workers: int,
+            prefetch_factor: int,
+            batch_size: int,
+            persistent: bool = True,
+    ) -> DataLoader:
+        """Build a DataLoader object over the entries of the loaded sample,
+        and of the samples loaded after it.
+
+        :param num_workers: Number of worker processes.
+        :param prefetch_factor: Number of batches loaded in advance per worker.
+        :param batch_size: Number of items per batch.
+        :param persistent: Keep the workers alive between iterations.
+        :return: Iterable DataLoader object.
+        """
+        kwargs = {}
+        if num_workers > 0:
+            kwargs['prefetch_factor'] = prefetch_factor
+            kwargs['persistent_workers'] = persistent
+        return DataLoader(
+            self.dataset,
+            batch_size=batch_size,
+            sampler=self.sampler,
+            num_workers=num_workers,
+            pin_memory=True,
+            collate_fn=collate_batch,
+            **kwargs
+        )
+
+    def get_data_loader(self) -> DataLoader:
+        """Get the data loader object, built once.
+
+        :return: Iterable DataLoader object.
+        """
+        if self.data_loader is None:
+            self.data_loader = self.build_data_loader(
+                self.num_workers, self.prefetch_factor, self.batch_size
+            )
+        return self.data_loader
+
+
+class LocatedTensors(Dataset):
+    """Read test items from the locations yielded by EntryLocations.
+
+    Same items as MutationDataset when testing. The entries of the loaded
+    sample are only read in the main process, the workers read the tensors
+    at the locations they are given.
+    """
+
+    def __init__(self, window_size: int, aug_rate: int):
+        """Initializer for the data set, with no entries.
+
+        :param window_size: Width to crop the tensors to around the variant,
+        0 to keep the full width.
+        :param aug_rate: Augmentation rate for window size augmentation.
+        """
+        self.window_size = window_size
+        self.aug_rate = aug_rate
+        self.num_clips = max(aug_rate, 1)
+        self.data_list = AnnotatedTensors.concatenate([])
+
+    def __len__(self) -> int:
+        return len(self.data_list)
+
+    def __getitem__(
+            self, location: Tuple[Text, int, int, int, int]
+    ) -> Dict:
+        path, shard_item, y1, y2, idx = location
+        return dict(
+            read_array(path, shard_item, self.window_size),
+            y1=y1,
+            y2=y2,
+            clip=torch.arange(self.num_clips),
+            index=idx,
+        )
+
+
+class EntryLocations(Sampler):
+    """Yield the tensor location and labels of every entry of a data set.
+
+    It is iterated in the main process, so the entries can be replaced
+    between iterations while the workers of the DataLoader persist.
+    """
+
+    def __init__(self, dataset: LocatedTensors):
+        """Initializer for the sampler.
+
+        :param dataset: Data set whose entries are yielded.
+        """
+        self.dataset = dataset
+
+    def __iter__(self) -> Iterator[Tuple[Text, int, int, int, int]]:
+        data_list = self.dataset.data_list
+        for idx in range(len(data_list)):
+            yield (
+                *data_list.tensor(idx),
+                int(data_list.mutation_types[idx]),
+                int(data_list.mutation_length_types[idx]),
+                idx,
+            )
+
+    def __len__(self) -> int:
+        return len(self.dataset)
+
+
+def model_signature(network_path: Text) -> Text:
+    """Identify a trained network by its path and modification time.
+
+    :param network_path: Path to the trained network.
+    :return: The first line of a progress file.
+    """
+    return '#model\t{}\t{}'.format(
+        os.path.abspath(network_path), os.stat(network_path).st_mtime_ns
+    )
+
+
+def read_progress(progress_path: Text, model: Text) -> Set[Text]:
+    """Read the samples completed by an earlier streaming call.
+
+    :param progress_path: Path to the progress file.
+    :param model: Signature of the network calling now, see model_signature.
+    :return: Names of the completed samples, none if they were called with
+    another network.
+    """
+    if not os.path.exists(progress_path):
+        return set()
+    with open(progress_path) as f:
+        lines = [line.rstrip('\n') for line in f if line.strip()]
+    if len(lines) == 0 or lines[0] != model:
+        logger.warning('{} was written with another model, starting '
+                       'fresh'.format(progress_path))
+        return set()
+    return set(lines[1:])
+
+
+def record_progress(progress_path: Text, sample: Text):
+    """Record a sample as completed in the progress file.
+
+    :param progress_path: Path to the progress file.
+    :param sample: Name of the sample.
+    """
+    with open(progress_path, 'a') as f:
+        f.write('{}\n'.format(sample))
+
+
+def keep_samples(path: Text, samples: Set[Text]):
+    """Drop the rows of all but the given samples from a scores file.
+
+    :param path: Path to the TSV file, with a SAMPLE column.
+    :param samples: Names of the samples to keep.
+    """
+    if not os.path.exists(path):
+        return
+    tmp_path = path + '.tmp'
+    header = True
+    try:
+        reader = pd.read_csv(
+            path, sep='\t', dtype=str, keep_default_na=False,
+            chunksize=VARIANT_CHUNK_SIZE
+        )
+        with open(tmp_path, 'w') as f:
+            for chunk in reader:
+                chunk[chunk['SAMPLE'].isin(samples)].to_csv(
+                    f, sep='\t', index=False, header=header
+                )
+                header = False
+    except pd.errors.EmptyDataError:
+        pass
+    if header:
+        # no rows were read, append_tsv writes the header again
+        os.remove(path)
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+    else:
+        os.replace(tmp_path, path)
+
+
+def append_tsv(df: pd.DataFrame, path: Text):
+    """Append rows to a TSV file, writing the header if the file is new.
+
+    :param df: Rows to append.
+    :param path: Path to the TSV file.
+    """
+    df.to_csv(
+        path,
+        sep='\t',
+        index=False,
+        mode='a',
+        header=not os.path.exists(path),
+        float_format='%.15f'
+    )
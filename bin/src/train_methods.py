@@ -1,8 +1,6 @@
 import logging
 import time
 
-import numpy as np
-import random
 import torch
 import torch.nn as nn
 
@@ -13,9 +11,6 @@ from src.utils import *
 # from variantmedium.early_stopping import EarlyStopping
 
 logger = logging.getLogger(__name__)
-random.seed(567497)
-torch.manual_seed(37546)
-np.random.seed(6746549)
 
 
 def train_network(
@@ -51,7 +46,7 @@ def train_network(
         for i, data in enumerate(train_loader.get_data_loader(), 0):
             # get the inputs
             inputs, mutation_classes, mutation_length_classes = get_batch_data(
-                data, device)
+                data, device, hp.aug_rate)
             network.train()
             # zero the parameter gradients
             optimizer.zero_grad()
@@ -86,6 +81,10 @@ def train_network(
                     )
             except RuntimeError as e:
                 logger.error(e)
+        if train_loader.dataset.cache is not None:
+            logger.info('Training tensor cache: {}'.format(
+                train_loader.dataset.cache_stats()
+            ))
 
     save_successful_model(
         loader=valid_loader,
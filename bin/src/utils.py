@@ -2,29 +2,66 @@ import logging
 
 import numpy as np
 import pandas as pd
-import random
 import os
+import random
 import torch
-from sklearn.metrics import average_precision_score as aps
-from sklearn.metrics import roc_auc_score  as auroc
 
 from src.constants import *
+from src.dataloaders.input_parsers import clip_batch
+from src.dataloaders.tensor_store import dequantize
 
 logger = logging.getLogger(__name__)
-random.seed(567497)
-torch.manual_seed(37546)
-np.random.seed(6746549)
 
 
-def get_batch_data(data, device):
+def set_seeds():
+    """Seed the random number generators of Python, NumPy and PyTorch.
+
+    Called when a run starts, not when the modules are imported.
+    """
+    random.seed(567497)
+    torch.manual_seed(37546)
+    np.random.seed(6746549)
+
+
+def prepare_inputs(data, device, aug_rate):
+    """ Move the tensors of the current batch to the GPU and decode them there
+
+    Tensors are moved as stored, so uint8 tensors cross the bus as uint8.
+    They are dequantized and clipped on the device. Test batches hold every
+    tensor once, it is expanded to all of its clip levels on the device too,
+    see collate_batch.
+
+    :param data: Data in the current batch
+    :param device: GPU device
+    :param aug_rate: Augmentation rate for window size augmentation
+    :return: inputs in float
+    """
+    inputs = data['X'].to(device, non_blocking=True)
+    if 'scale' in data:
+        inputs = dequantize(
+            inputs,
+            data['scale'].to(device, non_blocking=True),
+            data['offset'].to(device, non_blocking=True)
+        )
+    inputs = inputs.to(dtype=torch.float)
+    clip_lengths = data['clip'].to(device, non_blocking=True)
+    if len(clip_lengths) != len(inputs):
+        inputs = inputs.repeat_interleave(
+            len(clip_lengths) // len(inputs), dim=0
+        )
+    return clip_batch(inputs, clip_lengths, aug_rate)
+
+
+def get_batch_data(data, device, aug_rate):
     """ Get data from the current batch and move them to the GPU
 
     :param data: Data in the current batch
     :param device: GPU device
+    :param aug_rate: Augmentation rate for window size augmentation
     :return: inputs, mutation_classes, mutation_length_classes
     """
-    inputs, classes1, classes2 = data['X'], data['y1'], data['y2']
-    inputs = inputs.to(device, dtype=torch.float, non_blocking=True)
+    classes1, classes2 = data['y1'], data['y2']
+    inputs = prepare_inputs(data, device, aug_rate)
     mutation_classes = classes1.to(device, dtype=torch.long, non_blocking=True)
     length_classes = classes2.to(device, dtype=torch.long, non_blocking=True)
     return inputs, mutation_classes, length_classes
@@ -36,12 +73,16 @@ def migrate_to_gpu(network):
     :param network: The neural network object.
     :return: Connected device and the network in the device.
     """
+    from src.inference import InferenceNetwork, OnnxNetwork
+
     is_gpu_avail = torch.cuda.is_available()
     logger.info('Moving the network to the GPU. GPU available: {}'.format(
         is_gpu_avail
     ))
     device = torch.device("cuda:0" if is_gpu_avail else "cpu")
-    if torch.cuda.device_count() > 1:
+    # compiled networks are not replicated, they would be compiled per replica
+    if torch.cuda.device_count() > 1 and \
+            not isinstance(network, (InferenceNetwork, OnnxNetwork)):
         logger.info('Using multiple GPUs.')
         network = torch.nn.DataParallel(network)
     network.to(device)
@@ -75,26 +116,82 @@ def compute_binary_performance(labels, scores, prediction_mode):
     :param prediction_mode: Somatic/germline prediction modes.
     :return: AUPRC, AUROC, and final scores in binary classification task.
     """
+    preds_ens = binary_scores(scores, prediction_mode)
     if prediction_mode in GERMLINE_MODES:
         labels_bin = (labels == GERMLINE)
-        preds_ens = scores[:, GERMLINE] - scores[:, NO_MUT]
-    elif prediction_mode in SOMATIC_MODES:
-        labels_bin = (labels == SOMATIC)
-        preds_ens = scores[:, SOMATIC] - \
-                    scores[:, NO_MUT] - \
-                    scores[:, GERMLINE]
     else:
-        raise Exception('Prediction mode not recognized')
+        labels_bin = (labels == SOMATIC)
 
     auprc_all = -1.
     auroc_all = -1.
     if len(np.unique(labels_bin)) > 1:
+        from sklearn.metrics import average_precision_score as aps
+        from sklearn.metrics import roc_auc_score as auroc
+
         auprc_all = aps(labels_bin, preds_ens)
         auroc_all = auroc(labels_bin, preds_ens)
 
     return auprc_all, auroc_all, preds_ens
 
 
+def binary_scores(scores, prediction_mode):
+    """ Compute the final scores in binary classification task.
+
+    :param scores: Softmax scores of the network, one column per class.
+    :param prediction_mode: Somatic/germline prediction modes.
+    :return: Germline minus no mutation scores, or somatic minus the others.
+    """
+    if prediction_mode in GERMLINE_MODES:
+        return scores[:, GERMLINE] - scores[:, NO_MUT]
+    elif prediction_mode in SOMATIC_MODES:
+        return scores[:, SOMATIC] - \
+               scores[:, NO_MUT] - \
+               scores[:, GERMLINE]
+    raise Exception('Prediction mode not recognized')
+
+
+def output_modes(hp):
+    """ Get the prediction modes a call writes scores and calls for.
+
+    :param hp: Hyperparameters, with a prediction mode of a single variant
+    type.
+    :return: The prediction mode, followed by the mode of the other class if
+    multi_mode is set.
+    """
+    if hp.multi_mode:
+        return [hp.prediction_mode, COUNTERPART_MODES[hp.prediction_mode]]
+    return [hp.prediction_mode]
+
+
+def rescore(preds, prediction_mode):
+    """ Replace the binary scores with those of another prediction mode.
+
+    :param preds: Softmax scores, one column per class, and binary scores.
+    :param prediction_mode: Somatic/germline prediction modes.
+    :return: The softmax scores and the binary scores of prediction_mode.
+    """
+    return np.append(
+        preds[:, :ALL],
+        binary_scores(preds[:, :ALL], prediction_mode)[:, None],
+        axis=1
+    )
+
+
+def rescore_frame(df, prediction_mode):
+    """ Replace the SCORE column of a scores data frame with the binary
+    scores of another prediction mode.
+
+    :param df: Data frame with the columns in SCORES_COLUMNS.
+    :param prediction_mode: Somatic/germline prediction modes.
+    :return: A copy of the data frame with the new scores.
+    """
+    scores = np.zeros((len(df), ALL))
+    scores[:, NO_MUT] = df['SCORE_NOMUT'].values
+    scores[:, GERMLINE] = df['SCORE_GERMLINE'].values
+    scores[:, SOMATIC] = df['SCORE_SOMATIC'].values
+    return df.assign(SCORE=binary_scores(scores, prediction_mode))
+
+
 def print_performance(labels, scores, auprc_all, auroc_all):
     """ Print the AUPRC/AUROC values of different classification tasks.
     somatic, germline, no mutation, overall(binary)
@@ -110,7 +207,13 @@ def print_performance(labels, scores, auprc_all, auroc_all):
     labels = np.array(labels)
     for class_name, class_id in classes_dict.items():
         labels_n = (labels != class_id) == False
-        logger.info(t.format(class_name, aps(labels_n, scores[:, class_id])))
+        # -1 without both classes, e.g. when calling without labels
+        auprc = -1.
+        if len(np.unique(labels_n)) > 1:
+            from sklearn.metrics import average_precision_score as aps
+
+            auprc = aps(labels_n, scores[:, class_id])
+        logger.info(t.format(class_name, auprc))
 
     logger.info(t.format('OVERALL', auprc_all))
     logger.info('Area under ROC {:14}: {:.3}'.format('OVERALL', auroc_all))
@@ -120,26 +223,15 @@ def save_scores(preds, metadata, out_path, prediction_mode, call_mode):
     """ Save neural network scores and other variant information to a file.
 
     :param preds: Scores assigned to each candidate variant by the model
-    :param metadata: Info on variant such as the position, sample etc.
+    :param metadata: Data frame of variant info such as the position, sample
+    etc. with the columns in HEADER.
     :param out_path: The path to the output folder.
     """
-    df = pd.DataFrame(metadata, columns=HEADER)
-    df['SCORE_NOMUT'] = preds[:, NO_MUT]
-    df['SCORE_GERMLINE'] = preds[:, GERMLINE]
-    df['SCORE_SOMATIC'] = preds[:, SOMATIC]
-    df['SCORE'] = preds[:, ALL]
-    df = df[
-        [
-            'SAMPLE', 'CHROM', 'POS', 'REF', 'ALT', 'REPLICATE', 'CLIPPING',
-            'SCORE', 'SCORE_NOMUT', 'SCORE_GERMLINE', 'SCORE_SOMATIC'
-        ]
-    ]
+    df = scores_frame(preds, metadata)
     out_name = os.path.join(out_path, 'all_scores_{}.tsv'.format(prediction_mode))
     df.to_csv(out_name, sep='\t', index=False, float_format='%.15f')
 
-    df_comb = df.groupby(
-        ['SAMPLE', 'CHROM', 'POS', 'REF', 'ALT', 'REPLICATE']
-    ).mean(numeric_only=True).sort_values('SCORE', ascending=False).reset_index()
+    df_comb = combine_scores(df)
     df_comb.to_csv(
         out_name.replace('all_', ''),
         sep='\t',
@@ -148,6 +240,36 @@ def save_scores(preds, metadata, out_path, prediction_mode, call_mode):
     )
     write_predictions(df_comb, out_path, prediction_mode, call_mode)
 
+
+def scores_frame(preds, metadata):
+    """ Put the scores of every scored row next to its variant information.
+
+    :param preds: Scores assigned to each row by the model, one column per
+    class and the binary score.
+    :param metadata: Data frame with the columns in HEADER.
+    :return: Data frame with the columns in SCORES_COLUMNS.
+    """
+    df = metadata[HEADER].reset_index(drop=True)
+    df['SCORE_NOMUT'] = preds[:, NO_MUT]
+    df['SCORE_GERMLINE'] = preds[:, GERMLINE]
+    df['SCORE_SOMATIC'] = preds[:, SOMATIC]
+    df['SCORE'] = preds[:, ALL]
+    return df[SCORES_COLUMNS]
+
+
+def combine_scores(df):
+    """ Average the scores of the clip levels of every variant.
+
+    :param df: Data frame with the columns in SCORES_COLUMNS.
+    :return: One row per variant and replicate, sorted by score.
+    """
+    df_comb = df.groupby(
+        ['SAMPLE', 'CHROM', 'POS', 'REF', 'ALT', 'REPLICATE']
+    ).mean(numeric_only=True).reset_index()
+    return df_comb.sort_values(
+        'SCORE', ascending=False
+    )[SCORES_COLUMNS].reset_index(drop=True)
+
 def write_predictions(df, out_path, muttype, call_mode):
     """ Write the final predictions to a file.
 
@@ -163,7 +285,8 @@ def write_predictions(df, out_path, muttype, call_mode):
     for gr in df.groupby(by='SAMPLE'):
         df_s = gr[1]
         df_s = df_s.sort_values(['SCORE']).reset_index(drop=True)
-        if muttype == 'somatic_snv':
+        # thresholds by variant type, for germline_snp as for somatic_snv
+        if muttype in SNP_MODES:
             df_s = df_s[df_s['SCORE'] > SNV_THRESHOLD].reset_index(drop=True)
         else:
             df_s['IS_DEL'] = False
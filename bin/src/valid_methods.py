@@ -1,5 +1,6 @@
+import logging
+
 import numpy as np
-import random
 import torch
 import torch.nn as nn
 from torch.nn import functional as F
@@ -7,6 +8,8 @@ from typing import Dict, List, Tuple, Text
 
 from src.architecture import initialize_network
 from src.dataloaders.data_loader import MutationDataLoader
+from src.quantization import quantize_network
+from src.sharded import sharded_scores
 from src.utils import *
 
 # import os
@@ -15,9 +18,7 @@ from src.utils import *
 # if module_path not in sys.path:
 #     sys.path.append(module_path)
 # from temperature_scaling import ModelWithTemperature
-random.seed(567497)
-torch.manual_seed(37546)
-np.random.seed(6746549)
+logger = logging.getLogger(__name__)
 
 
 def validate_network(
@@ -36,14 +37,16 @@ def validate_network(
     :param network_path: Path to the trained network.
     :param network: Trained network. If network_path is given, this is ignored.
     :param is_final: Is this the final run for this
-    :return: Average precision values, binary predictions, metadata
+    :return: Scores, metadata data frame rebuilt from the dataset, AUPRC.
     """
     if not network_path and not network:
         raise Exception(
             'Both network and network network_path are empty. You need to input one of them.'
         )
     if network_path:
-        network = initialize_network(hp, network_path)
+        network = initialize_network(hp, network_path, for_inference=True)
+        if hp.quantize:
+            network = quantize_network(network, loader, hp)
 
     seed = 0
     torch.manual_seed(seed)
@@ -57,45 +60,54 @@ def validate_network(
     #     network.set_temperature(loader.get_data_loader())
     #     torch.save(network.state_dict(), 'best_model.pt')
 
-    # aug_rate = 0
-    # if loader.dataset.for_final_validation:
-    #     aug_rate = hp.aug_rate
-    arr_len = len(loader.get_data_loader().dataset.data_list)
-    if torch.cuda.is_available():
-        scores_arr = torch.zeros(arr_len, 3, dtype=torch.float16).cuda()
-        labels_arr = torch.zeros(arr_len, dtype=torch.int8).cuda()
+    if not torch.cuda.is_available() and hp.cpu_workers and \
+            hp.cpu_workers > 1:
+        scores, labels, indices_arr, clips_arr = sharded_scores(
+            network, loader, hp.cpu_workers
+        )
+        scores_arr = F.softmax(torch.from_numpy(scores), dim=1)
+        labels_arr = torch.from_numpy(labels)
     else:
-        scores_arr = torch.zeros(arr_len, 3, dtype=torch.float)
-        labels_arr = torch.zeros(arr_len, dtype=torch.int8)
-    metadata_arr = np.ndarray([arr_len, 7], dtype=object)
-
-    with torch.no_grad():
-        start = 0
-        # for a in range(aug_rate + 1):
-        #     loader.dataset.val_clip_length = a
-        for i, data in enumerate(loader.get_data_loader()):
-            network.eval()
-            inputs, labels, metadata = data['X'], data['y1'], data['metadata']
-            inputs = inputs.to(device, dtype=torch.float, non_blocking=True)
-            scores, _ = network(inputs)
-
-            end = start + len(scores)
-            scores_arr[start:end] = scores
-            labels_arr[start:end] = labels
-            for ind in range(7):
-                metadata_arr[start:end, ind] = metadata[ind]
-            start = end
+        arr_len = len(loader.dataset) * loader.dataset.num_clips
         if torch.cuda.is_available():
-            scores_arr = F.softmax(scores_arr.cuda(), dim=1)
+            scores_arr = torch.zeros(arr_len, 3, dtype=torch.float16).cuda()
+            labels_arr = torch.zeros(arr_len, dtype=torch.int8).cuda()
         else:
-            scores_arr = F.softmax(scores_arr, dim=1)
+            scores_arr = torch.zeros(arr_len, 3, dtype=torch.float)
+            labels_arr = torch.zeros(arr_len, dtype=torch.int8)
+        indices_arr = np.zeros(arr_len, dtype=np.int64)
+        clips_arr = np.zeros(arr_len, dtype=np.int8)
+
+        with torch.no_grad():
+            start = 0
+            for i, data in enumerate(loader.get_data_loader()):
+                network.eval()
+                labels, indices = data['y1'], data['index']
+                inputs = prepare_inputs(data, device, loader.dataset.aug_rate)
+                scores, _ = network(inputs)
+
+                end = start + len(scores)
+                scores_arr[start:end] = scores
+                labels_arr[start:end] = labels
+                indices_arr[start:end] = indices.numpy()
+                clips_arr[start:end] = data['clip'].numpy()
+                start = end
+            if torch.cuda.is_available():
+                scores_arr = F.softmax(scores_arr.cuda(), dim=1)
+            else:
+                scores_arr = F.softmax(scores_arr, dim=1)
 
     nn_scores, auprc = sum_up(
         hp,
         scores_arr.cpu().numpy(),
         labels_arr.cpu().numpy()
     )
-    return nn_scores, metadata_arr, auprc
+    if loader.dataset.cache is not None:
+        logger.info('Validation tensor cache: {}'.format(
+            loader.dataset.cache_stats()
+        ))
+    metadata = loader.dataset.data_list.metadata(indices_arr, clips_arr)
+    return nn_scores, metadata, auprc
 
 
 def extend_metadata(all_metadata: Dict[Text, List], metadata: Tuple[List]):
@@ -0,0 +1,5 @@
+import os
+import sys
+
+# the scripts in bin/ import the src package from their own folder
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
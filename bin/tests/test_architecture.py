@@ -0,0 +1,71 @@
+import os
+from collections import OrderedDict
+
+import torch
+
+from src import architecture
+from src.architecture import load_weights, normalized_weights_path
+from src.constants import DATA_PARALLEL_PREFIX
+
+
+def _save_model(path, value):
+    """Save a DataParallel state dict with float64 weights."""
+    torch.save(OrderedDict([
+        (DATA_PARALLEL_PREFIX + 'conv.weight',
+         torch.full((2, 3), value, dtype=torch.float64)),
+        (DATA_PARALLEL_PREFIX + 'bn.num_batches_tracked', torch.tensor(4)),
+    ]), path)
+
+
+def _set_mtime(path, mtime_ns):
+    os.utime(path, ns=(mtime_ns, mtime_ns))
+
+
+def test_normalized_weights_are_cached(tmp_path, monkeypatch):
+    monkeypatch.setattr(architecture, '_WEIGHTS', {})
+    network_path = str(tmp_path / 'model.pt')
+    _save_model(network_path, 1.)
+    _set_mtime(network_path, 10 ** 18)
+
+    state_dict = load_weights(network_path)
+    weights_path = normalized_weights_path(network_path)
+    assert weights_path == str(tmp_path / 'model.weights.pt')
+    assert list(state_dict) == ['conv.weight', 'bn.num_batches_tracked']
+    assert state_dict['conv.weight'].dtype == torch.float32
+    assert state_dict['bn.num_batches_tracked'].dtype == torch.int64
+    saved = torch.load(weights_path)
+    for name, tensor in state_dict.items():
+        assert torch.equal(saved[name], tensor)
+    assert sorted(os.listdir(str(tmp_path))) == \
+        ['model.pt', 'model.weights.pt']
+
+    # loaded once per process
+    assert load_weights(network_path) is state_dict
+
+    # in a new process, the normalized weights are read, not the model
+    monkeypatch.setattr(architecture, '_WEIGHTS', {})
+    torch.save({'conv.weight': torch.zeros(2, 3)}, weights_path)
+    _set_mtime(weights_path, 10 ** 18 + 1)
+    assert torch.equal(
+        load_weights(network_path)['conv.weight'], torch.zeros(2, 3)
+    )
+
+
+def test_normalized_weights_rebuilt_for_newer_model(tmp_path, monkeypatch):
+    monkeypatch.setattr(architecture, '_WEIGHTS', {})
+    network_path = str(tmp_path / 'model.pt')
+    _save_model(network_path, 1.)
+    _set_mtime(network_path, 10 ** 18)
+    load_weights(network_path)
+    _set_mtime(normalized_weights_path(network_path), 10 ** 18)
+
+    _save_model(network_path, 2.)
+    _set_mtime(network_path, 10 ** 18 + 10 ** 9)
+    state_dict = load_weights(network_path)
+    assert torch.equal(state_dict['conv.weight'], torch.full((2, 3), 2.))
+    assert torch.equal(
+        torch.load(normalized_weights_path(network_path))['conv.weight'],
+        torch.full((2, 3), 2.)
+    )
+    # only the latest version of the model is kept
+    assert list(architecture._WEIGHTS) == [os.path.abspath(network_path)]
@@ -0,0 +1,117 @@
+import os
+from types import SimpleNamespace
+
+import numpy as np
+import pandas as pd
+import torch
+
+from src import combined
+from src.dataloaders.annotated_tensor import AnnotatedTensors
+from src.dataloaders.data_loader import MutationDataLoader, MutationDataset
+from src.models.densesomatic3d import densesomatic3d
+from src.utils import rescore, save_scores
+from src.valid_methods import validate_network
+
+AUG_RATE = 2
+ALLELES = [
+    ('A', 'C'), ('A', 'AT'), ('C', 'G'), ('ACG', 'A'), ('G', 'T'),
+    ('T', 'A'), ('T', 'TCC'), ('C', 'A'), ('G', 'GA'), ('A', 'G'),
+]
+
+
+def _loader(tmp_path, indices):
+    """Build a loader of call tensors of the variants in ALLELES at the
+    given indices, without reading any sample."""
+    paths = []
+    for i in indices:
+        paths.append(str(tmp_path / '{}.pt'.format(i)))
+        torch.save(
+            torch.from_numpy(np.random.default_rng(i).random(
+                (11, 3, 4, 20), np.float32
+            )),
+            paths[-1]
+        )
+    dataset = MutationDataset.__new__(MutationDataset)
+    dataset.for_train = False
+    dataset.aug_rate = AUG_RATE
+    dataset.num_clips = AUG_RATE
+    dataset.window_size = 0
+    dataset.cache = None
+    dataset.data_list = AnnotatedTensors.from_columns(
+        paths, [-1] * len(indices), [i % 3 for i in indices],
+        [0] * len(indices), {
+            'POS': [100 * (i + 1) for i in indices],
+            'CHROM': ['chr1'] * len(indices),
+            'REF': [ALLELES[i][0] for i in indices],
+            'ALT': [ALLELES[i][1] for i in indices],
+            'SAMPLE': ['s'] * len(indices),
+            'REPLICATE': ['1'] * len(indices),
+        }
+    )
+    loader = MutationDataLoader.__new__(MutationDataLoader)
+    loader.dataset = dataset
+    loader.for_train = False
+    loader.sampler = None
+    loader.data_loader = None
+    loader.configure(num_workers=0, prefetch_factor=2, batch_size=8)
+    return loader
+
+
+def _networks():
+    networks = {}
+    for seed, model in enumerate(['snv.pt', 'indel.pt']):
+        torch.manual_seed(seed)
+        networks[model] = densesomatic3d(16, 8, (2, 2), 2, 11, 0.).eval()
+    return networks
+
+
+def _hp(out_path, **kwargs):
+    os.makedirs(out_path, exist_ok=True)
+    return SimpleNamespace(**dict(dict(
+        prediction_mode='somatic',
+        pretrained_model='snv.pt',
+        indel_model='indel.pt',
+        quantize=False,
+        multi_mode=False,
+        cpu_workers=None,
+        out_path=str(out_path),
+    ), **kwargs))
+
+
+def _scores(out_path, mode):
+    df = pd.read_csv(
+        os.path.join(out_path, 'all_scores_{}.tsv'.format(mode)), sep='\t'
+    )
+    return df.sort_values(['POS', 'CLIPPING']).reset_index(drop=True)
+
+
+def test_combined_scores_match_single_mode_scores(tmp_path, monkeypatch):
+    networks = _networks()
+    monkeypatch.setattr(
+        combined, 'MutationDataLoader',
+        lambda hp: _loader(tmp_path, range(len(ALLELES)))
+    )
+    monkeypatch.setattr(
+        combined, 'initialize_network',
+        lambda hp, path, for_inference: networks[path]
+    )
+    combined.combined_call(_hp(tmp_path / 'combined'))
+
+    for mode, model, is_indel in [
+        ('somatic_snv', 'snv.pt', False), ('somatic_indel', 'indel.pt', True)
+    ]:
+        indices = [i for i, (ref, alt) in enumerate(ALLELES)
+                   if (len(ref) != len(alt)) == is_indel]
+        out_path = tmp_path / mode
+        hp = _hp(out_path, prediction_mode=mode)
+        scores, metadata, _ = validate_network(
+            _loader(out_path, indices), hp, network=networks[model]
+        )
+        save_scores(
+            rescore(scores, mode), metadata, str(out_path), mode, True
+        )
+
+        actual = _scores(tmp_path / 'combined', mode)
+        expected = _scores(out_path, mode)
+        assert len(actual) == len(indices) * AUG_RATE
+        pd.testing.assert_frame_equal(actual, expected, atol=1e-6)
@@ -0,0 +1,134 @@
+import numpy as np
+import torch
+
+from src.dataloaders.annotated_tensor import AnnotatedTensors
+from src.dataloaders.data_loader import MutationDataset, collate_batch
+from src.dataloaders.input_parsers import clip_batch
+from src.dataloaders.sampler import BalancedSampler
+from src.dataloaders.tensor_store import quantize
+from src.utils import prepare_inputs
+
+NUM_CLIPS = 3
+
+
+def _test_items(arrs, scales=None):
+    """Build the items MutationDataset returns when testing."""
+    items = []
+    for i, arr in enumerate(arrs):
+        item = {
+            'X': torch.from_numpy(arr),
+            'y1': i % 3,
+            'y2': 0,
+            'clip': torch.arange(NUM_CLIPS),
+            'index': i,
+        }
+        if scales is not None:
+            item['scale'] = torch.from_numpy(scales[i, 0])
+            item['offset'] = torch.from_numpy(scales[i, 1])
+        items.append(item)
+    return items
+
+
+def _data_set(tmp_path, for_train, num_entries=4):
+    """Build a data set over .pt tensors, without reading any sample."""
+    paths = []
+    for i in range(num_entries):
+        paths.append(str(tmp_path / '{}.pt'.format(i)))
+        torch.save(torch.full((3, 2, 4), float(i)), paths[-1])
+    dataset = MutationDataset.__new__(MutationDataset)
+    dataset.for_train = for_train
+    dataset.num_clips = NUM_CLIPS
+    dataset.window_size = 0
+    dataset.cache = None
+    dataset.data_list = AnnotatedTensors.from_columns(
+        paths, [-1] * num_entries, list(range(num_entries)),
+        [0] * num_entries, {
+            'POS': list(range(num_entries)),
+            'CHROM': ['chr1'] * num_entries,
+            'REF': ['A'] * num_entries,
+            'ALT': ['C'] * num_entries,
+            'SAMPLE': ['s'] * num_entries,
+            'REPLICATE': ['1'] * num_entries,
+        }
+    )
+    return dataset
+
+
+def test_training_index_maps_to_entry_and_clip_level(tmp_path):
+    dataset = _data_set(tmp_path, for_train=True)
+
+    assert len(dataset) == 4 * NUM_CLIPS
+    for idx in range(len(dataset)):
+        item = dataset[idx]
+        entry, clip = divmod(idx, NUM_CLIPS)
+        assert item['clip'] == clip
+        assert item['y1'] == entry
+        assert torch.equal(item['X'], torch.full((3, 2, 4), float(entry)))
+
+
+def test_testing_index_maps_to_entry_with_all_clip_levels(tmp_path):
+    dataset = _data_set(tmp_path, for_train=False)
+
+    assert len(dataset) == 4
+    item = dataset[2]
+    assert item['index'] == 2
+    assert item['clip'].tolist() == list(range(NUM_CLIPS))
+    assert torch.equal(item['X'], torch.full((3, 2, 4), 2.))
+
+
+def test_balanced_sampler_draws_entries_and_clip_levels_of_each_class():
+    index_mappings = {
+        'SOMATIC': np.array([0, 5]),
+        'GERMLINE': np.array([1, 2, 3]),
+        'NO MUTATION': np.array([4, 6, 7, 8, 9, 10]),
+        'UNKNOWN': np.zeros(0, dtype=np.int64),
+    }
+    sampler = BalancedSampler(index_mappings, 'somatic_snv', NUM_CLIPS)
+    indices = np.array(list(sampler))
+
+    # at most as many entries per class as there are somatic entries
+    assert len(sampler) == len(indices) == 3 * 2 * NUM_CLIPS
+    entries, clips = np.divmod(indices, NUM_CLIPS)
+    assert set(clips) <= set(range(NUM_CLIPS))
+    for class_indices in index_mappings.values():
+        drawn = np.isin(entries, class_indices).sum()
+        assert drawn == min(2, len(class_indices)) * NUM_CLIPS
+
+
+def test_collate_keeps_one_tensor_per_entry():
+    arrs = np.random.default_rng(0).random((4, 11, 3, 2, 20), np.float32)
+    batch = collate_batch(_test_items(arrs))
+
+    assert batch['X'].shape[0] == 4
+    assert batch['clip'].tolist() == [0, 1, 2] * 4
+    assert batch['index'].tolist() == [0, 0, 0, 1, 1, 1, 2, 2, 2, 3, 3, 3]
+    assert batch['y1'].tolist() == [0, 0, 0, 1, 1, 1, 2, 2, 2, 0, 0, 0]
+
+
+def test_prepare_inputs_expands_clip_levels():
+    arrs = np.random.default_rng(0).random((4, 11, 3, 2, 20), np.float32)
+    inputs = prepare_inputs(
+        collate_batch(_test_items(arrs)), torch.device('cpu'), NUM_CLIPS
+    )
+
+    expected = clip_batch(
+        torch.from_numpy(arrs).repeat_interleave(NUM_CLIPS, dim=0),
+        torch.arange(NUM_CLIPS).repeat(4),
+        NUM_CLIPS
+    )
+    assert torch.equal(inputs, expected)
+
+
+def test_prepare_inputs_dequantizes_before_expanding():
+    arrs = np.random.default_rng(0).random((4, 11, 3, 2, 20), np.float32)
+    quantized, scales = quantize(arrs, 'uint8')
+    inputs = prepare_inputs(
+        collate_batch(_test_items(quantized, scales)),
+        torch.device('cpu'),
+        0
+    )
+
+    assert inputs.shape[0] == 4 * NUM_CLIPS
+    np.testing.assert_allclose(
+        inputs[::NUM_CLIPS].numpy(), arrs, atol=scales[:, 0].max()
+    )
@@ -0,0 +1,51 @@
+import pytest
+import torch
+import torch.nn.functional as F
+
+from src.models.densesomatic3d import densesomatic3d
+
+
+def _network_pair():
+    """Build a network and its memory efficient copy, with the same weights."""
+    torch.manual_seed(0)
+    network = densesomatic3d(16, 8, (3, 2), 2, 11, 0.)
+    efficient = densesomatic3d(16, 8, (3, 2), 2, 11, 0., memory_efficient=True)
+    efficient.load_state_dict(network.state_dict())
+    return network, efficient
+
+
+def _train_step(network, inputs, labels):
+    network.train()
+    outputs1, outputs2 = network(inputs.clone().requires_grad_())
+    loss = F.cross_entropy(outputs1, labels) + F.cross_entropy(outputs2, labels)
+    network.zero_grad()
+    loss.backward()
+    return loss.item()
+
+
+def test_memory_efficient_matches_losses_and_gradients():
+    network, efficient = _network_pair()
+    inputs = torch.rand(8, 11, 3, 4, 20)
+    labels = torch.arange(8) % 3
+
+    assert _train_step(network, inputs, labels) == pytest.approx(
+        _train_step(efficient, inputs, labels), abs=1e-6)
+    gradients = dict(network.named_parameters())
+    for name, parameter in efficient.named_parameters():
+        assert torch.allclose(parameter.grad, gradients[name].grad, atol=1e-6)
+
+
+def test_memory_efficient_updates_running_stats_once():
+    network, efficient = _network_pair()
+    inputs = torch.rand(8, 11, 3, 4, 20)
+    labels = torch.arange(8) % 3
+
+    for _ in range(3):
+        _train_step(network, inputs, labels)
+        _train_step(efficient, inputs, labels)
+    buffers = dict(network.named_buffers())
+    for name, buffer in efficient.named_buffers():
+        if name.endswith('num_batches_tracked'):
+            assert buffer.item() == buffers[name].item() == 3
+        else:
+            assert torch.allclose(buffer, buffers[name], atol=1e-5), name
@@ -0,0 +1,47 @@
+import os
+
+import numpy as np
+import pytest
+import torch
+
+from src.constants import ONNX_TOLERANCE
+from src.inference import OnnxNetwork, export_onnx, onnx_max_difference
+from src.models.densesomatic3d import densesomatic3d
+
+pytest.importorskip('onnxruntime')
+
+
+def _trained_network():
+    """Build a small network with non-trivial batch norm statistics."""
+    torch.manual_seed(0)
+    network = densesomatic3d(16, 8, (2, 2), 2, 11, 0.)
+    network.train()
+    with torch.no_grad():
+        for _ in range(3):
+            network(torch.rand(16, 11, 3, 4, 20) * 4)
+    return network.eval()
+
+
+def test_onnx_export_matches_torch(tmp_path):
+    network = _trained_network()
+    onnx_path = str(tmp_path / 'model.onnx')
+    export_onnx(network, onnx_path, torch.rand(8, 11, 3, 4, 20))
+
+    assert os.listdir(str(tmp_path)) == ['model.onnx']
+    # the batch size is dynamic
+    for batch_size in [1, 8, 33]:
+        inputs = torch.rand(batch_size, 11, 3, 4, 20)
+        assert onnx_max_difference(network, onnx_path, inputs) \
+            <= ONNX_TOLERANCE
+
+
+def test_onnx_network_scores_like_torch(tmp_path):
+    network = _trained_network()
+    onnx_network = OnnxNetwork(network, str(tmp_path / 'model.onnx'))
+    inputs = torch.rand(8, 11, 3, 4, 20)
+
+    with torch.no_grad():
+        expected = [out.numpy() for out in network(inputs)]
+        outputs = [out.numpy() for out in onnx_network(inputs)]
+    for out, ref in zip(outputs, expected):
+        np.testing.assert_allclose(out, ref, atol=ONNX_TOLERANCE)
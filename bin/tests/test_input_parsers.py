@@ -0,0 +1,93 @@
+import gzip
+
+import pandas as pd
+import pytest
+
+from src.dataloaders.input_parsers import parse_variants
+
+VARIANTS = [
+    ('chr1', 100, 'A', 'C', 'PASS'),
+    ('chr1', 200, 'AT', 'A', 'PASS'),
+    ('chr2', 300, 'G', 'T', 'LowQual'),
+    ('chr2', 400, 'G', 'GCA', 'PASS'),
+    ('chrX', 500, 'TC', 'GA', 'PASS'),
+    ('chrX', 600, 'C', 'A', '.'),
+    ('chrY', 700, 'CAT', 'C', 'PASS'),
+]
+SNVS = [variant for variant in VARIANTS if len(variant[2]) == len(variant[3])]
+INDELS = [variant for variant in VARIANTS if variant not in SNVS]
+
+
+def _write(path, lines):
+    opener = gzip.open if path.endswith('.gz') else open
+    with opener(path, 'wt') as f:
+        f.write(''.join(line + '\n' for line in lines))
+    return path
+
+
+def _vcf(path):
+    return _write(path, [
+        '##fileformat=VCFv4.2',
+        '##source=test',
+        '#CHROM\tPOS\tID\tREF\tALT\tQUAL\tFILTER\tINFO',
+    ] + [
+        '{}\t{}\t.\t{}\t{}\t50\t{}\t.'.format(*variant)
+        for variant in VARIANTS
+    ])
+
+
+def _tsv(path):
+    return _write(path, ['CHROM\tPOS\tREF\tALT\tDP'] + [
+        '{}\t{}\t{}\t{}\t30'.format(*variant[:4]) for variant in VARIANTS
+    ])
+
+
+def _rows(df):
+    return [tuple(row) for row in df.itertuples(index=False)]
+
+
+@pytest.mark.parametrize('prediction_mode, expected', [
+    ('somatic_snv', SNVS),
+    ('germline_indel', INDELS),
+])
+def test_plain_vcf(tmp_path, prediction_mode, expected):
+    df = parse_variants(_vcf(str(tmp_path / 'calls.vcf')), prediction_mode)
+    assert list(df.columns) == ['CHROM', 'POS', 'REF', 'ALT', 'FILTER']
+    assert _rows(df) == expected
+    assert df.index.tolist() == list(range(len(expected)))
+
+
+def test_gzipped_tsv(tmp_path):
+    df = parse_variants(_tsv(str(tmp_path / 'calls.tsv.gz')), 'somatic_snv')
+    assert list(df.columns) == ['CHROM', 'POS', 'REF', 'ALT']
+    assert _rows(df) == [variant[:4] for variant in SNVS]
+
+
+def test_gzipped_vcf_detected_from_header(tmp_path):
+    # no VCF extension, the meta-information lines identify it
+    df = parse_variants(_vcf(str(tmp_path / 'calls.txt.gz')), 'somatic_snv')
+    assert _rows(df) == SNVS
+
+
+@pytest.mark.parametrize('chunk_size', [1, 2, 3, 5, 7, 100])
+def test_chunks_do_not_change_variants(tmp_path, chunk_size):
+    path = _vcf(str(tmp_path / 'calls.vcf.gz'))
+    expected = parse_variants(path, 'somatic_indel')
+    df = parse_variants(path, 'somatic_indel', chunk_size=chunk_size)
+    pd.testing.assert_frame_equal(df, expected)
+    assert _rows(df) == INDELS
+
+
+def test_no_variants_of_the_type(tmp_path):
+    path = _write(str(tmp_path / 'calls.tsv'), ['CHROM\tPOS\tREF\tALT'] + [
+        '{}\t{}\t{}\t{}'.format(*variant[:4]) for variant in INDELS
+    ])
+    df = parse_variants(path, 'somatic_snv', chunk_size=2)
+    assert len(df) == 0
+    assert list(df.columns) == ['CHROM', 'POS', 'REF', 'ALT']
+
+
+def test_missing_columns(tmp_path):
+    path = _write(str(tmp_path / 'calls.tsv'), ['CHROM\tPOS\tREF', 'chr1\t1\tA'])
+    with pytest.raises(Exception, match='Wrong variants file'):
+        parse_variants(path, 'somatic_snv')
@@ -0,0 +1,55 @@
+import numpy as np
+import pandas as pd
+
+from src.constants import GERMLINE, NO_MUT, SOMATIC
+from src.dataloaders.populator import populate
+
+
+def _candidates():
+    """Candidates merged with labels and tensors, one per labelling rule."""
+    return pd.DataFrame({
+        'CHROM': ['chr1'] * 6,
+        'POS': [10, 20, 30, 40, 50, 60],
+        'REF': ['A', 'C', 'G', 'T', 'A', 'ACG'],
+        'ALT': ['C', 'G', 'T', 'A', 'AT', 'A'],
+        'LABEL': [True, False, False, True, False, False],
+        'FILTER': ['somatic', 'SNP', 'no_mutation', None, 'other', 'SNP'],
+        'LENGTH': [0, 0, 0, 0, 1, -5],
+        'FULL_PATH': ['{}.pt'.format(i) for i in range(6)],
+        'SHARD_ITEM': [-1] * 6,
+    })
+
+
+def test_populate_labels_each_candidate_by_precedence():
+    data_list, indices = populate(_candidates(), 's1')
+
+    # a missing filter makes any label unknown, the label wins over filters
+    assert indices['SOMATIC'].tolist() == [0]
+    assert indices['GERMLINE'].tolist() == [1, 5]
+    assert indices['NO MUTATION'].tolist() == [2]
+    assert indices['UNKNOWN'].tolist() == [3, 4]
+    # unknown candidates are trained on as no mutation
+    assert data_list.mutation_types.tolist() == [
+        SOMATIC, GERMLINE, NO_MUT, NO_MUT, NO_MUT, GERMLINE
+    ]
+    assert data_list.mutation_length_types.tolist() == [0, 0, 0, 0, 1, 3]
+
+
+def test_populate_keeps_the_candidate_metadata():
+    data_list, _ = populate(_candidates(), 's1')
+
+    metadata = data_list.metadata()
+    assert metadata['POS'].tolist() == [10, 20, 30, 40, 50, 60]
+    assert metadata['ALT'].tolist() == ['C', 'G', 'T', 'A', 'AT', 'A']
+    assert set(metadata['SAMPLE']) == {'s1'}
+    assert set(metadata['REPLICATE']) == {'1'}
+    assert set(metadata['CLIPPING']) == {0}
+    assert [data_list.tensor(i) for i in range(2)] == [('0.pt', -1),
+                                                       ('1.pt', -1)]
+
+
+def test_populate_empty_candidates():
+    data_list, indices = populate(_candidates().iloc[:0], 's1')
+
+    assert len(data_list) == 0
+    assert all(len(class_indices) == 0 for class_indices in indices.values())
@@ -0,0 +1,149 @@
+import json
+import multiprocessing
+from types import SimpleNamespace
+
+import numpy as np
+import pytest
+import torch
+
+from src import quantization
+from src.constants import QUANTIZE_MAX_DRIFT
+from src.dataloaders.annotated_tensor import AnnotatedTensors
+from src.dataloaders.data_loader import MutationDataLoader, MutationDataset
+from src.inference import score_batches
+from src.models.densesomatic3d import densesomatic3d
+from src.quantization import (
+    quantize_network, quantized_calibration_path, quantized_metadata_path
+)
+from src.utils import binary_scores
+
+
+def _network():
+    """Build a small network with non-trivial batch norm statistics."""
+    torch.manual_seed(0)
+    network = densesomatic3d(16, 8, (2, 2), 2, 11, 0.)
+    network.train()
+    with torch.no_grad():
+        for _ in range(3):
+            network(torch.rand(16, 11, 3, 4, 20))
+    return network.eval()
+
+
+def _hp(tmp_path, **kwargs):
+    pretrained_model = tmp_path / 'model.pt'
+    torch.save(_network().state_dict(), str(pretrained_model))
+    return SimpleNamespace(**dict(dict(
+        pretrained_model=str(pretrained_model),
+        window_size=0,
+        architecture='DenseSomatic3D',
+        num_init_features=16,
+        growth_rate=8,
+        bn_size=2,
+        block_config=[2, 2],
+        channels=24,
+        batch_size=16,
+        prediction_mode='somatic_snv',
+    ), **kwargs))
+
+
+def _loader(tmp_path, num_entries=96, num_workers=0):
+    """Build a loader of call tensors, without reading any sample."""
+    rng = np.random.default_rng(0)
+    paths = []
+    for i in range(num_entries):
+        paths.append(str(tmp_path / '{}.pt'.format(i)))
+        torch.save(
+            torch.from_numpy(rng.random((11, 3, 4, 20), np.float32)),
+            paths[-1]
+        )
+    dataset = MutationDataset.__new__(MutationDataset)
+    dataset.for_train = False
+    dataset.aug_rate = 0
+    dataset.num_clips = 1
+    dataset.window_size = 0
+    dataset.cache = None
+    dataset.data_list = AnnotatedTensors.from_columns(
+        paths, [-1] * num_entries, [i % 3 for i in range(num_entries)],
+        [0] * num_entries, {
+            'POS': list(range(num_entries)),
+            'CHROM': ['chr1'] * num_entries,
+            'REF': ['A'] * num_entries,
+            'ALT': ['C'] * num_entries,
+            'SAMPLE': ['s'] * num_entries,
+            'REPLICATE': ['1'] * num_entries,
+        }
+    )
+    loader = MutationDataLoader.__new__(MutationDataLoader)
+    loader.dataset = dataset
+    loader.for_train = False
+    loader.sampler = None
+    loader.data_loader = None
+    loader.configure(
+        num_workers=num_workers, prefetch_factor=2, batch_size=16
+    )
+    return loader
+
+
+class _Unread:
+    """A loader that fails when read, for calls that use the cache."""
+
+    def __getattr__(self, name):
+        raise AssertionError('The loader is read')
+
+
+def _drift(quantized, inputs):
+    return np.abs(
+        binary_scores(score_batches(quantized, inputs), 'somatic_snv')
+        - binary_scores(score_batches(_network(), inputs), 'somatic_snv')
+    ).mean()
+
+
+def test_quantized_network_is_cached_and_bounded(tmp_path):
+    hp, loader = _hp(tmp_path), _loader(tmp_path, num_workers=2)
+    quantized = quantize_network(_network(), loader, hp)
+
+    assert isinstance(quantized, torch.jit.ScriptModule)
+    # its workers are stopped, e.g. before sharded_scores forks
+    assert multiprocessing.active_children() == []
+    with open(quantized_metadata_path(hp.pretrained_model)) as f:
+        metadata = json.load(f)
+    assert metadata['check']['mean_binary_drift'] <= QUANTIZE_MAX_DRIFT
+    assert 'float_auprc' in metadata['check']
+    assert metadata['calibration']['variants'] == 96
+    assert loader.data_loader is None
+
+    cached = quantize_network(_network(), _Unread(), hp)
+    inputs = torch.rand(32, 11, 3, 4, 20)
+    assert isinstance(cached, torch.jit.ScriptModule)
+    np.testing.assert_allclose(
+        score_batches(cached, inputs), score_batches(quantized, inputs),
+        atol=1e-6
+    )
+    assert _drift(cached, inputs) <= QUANTIZE_MAX_DRIFT
+
+
+def test_other_settings_rebuild_from_the_saved_calibration(tmp_path):
+    hp, loader = _hp(tmp_path), _loader(tmp_path)
+    quantize_network(_network(), loader, hp)
+    calibration = torch.load(quantized_calibration_path(hp.pretrained_model))
+
+    # another window size keys another network and calibration tensors
+    other = SimpleNamespace(**dict(vars(hp), window_size=10))
+    with pytest.raises(AssertionError):
+        quantize_network(_network(), _Unread(), other)
+    quantize_network(_network(), _loader(tmp_path, 48), other)
+    with open(quantized_metadata_path(hp.pretrained_model)) as f:
+        assert json.load(f)['settings']['window_size'] == 10
+    saved = torch.load(quantized_calibration_path(hp.pretrained_model))
+    assert saved['settings']['window_size'] == 10
+    assert len(saved['inputs']) == 48
+    assert len(calibration['inputs']) == 96
+
+
+def test_drifting_network_is_not_used(tmp_path, monkeypatch):
+    monkeypatch.setattr(quantization, 'QUANTIZE_MAX_DRIFT', -1)
+    hp, network = _hp(tmp_path), _network()
+
+    assert quantize_network(network, _loader(tmp_path), hp) is network
+    # the check is cached with the network, it is not run again
+    assert quantize_network(network, _Unread(), hp) is network
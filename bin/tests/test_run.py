@@ -0,0 +1,51 @@
+import pytest
+
+from src.run import parse_command_line
+
+
+def test_call_command_line():
+    # as run by modules/variantmedium/call/main.nf
+    parsed = parse_command_line([
+        'call',
+        '--home_folder', '/data/home',
+        '--unknown_strategy_call', 'keep_as_false',
+        '--pretrained_model', '/models/model.pt',
+        '--prediction_mode', 'somatic_snv',
+        '--learning_rate', '0.001',
+        '--epoch', '0',
+        '--drop_rate', '0.1',
+        '--aug_rate', '5',
+        '--aug_mixes', 'nan',
+        '--run', 'call',
+        '--block_config=[4, 4]',
+        '--quantize', 'True',
+    ])
+    assert parsed == ('call', {
+        'home_folder': '/data/home',
+        'unknown_strategy_call': 'keep_as_false',
+        'pretrained_model': '/models/model.pt',
+        'prediction_mode': 'somatic_snv',
+        'learning_rate': 0.001,
+        'epoch': 0,
+        'drop_rate': 0.1,
+        'aug_rate': 5,
+        'aug_mixes': 'nan',
+        'run': 'call',
+        'block_config': [4, 4],
+    }, {'quantize': True})
+
+
+@pytest.mark.parametrize('argv', [
+    [],
+    ['--help'],
+    ['call', '--help'],
+    ['_set_call_paths'],
+    ['home_folder', '--run', 'call'],
+    ['call', '--no_such_flag', '1'],
+    ['call', '--quantize'],
+    ['call', '--quantize', '--run', 'call'],
+    ['call', '--run', 'call', '--run', 'train'],
+    ['call', 'extra'],
+])
+def test_other_command_lines_left_to_fire(argv):
+    assert parse_command_line(argv) is None
@@ -0,0 +1,114 @@
+import os
+from types import SimpleNamespace
+
+import numpy as np
+import pytest
+import torch
+from torch.utils.data import DataLoader
+
+from src.dataloaders.annotated_tensor import AnnotatedTensors
+from src.dataloaders.data_loader import MutationDataset, collate_batch
+from src.models.densesomatic3d import densesomatic3d
+from src.sharded import core_groups, sharded_scores
+from src.utils import prepare_inputs
+
+AUG_RATE = 2
+
+
+@pytest.fixture
+def two_cpus(monkeypatch):
+    """Split the work in two CPU groups, both pinned to the CPUs we have."""
+    cores = sorted(os.sched_getaffinity(0))
+    setaffinity = os.sched_setaffinity
+
+    def sched_setaffinity(pid, group):
+        assert all(type(core) is int for core in group)
+        setaffinity(pid, [cores[core % len(cores)] for core in group])
+
+    monkeypatch.setattr(os, 'sched_getaffinity', lambda pid: {0, 1})
+    monkeypatch.setattr(os, 'sched_setaffinity', sched_setaffinity)
+
+
+def _loader(tmp_path, num_entries=7):
+    """Build a loader over .pt tensors, without reading any sample."""
+    rng = np.random.default_rng(0)
+    paths = []
+    for i in range(num_entries):
+        paths.append(str(tmp_path / '{}.pt'.format(i)))
+        torch.save(
+            torch.from_numpy(rng.random((11, 3, 4, 20), np.float32)),
+            paths[-1]
+        )
+    dataset = MutationDataset.__new__(MutationDataset)
+    dataset.for_train = False
+    dataset.aug_rate = AUG_RATE
+    dataset.num_clips = AUG_RATE
+    dataset.window_size = 0
+    dataset.cache = None
+    dataset.data_list = AnnotatedTensors.from_columns(
+        paths, [-1] * num_entries, [i % 3 for i in range(num_entries)],
+        [0] * num_entries, {
+            'POS': list(range(num_entries)),
+            'CHROM': ['chr1'] * num_entries,
+            'REF': ['A'] * num_entries,
+            'ALT': ['C'] * num_entries,
+            'SAMPLE': ['s'] * num_entries,
+            'REPLICATE': ['1'] * num_entries,
+        }
+    )
+    return SimpleNamespace(
+        dataset=dataset, batch_size=3, release=lambda: None
+    )
+
+
+def _network():
+    torch.manual_seed(0)
+    return densesomatic3d(16, 8, (2, 2), 2, 11, 0.).eval()
+
+
+def _in_process_scores(network, loader):
+    scores, indices, clips = [], [], []
+    with torch.no_grad():
+        for data in DataLoader(
+                loader.dataset, batch_size=loader.batch_size,
+                collate_fn=collate_batch
+        ):
+            inputs = prepare_inputs(data, torch.device('cpu'), AUG_RATE)
+            scores.append(network(inputs)[0].numpy())
+            indices.append(data['index'].numpy())
+            clips.append(data['clip'].numpy())
+    return [np.concatenate(arrs) for arrs in [scores, indices, clips]]
+
+
+def test_core_groups_are_contiguous_plain_ints(monkeypatch):
+    monkeypatch.setattr(os, 'sched_getaffinity', lambda pid: {4, 0, 3, 1, 2})
+
+    assert core_groups(2) == [[0, 1], [2, 3, 4]]
+    assert core_groups(8) == [[0], [1], [2], [3], [4]]
+    assert all(type(core) is int for group in core_groups(3)
+               for core in group)
+
+
+def test_sharded_scores_match_in_process_scores(tmp_path, two_cpus):
+    network, loader = _network(), _loader(tmp_path)
+    scores, labels, indices, clips = sharded_scores(network, loader, 2)
+
+    expected, expected_indices, expected_clips = \
+        _in_process_scores(network, loader)
+    np.testing.assert_allclose(scores, expected, atol=1e-5)
+    assert indices.tolist() == expected_indices.tolist()
+    assert clips.tolist() == expected_clips.tolist()
+    assert labels.tolist() == [i % 3 for i in indices]
+
+
+def test_sharded_onnx_scores_match_in_process_scores(tmp_path, two_cpus):
+    pytest.importorskip('onnxruntime')
+    from src.inference import OnnxNetwork
+
+    network, loader = _network(), _loader(tmp_path)
+    onnx_network = OnnxNetwork(network, str(tmp_path / 'model.onnx'))
+    scores = sharded_scores(onnx_network, loader, 2)[0]
+
+    assert onnx_network.checked
+    expected = _in_process_scores(network, loader)[0]
+    np.testing.assert_allclose(scores, expected, atol=1e-4)
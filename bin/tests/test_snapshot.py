@@ -0,0 +1,129 @@
+import os
+
+import numpy as np
+
+from src.constants import TENSOR_INDEX_FNAME
+from src.dataloaders.annotated_tensor import AnnotatedTensors
+from src.dataloaders.snapshot import (
+    fingerprint, load_snapshot, save_snapshot, snapshot_path
+)
+
+
+def _sample(tmp_path):
+    """Create the input files of a sample, without labels."""
+    tensors = tmp_path / 'sample' / 'purity-1.0-downsample-1.0-contamination-0.0'
+    tensors.mkdir(parents=True)
+    (tensors / 'chr1-100-snv-0-1-0.pt').write_bytes(b'')
+    candidates = tmp_path / 'candidates.tsv'
+    candidates.write_text('CHROM\tPOS\tREF\tALT\nchr1\t100\tA\tC\n')
+    return {
+        'tensors': str(tmp_path / 'sample'),
+        'candidates': str(candidates),
+        'labels': None,
+    }
+
+
+def _data_set():
+    data_list = AnnotatedTensors.from_columns(
+        ['a.pt', 'b.pt'], [-1, -1], [0, 2], [0, 1], {
+            'POS': [100, 200],
+            'CHROM': ['chr1', 'chr2'],
+            'REF': ['A', 'C'],
+            'ALT': ['C', 'G'],
+            'SAMPLE': ['s', 's'],
+            'REPLICATE': ['1', '1'],
+        }
+    )
+    return data_list, {'somatic': np.array([1])}
+
+
+def _snapshot(tmp_path):
+    paths = _sample(tmp_path)
+    path = snapshot_path(paths, 'somatic_snv', False, None, 'keep_as_false')
+    return paths, path, fingerprint(paths, False, None)
+
+
+def test_snapshot_round_trip(tmp_path):
+    paths, path, inputs = _snapshot(tmp_path)
+    save_snapshot(path, inputs, _data_set())
+
+    found, (data_list, class_indices) = load_snapshot(path, inputs)
+    assert found
+    assert data_list.metadata().equals(_data_set()[0].metadata())
+    assert list(class_indices['somatic']) == [1]
+    assert [name for name in os.listdir(os.path.dirname(path))
+            if name.endswith('.tmp')] == []
+
+
+def test_truncated_snapshot_is_rebuilt(tmp_path):
+    paths, path, inputs = _snapshot(tmp_path)
+    save_snapshot(path, inputs, _data_set())
+    with open(path, 'rb') as f:
+        content = f.read()
+
+    for size in [0, 10, len(content) // 2, len(content) - 10]:
+        with open(path, 'wb') as f:
+            f.write(content[:size])
+        assert load_snapshot(path, inputs) == (False, None)
+
+
+def _touch(path, offset_ns):
+    """Change the modification time of a file or directory."""
+    stat = os.stat(path)
+    os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns + offset_ns))
+
+
+def _append(path, text):
+    with open(path, 'a') as f:
+        f.write(text)
+
+
+def test_changed_inputs_invalidate_the_snapshot(tmp_path):
+    paths, path, _ = _snapshot(tmp_path)
+    tensors = os.path.join(
+        paths['tensors'], 'purity-1.0-downsample-1.0-contamination-0.0'
+    )
+    index = os.path.join(tensors, TENSOR_INDEX_FNAME)
+    _append(index, 'FILE_NAME\tSHARD\tITEM\tENCODING\n')
+
+    for change in [
+        lambda: _touch(paths['candidates'], 10 ** 9),
+        lambda: _append(paths['candidates'], 'chr1\t200\tC\tG\n'),
+        lambda: _touch(tensors, 10 ** 9),
+        # repacked: the index is replaced, the directory is not touched
+        lambda: _append(index, 'chr1-100-snv-0-1-0.pt\tshard-00000.npy\t0'
+                               '\traw\n'),
+    ]:
+        inputs = fingerprint(paths, False, None)
+        save_snapshot(path, inputs, _data_set())
+        change()
+        changed = fingerprint(paths, False, None)
+        assert changed != inputs
+        assert load_snapshot(path, changed) == (False, None)
+
+
+def test_unchanged_inputs_keep_the_fingerprint(tmp_path):
+    paths, path, inputs = _snapshot(tmp_path)
+
+    assert fingerprint(paths, False, None) == inputs
+
+
+def test_settings_select_another_snapshot(tmp_path):
+    paths, path, inputs = _snapshot(tmp_path)
+
+    others = [
+        snapshot_path(paths, 'germline_snp', False, None, 'keep_as_false'),
+        snapshot_path(paths, 'somatic_snv', True, None, 'keep_as_false'),
+        snapshot_path(paths, 'somatic_snv', False, None, 'discard'),
+        snapshot_path(
+            dict(paths, labels=paths['candidates']), 'somatic_snv', False,
+            None, 'keep_as_false'
+        ),
+    ]
+    assert len(set(others + [path])) == len(others) + 1
+    assert all(os.path.dirname(other) == os.path.dirname(path)
+               for other in others)
+    # augmentation mixes are only used when training
+    assert snapshot_path(
+        paths, 'somatic_snv', False, ['purity-0.5'], 'keep_as_false'
+    ) == path
@@ -0,0 +1,82 @@
+from types import SimpleNamespace
+
+import torch
+
+from src.dataloaders.annotated_tensor import AnnotatedTensors
+from src import streaming
+from src.streaming import StreamingLoader
+
+NUM_CLIPS = 2
+
+
+def _data_list(tmp_path, name, num_entries):
+    """Write the tensors of a sample and build its entries."""
+    paths = []
+    for i in range(num_entries):
+        path = tmp_path / '{}-{}.pt'.format(name, i)
+        torch.save(torch.full((3, 2, 4), float(len(paths) + 1)), path)
+        paths.append(str(path))
+    return AnnotatedTensors.from_columns(
+        paths, [-1] * num_entries, [1] * num_entries, [0] * num_entries, {
+            'POS': list(range(num_entries)),
+            'CHROM': ['chr1'] * num_entries,
+            'REF': ['A'] * num_entries,
+            'ALT': ['C'] * num_entries,
+            'SAMPLE': [name] * num_entries,
+            'REPLICATE': ['1'] * num_entries,
+        }
+    )
+
+
+def _loader(num_workers):
+    return StreamingLoader(SimpleNamespace(
+        window_size=0,
+        aug_rate=NUM_CLIPS,
+        num_workers=num_workers,
+        prefetch_factor=2,
+        inference_batch_size=3 * NUM_CLIPS,
+        batch_size=1,
+        loader_config=None,
+        prediction_mode='somatic',
+        aug_mixes=None,
+        unknown_strategy_val=None,
+        dataset_snapshots=False,
+    ))
+
+
+def test_shared_workers_read_one_sample_after_another(tmp_path):
+    loader = _loader(num_workers=2)
+    assert loader.batch_size == 3
+
+    iterator = None
+    for name, num_entries in [('a', 5), ('b', 2)]:
+        loader.dataset.data_list = _data_list(tmp_path, name, num_entries)
+        data_loader = loader.get_data_loader()
+        batches = list(data_loader)
+        if iterator is not None:
+            assert data_loader._iterator is iterator
+        iterator = data_loader._iterator
+
+        x = torch.cat([batch['X'] for batch in batches])
+        index = torch.cat([batch['index'] for batch in batches])
+        assert x[:, 0, 0, 0].tolist() == list(range(1, num_entries + 1))
+        assert index.tolist() == [
+            i for i in range(num_entries) for _ in range(NUM_CLIPS)
+        ]
+
+
+def test_load_replaces_the_entries(tmp_path, monkeypatch):
+    data_lists = {'a': _data_list(tmp_path, 'a', 3)}
+
+    def build_sample(sample, *args):
+        if sample not in data_lists:
+            return None
+        return data_lists[sample], None
+
+    monkeypatch.setattr(streaming, 'build_sample', build_sample)
+    loader = _loader(num_workers=0)
+    assert loader.load('a', {}) == 3
+    assert len(loader.dataset) == 3
+    assert loader.load('b', {}) == 0
+    assert len(loader.dataset) == 0
+    assert list(loader.get_data_loader()) == []
@@ -0,0 +1,95 @@
+import torch
+from torch.utils.data import DataLoader, Dataset
+
+from src.dataloaders.tensor_cache import NOT_CACHED, SharedTensorCache
+
+
+def _tensor(value, shape=(2, 3)):
+    return {'X': torch.full(shape, value, dtype=torch.float16)}
+
+
+def _cache(num_keys=4, num_slots=2):
+    return SharedTensorCache(num_keys, num_slots, _tensor(0.))
+
+
+def test_slots_assigned_first_come():
+    cache = _cache()
+    cache.put(2, _tensor(2.))
+    cache.put(0, _tensor(0.5))
+    assert cache.slots.tolist() == [1, NOT_CACHED, 0, NOT_CACHED]
+    assert torch.equal(cache.get(2)['X'], _tensor(2.)['X'])
+    assert torch.equal(cache.get(0)['X'], _tensor(0.5)['X'])
+
+    # a cached tensor keeps its slot and value
+    cache.put(2, _tensor(3.))
+    assert cache.slots.tolist() == [1, NOT_CACHED, 0, NOT_CACHED]
+    assert torch.equal(cache.get(2)['X'], _tensor(2.)['X'])
+
+
+def test_full_cache_does_not_evict():
+    cache = _cache()
+    for key in range(4):
+        cache.put(key, _tensor(float(key)))
+    assert cache.slots.tolist() == [0, 1, NOT_CACHED, NOT_CACHED]
+    assert cache.get(2) is None
+    assert cache.get(3) is None
+    assert torch.equal(cache.get(1)['X'], _tensor(1.)['X'])
+    assert cache.stats()['cached_tensors'] == 2
+
+
+def test_other_shapes_and_types_not_cached():
+    cache = _cache()
+    cache.put(0, _tensor(1., shape=(2, 4)))
+    cache.put(1, {'X': torch.ones(2, 3)})
+    cache.put(2, dict(_tensor(1.), scales=torch.ones(2)))
+    assert cache.slots.tolist() == [NOT_CACHED] * 4
+    assert int(cache.next_slot[0]) == 0
+
+
+def test_hits_and_misses_counted():
+    cache = _cache()
+    assert cache.get(0) is None
+    cache.put(0, _tensor(1.))
+    cache.get(0)
+    cache.get(0)
+    cache.get(1)
+    stats = cache.stats()
+    assert (stats['hits'], stats['misses']) == (2, 2)
+    assert stats['hit_rate'] == 0.5
+    assert stats['capacity'] == 2
+    assert stats['bytes_used'] == 6 * 2
+    assert stats['bytes_allocated'] == 2 * 6 * 2
+
+
+class _Cached(Dataset):
+    """Read every key through the cache, filling it on a miss."""
+
+    def __init__(self, cache, num_keys):
+        self.cache = cache
+        self.num_keys = num_keys
+
+    def __len__(self):
+        return self.num_keys
+
+    def __getitem__(self, key):
+        encoded = self.cache.get(key)
+        if encoded is None:
+            encoded = _tensor(float(key))
+            self.cache.put(key, encoded)
+        return encoded['X'].clone()
+
+
+def test_workers_share_the_cache():
+    cache = _cache(num_keys=4, num_slots=4)
+    data_loader = DataLoader(
+        _Cached(cache, 4), batch_size=1, num_workers=2,
+        persistent_workers=True,
+    )
+    for _ in range(2):
+        values = [batch[0, 0, 0].item() for batch in data_loader]
+        assert values == [0., 1., 2., 3.]
+    assert sorted(cache.slots.tolist()) == [0, 1, 2, 3]
+    stats = cache.stats()
+    # the workers count in their own rows, the second pass only hits
+    assert (stats['hits'], stats['misses']) == (4, 4)
+    assert cache.counters[0].tolist() == [0, 0]
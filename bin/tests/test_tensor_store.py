@@ -0,0 +1,144 @@
+import os
+
+import numpy as np
+import pytest
+import torch
+
+from src.constants import TENSOR_INDEX_FNAME, TENSOR_SCALES_SUFFIX
+from src.dataloaders.tensor_store import (
+    crop_sparse, crop_window, densify, dequantize, list_tensors, load_tensor,
+    pack_directory, quantize, read_index, sidecar_path, sparsify
+)
+
+
+def _tensor_directory(tmp_path, num_tensors=5):
+    """Write .pt tensors into a directory, as the tensor generation does."""
+    directory = tmp_path / 'purity-1.0-downsample-1.0-contamination-0.0'
+    directory.mkdir()
+    rng = np.random.default_rng(0)
+    arrs = rng.random((num_tensors, 11, 3, 2, 20), np.float32)
+    arrs[arrs < 0.7] = 0
+    for i, arr in enumerate(arrs):
+        torch.save(
+            torch.from_numpy(arr),
+            str(directory / 'chr1-{}-snv-0-1-0.pt'.format(100 + i))
+        )
+    return str(directory), arrs
+
+
+def _load_all(directory):
+    tensors = list_tensors(directory).sort_values('FILE_NAME')
+    return np.stack([
+        load_tensor(path, item).numpy()
+        for path, item in zip(tensors['FULL_PATH'], tensors['SHARD_ITEM'])
+    ])
+
+
+@pytest.mark.parametrize('encoding, atol', [
+    ('raw', 0), ('float16', 1e-3)
+])
+def test_quantize_round_trip(encoding, atol):
+    arrs = np.random.default_rng(0).random((4, 11, 3, 20), np.float32)
+    encoded, scales = quantize(arrs, encoding)
+
+    assert scales is None
+    np.testing.assert_allclose(encoded.astype(np.float32), arrs, atol=atol)
+
+
+def test_uint8_round_trip_within_half_a_step():
+    arrs = np.random.default_rng(0).random((4, 11, 3, 20), np.float32) * 50
+    arrs[1, 2] = 7  # constant channel
+    encoded, scales = quantize(arrs, 'uint8')
+    decoded = dequantize(
+        torch.from_numpy(encoded),
+        torch.from_numpy(scales[:, 0]),
+        torch.from_numpy(scales[:, 1])
+    ).numpy()
+
+    assert encoded.dtype == np.uint8
+    assert scales.shape == (4, 2, 11)
+    error = np.abs(decoded - arrs).max(axis=(2, 3))
+    assert (error <= scales[:, 0] / 2 + 1e-5).all()
+    np.testing.assert_allclose(decoded[1, 2], 7)
+
+
+def test_unknown_encoding_is_rejected():
+    with pytest.raises(Exception):
+        quantize(np.zeros((1, 2, 3), np.float32), 'int4')
+
+
+def test_sparse_round_trip():
+    arrs = np.random.default_rng(0).random((4, 11, 3, 20), np.float32)
+    arrs[arrs < 0.8] = 0
+    arrs[2] = 0  # no non-zero value
+    values, indices, indptr = sparsify(arrs)
+    decoded = densify(
+        [torch.from_numpy(values[start:stop])
+         for start, stop in zip(indptr[:-1], indptr[1:])],
+        [torch.from_numpy(indices[start:stop]).long()
+         for start, stop in zip(indptr[:-1], indptr[1:])],
+        torch.tensor(arrs.shape[1:])
+    )
+
+    assert indptr[2] == indptr[3]
+    assert torch.equal(decoded, torch.from_numpy(arrs))
+
+
+@pytest.mark.parametrize('width', [0, 8, 20, 30])
+def test_crop_sparse_matches_dense_crop(width):
+    arr = np.random.default_rng(0).random((1, 11, 3, 20), np.float32)
+    arr[arr < 0.8] = 0
+    values, indices, _ = sparsify(arr)
+    cropped = crop_sparse(
+        torch.from_numpy(values),
+        torch.from_numpy(indices).long(),
+        torch.tensor(arr.shape[1:]),
+        width
+    )
+    decoded = densify(
+        [cropped['values']], [cropped['indices']], cropped['shape']
+    )[0]
+
+    expected = arr[0][..., crop_window(arr.shape[-1], width)]
+    assert torch.equal(decoded, torch.from_numpy(expected))
+
+
+@pytest.mark.parametrize('encoding, atol', [
+    ('raw', 0), ('float16', 1e-3), ('uint8', 1 / 255), ('sparse', 0)
+])
+def test_packed_tensors_load_as_written(tmp_path, encoding, atol):
+    directory, arrs = _tensor_directory(tmp_path)
+    pack_directory(directory, shard_size=2, encoding=encoding)
+
+    np.testing.assert_allclose(_load_all(directory), arrs, atol=atol)
+
+
+def test_sidecar_path_only_replaces_the_extension():
+    assert sidecar_path('/data/x.npy.d/shard-00000.npy', '.scales.npy') == \
+        '/data/x.npy.d/shard-00000.scales.npy'
+
+
+def test_index_records_the_encoding(tmp_path):
+    directory, arrs = _tensor_directory(tmp_path)
+    pack_directory(directory, shard_size=2, encoding='sparse')
+
+    assert set(read_index(directory)['ENCODING']) == {'sparse'}
+
+
+@pytest.mark.parametrize('first, second', [
+    ('uint8', 'raw'), ('sparse', 'float16'), ('sparse', 'raw')
+])
+def test_repacking_removes_stale_sidecars(tmp_path, first, second):
+    directory, arrs = _tensor_directory(tmp_path)
+    pack_directory(directory, shard_size=2, encoding=first)
+    os.remove(os.path.join(directory, TENSOR_INDEX_FNAME))
+    pack_directory(directory, shard_size=4, encoding=second)
+
+    names = os.listdir(directory)
+    assert not any(
+        name.endswith(TENSOR_SCALES_SUFFIX) or name.endswith('.indptr.npy')
+        for name in names
+    )
+    # 3 shards of the first packing, 2 of the second
+    assert 'shard-00002.npy' not in names
+    np.testing.assert_allclose(_load_all(directory), arrs, atol=1e-3)
@@ -0,0 +1,88 @@
+import json
+from types import SimpleNamespace
+
+import pytest
+import torch
+
+from src.constants import LOADER_CONFIG_KEYS
+from src.dataloaders import tuning
+from src.dataloaders.tuning import tune_data_loader
+
+NUM_CLIPS = 2
+
+
+class _Clock:
+    """Time that only moves when a batch is loaded."""
+
+    def __init__(self):
+        self.now = 0.
+
+    def time(self):
+        return self.now
+
+
+class _Loader:
+    """Deliver batches at a rate that peaks at 4 workers, a prefetch factor of
+    4 and 256 rows per batch."""
+
+    def __init__(self, clock):
+        self.clock = clock
+        self.for_train = False
+        self.dataset = SimpleNamespace(num_clips=NUM_CLIPS)
+        self.num_workers, self.prefetch_factor, self.batch_size = 8, 2, 32
+        self.measured = []
+        self.configured = None
+
+    def build_data_loader(
+            self, num_workers, prefetch_factor, batch_size, persistent=True
+    ):
+        assert not persistent
+        num_rows = batch_size * NUM_CLIPS
+        self.measured.append((num_workers, prefetch_factor, num_rows))
+        rows_per_second = 1000. - 10 * abs(num_workers - 4) \
+            - 10 * abs(prefetch_factor - 4) - abs(num_rows - 256) / 10
+        while True:
+            self.clock.now += num_rows / rows_per_second
+            yield {'clip': torch.zeros(num_rows, 1)}
+
+    def configure(self, num_workers, prefetch_factor, batch_size):
+        self.configured = (num_workers, prefetch_factor, batch_size)
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = _Clock()
+    monkeypatch.setattr(tuning, 'time', clock)
+    return clock
+
+
+def test_settings_tuned_one_after_another(tmp_path, clock):
+    loader = _Loader(clock)
+    config_path = str(tmp_path / 'loader_config.json')
+    best = tune_data_loader(loader, config_path, seconds=1.)
+
+    assert [setting[0] for setting in loader.measured[:6]] == \
+        [1, 2, 4, 8, 16, 32]
+    # the best number of workers is kept for the next settings
+    assert loader.measured[6:] == [
+        (4, 2, 64), (4, 4, 64), (4, 8, 64),
+        (4, 4, 64), (4, 4, 128), (4, 4, 256), (4, 4, 512), (4, 4, 1024),
+    ]
+    assert {key: best[key] for key in LOADER_CONFIG_KEYS} == \
+        {'num_workers': 4, 'prefetch_factor': 4, 'batch_size': 256}
+    assert best['rows_per_second'] == pytest.approx(1000.)
+    assert loader.configured == (4, 4, 256)
+    with open(config_path) as f:
+        assert json.load(f) == best
+
+
+def test_saved_setting_reused(tmp_path, clock):
+    config_path = str(tmp_path / 'loader_config.json')
+    tune_data_loader(_Loader(clock), config_path, seconds=1.)
+    with open(config_path) as f:
+        saved = json.load(f)
+
+    loader = _Loader(clock)
+    assert tune_data_loader(loader, config_path, seconds=1.) == saved
+    assert loader.measured == []
+    assert loader.configured is None
@@ -0,0 +1,49 @@
+import os
+
+import pandas as pd
+import pytest
+
+from src.constants import DEL_THRESHOLD, INS_THRESHOLD, SNV_THRESHOLD
+from src.utils import write_predictions
+
+
+def _combined_scores(alleles, scores):
+    return pd.DataFrame({
+        'SAMPLE': ['s'] * len(scores),
+        'CHROM': ['chr1'] * len(scores),
+        'POS': [100 * (i + 1) for i in range(len(scores))],
+        'REF': [ref for ref, _ in alleles],
+        'ALT': [alt for _, alt in alleles],
+        'SCORE': scores,
+    })
+
+
+def _calls(out_path, mode):
+    return pd.read_csv(
+        os.path.join(out_path, 's.{}.VariantMedium.tsv'.format(mode)),
+        sep='\t'
+    )
+
+
+@pytest.mark.parametrize('mode', ['somatic_snv', 'germline_snp'])
+def test_snv_calls_use_the_snv_threshold(tmp_path, mode):
+    scores = [SNV_THRESHOLD - 0.005, SNV_THRESHOLD + 0.005, -0.5, 0.9]
+    df = _combined_scores([('A', 'C')] * 4, scores)
+    write_predictions(df, str(tmp_path), mode, call_mode=True)
+
+    assert _calls(tmp_path, mode)['POS'].tolist() == [400, 200]
+
+
+@pytest.mark.parametrize('mode', ['somatic_indel', 'germline_indel'])
+def test_indel_calls_use_the_insertion_and_deletion_thresholds(
+        tmp_path, mode
+):
+    alleles = [('A', 'AT'), ('A', 'AT'), ('AT', 'A'), ('AT', 'A')]
+    scores = [
+        INS_THRESHOLD - 0.01, INS_THRESHOLD + 0.01,
+        DEL_THRESHOLD - 0.01, DEL_THRESHOLD + 0.01,
+    ]
+    df = _combined_scores(alleles, scores)
+    write_predictions(df, str(tmp_path), mode, call_mode=True)
+
+    assert sorted(_calls(tmp_path, mode)['POS'].tolist()) == [200, 400]